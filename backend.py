@@ -1,15 +1,29 @@
-import openai
 import os
+from termAi.checkpoint import load_local_model
 from termAi.models import SimpleChatBot
 from termAi.data_collector import ChatLogger
 
+try:
+    import openai
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+
 # Initialize local AI and logger
 local_bot = SimpleChatBot()
 logger = ChatLogger()
 
+# Trained termAi model, if a checkpoint is configured (memory-mapped weights)
+local_model = load_local_model(os.getenv("TERMAI_CHECKPOINT"), os.getenv("TERMAI_TOKENIZER", "termai_tokenizer.json"))
+
+def local_reply(user_message):
+    """Reply from the trained model when there is one, else SimpleChatBot"""
+    reply = local_model.reply(user_message) if local_model is not None else None
+    return reply or local_bot.think(user_message)
+
 def get_ai_response(user_message, use_api=False):
     try:
-        if use_api and os.getenv("OPENAI_API_KEY"):
+        if use_api and OPENAI_AVAILABLE and os.getenv("OPENAI_API_KEY"):
             client = openai.OpenAI(
                 api_key=os.getenv("OPENAI_API_KEY")
             )
@@ -23,7 +37,7 @@ def get_ai_response(user_message, use_api=False):
             ai_response = response.choices[0].message.content
         else:
             # Use local termAi library
-            ai_response = local_bot.think(user_message)
+            ai_response = local_reply(user_message)
         
         # Log interaction for training
         logger.log_interaction(user_message, ai_response)
@@ -31,6 +45,6 @@ def get_ai_response(user_message, use_api=False):
         
     except Exception as e:
         # Fallback to local AI on any error
-        ai_response = local_bot.think(user_message)
+        ai_response = local_reply(user_message)
         logger.log_interaction(user_message, ai_response)
         return ai_response
\ No newline at end of file
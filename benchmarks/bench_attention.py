@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Attention benchmark for termAi
+Compares the original single-sequence SelfAttention (three np.dot
+projections, whole-matrix softmax) with the batched multi-head one
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from termAi.core import Arena, Tensor, no_grad
+from termAi.models import SelfAttention
+
+
+class LegacySelfAttention:
+    """The implementation SelfAttention replaced, kept as the baseline"""
+    def __init__(self, embed_size):
+        self.W_q = np.random.randn(embed_size, embed_size) * 0.1
+        self.W_k = np.random.randn(embed_size, embed_size) * 0.1
+        self.W_v = np.random.randn(embed_size, embed_size) * 0.1
+
+    def __call__(self, x):
+        Q = np.dot(x, self.W_q)
+        K = np.dot(x, self.W_k)
+        V = np.dot(x, self.W_v)
+        score = np.dot(Q, K.T) / np.sqrt(K.shape[1])
+        exp_data = np.exp(score - np.max(score))
+        weights = exp_data / np.sum(exp_data)
+        return Tensor(np.dot(weights, V))
+
+
+def best_time(fn, repeat):
+    """Best wall time of repeat calls, in milliseconds"""
+    fn()  # Warm up
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run(seq_lens, embed_size, num_heads, batch, repeat):
+    results = []
+    for T in seq_lens:
+        x = np.random.randn(batch, T, embed_size)
+        legacy = LegacySelfAttention(embed_size)
+        batched = SelfAttention(embed_size, num_heads=num_heads)
+        batched.arena = Arena()
+
+        def run_legacy():
+            # The old layer only takes one sequence at a time
+            for b in range(batch):
+                legacy(x[b])
+
+        def run_batched():
+            with no_grad():
+                batched(Tensor(x))
+
+        legacy_ms = best_time(run_legacy, repeat)
+        batched_ms = best_time(run_batched, repeat)
+        results.append({
+            "seq_len": T,
+            "batch": batch,
+            "embed_size": embed_size,
+            "num_heads": num_heads,
+            "legacy_ms": round(legacy_ms, 3),
+            "batched_ms": round(batched_ms, 3),
+            "speedup": round(legacy_ms / batched_ms, 2),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seq-lens", default="16,64,256,512")
+    parser.add_argument("--embed-size", type=int, default=64)
+    parser.add_argument("--heads", type=int, default=1,
+                        help="Heads for the batched layer (legacy is always single-head)")
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = run([int(t) for t in args.seq_lens.split(",")], args.embed_size,
+                  args.heads, args.batch, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'seq_len':>8} {'legacy ms':>10} {'batched ms':>11} {'speedup':>8}")
+        for r in results:
+            print(f"{r['seq_len']:>8} {r['legacy_ms']:>10.3f} {r['batched_ms']:>11.3f} {r['speedup']:>7.2f}x")
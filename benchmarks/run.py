@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark suite for termAi kernels and mqtt_service hot functions
+
+    python benchmarks/run.py                    # run, compare with the baseline
+    python benchmarks/run.py -k attention       # only matching benchmarks
+    python benchmarks/run.py --save-baseline    # store this run as the new baseline
+    python benchmarks/run.py --json out.json    # machine-readable results
+
+Each benchmark reports the median per-call time in microseconds over
+several timed rounds, and the spread between its fastest and slowest round
+as noise. A benchmark counts as a regression, making the run exit with
+status 1, when it is more than --threshold (or its own noise, if larger)
+slower than its baseline and by at least --min-delta microseconds, so
+sub-microsecond functions don't flap on timer jitter. Baselines are
+machine specific: re-save them when the hardware changes.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from termAi.core import Arena, Softmax, Tensor, no_grad
+from termAi.models import Linear, MiniGPT, SelfAttention, SimpleChatBot
+from termAi.utils import extract_keywords, similarity, tokenize
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a setup function returning the callable to time"""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def time_call(fn, rounds=7, min_time=0.1):
+    """Median per-call time (us) over rounds, each running for at least min_time,
+    and the rounds' relative spread ((slowest - fastest) / median)"""
+    fn()  # Warm up caches and arenas
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - start >= min_time:
+            break
+        number *= 2
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        times.append((time.perf_counter() - start) / number)
+    median = float(np.median(times))
+    return median * 1e6, (max(times) - min(times)) / median
+
+
+# --- termAi kernels ---
+
+for rows, cols in [(64, 64), (256, 256)]:
+    @benchmark(f"softmax[{rows}x{cols}]")
+    def _(rows=rows, cols=cols):
+        softmax, x = Softmax(), Tensor(np.random.randn(rows, cols))
+
+        def run():
+            with no_grad():
+                softmax(x)
+        return run
+
+for tokens, size in [(16, 64), (128, 256)]:
+    @benchmark(f"linear[{tokens}x{size}]")
+    def _(tokens=tokens, size=size):
+        layer, x = Linear(size, size), Tensor(np.random.randn(tokens, size))
+        layer.arena = Arena()
+
+        def run():
+            with no_grad():
+                layer(x)
+        return run
+
+for seq_len in [16, 64, 256]:
+    @benchmark(f"attention[T={seq_len}]")
+    def _(seq_len=seq_len):
+        attention, x = SelfAttention(64, num_heads=4), Tensor(np.random.randn(1, seq_len, 64))
+        attention.arena = Arena()
+
+        def run():
+            with no_grad():
+                attention(x)
+        return run
+
+for seq_len in [16, 64, 128]:
+    @benchmark(f"minigpt_forward[T={seq_len}]")
+    def _(seq_len=seq_len):
+        model = MiniGPT(1000, 64, 2, context_length=128, num_heads=4)
+        ids = np.random.randint(0, 1000, size=seq_len)
+
+        def run():
+            with no_grad():
+                model(ids)
+        return run
+
+@benchmark("minigpt_generate[32 tokens]")
+def _():
+    model = MiniGPT(1000, 64, 2, context_length=128, num_heads=4)
+    return lambda: model.generate([1, 2, 3, 4], 32, temperature=0)
+
+@benchmark("chatbot_think")
+def _():
+    bot = SimpleChatBot()
+    return lambda: bot.think("Labas, kaip sekasi šiandien?")
+
+SENTENCE = "Labas! Ar galite padėti sukurti žaidimą su Python ir paaiškinti dirbtinį intelektą?"
+
+@benchmark("utils_tokenize")
+def _():
+    return lambda: tokenize(SENTENCE)
+
+@benchmark("utils_similarity")
+def _():
+    return lambda: similarity(SENTENCE, "Kaip sukurti žaidimą su Python?")
+
+@benchmark("utils_extract_keywords")
+def _():
+    return lambda: extract_keywords(SENTENCE)
+
+
+# --- mqtt_service pure functions ---
+
+def load_service():
+    """Import mqtt_service without its startup banner"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        import mqtt_service
+    return mqtt_service
+
+@benchmark("service_fallback_response")
+def _():
+    service = load_service()
+    messages = [{"role": "system", "content": "..."}, {"role": "user", "content": "user1: labas, kas tu esi?"}]
+    return lambda: service.get_fallback_response(messages)
+
+@benchmark("service_handle_admin[status]")
+def _():
+    service = load_service()
+    command = f"{service.admin_token} status"
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            service.handle_admin(command)
+    return run
+
+@benchmark("service_match_navigation")
+def _():
+    service = load_service()
+    return lambda: service.match_navigation("gal galim nueiti į laboratorija?")
+
+@benchmark("presence_touch[10k users, 5k cap]")
+def _():
+    from presence import PresenceStore
+    store = PresenceStore(max_users=5000)
+    user_ids = [f"Anon{i}" for i in range(10000)]
+    calls = iter(range(1 << 62))
+    return lambda: store.touch(user_ids[next(calls) % 10000], time.time())
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+        self.properties = None
+
+for fmt in ["json", "msgpack"]:
+    @benchmark(f"service_parse_payload[{fmt}]")
+    def _(fmt=fmt):
+        import wire_format
+        data = {"id": "user42", "msg": SENTENCE, "ref": "abc-1", "timestamp": 1760000000000}
+        message = FakeMessage(wire_format.topic_for("termchat/input", fmt), wire_format.encode(data, fmt))
+
+        def run():
+            _, wire = wire_format.detect_format(message)
+            wire_format.decode(message.payload, wire)
+        return run
+
+
+# --- Runner ---
+
+def run(pattern=None, rounds=7):
+    """Returns ({name: median us}, {name: relative noise})"""
+    results, noise = {}, {}
+    for name, setup in BENCHMARKS.items():
+        if pattern and pattern not in name:
+            continue
+        np.random.seed(0)
+        median, spread = time_call(setup(), rounds=rounds)
+        results[name], noise[name] = round(median, 3), round(spread, 3)
+        print(f"{name:<36} {results[name]:>12.2f} us  ±{spread * 100:.0f}%")
+    return results, noise
+
+
+def compare(results, baseline, threshold, noise=None, min_delta=0.0):
+    """Print changes against the baseline; returns the regressed names
+
+    A benchmark regresses when it slowed by more than threshold or its
+    noise, whichever is larger, and by at least min_delta us.
+    """
+    noise = noise or {}
+    regressions = []
+    print(f"\n{'benchmark':<36} {'baseline us':>12} {'now us':>12} {'change':>9}")
+    for name, now in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<36} {'-':>12} {now:>12.2f} {'new':>9}")
+            continue
+        change = (now - before) / before
+        flag = ""
+        if change > max(threshold, noise.get(name, 0)) and now - before >= min_delta:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<36} {before:>12.2f} {now:>12.2f} {change * 100:>+8.1f}%{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the termAi / mqtt_service micro-benchmarks")
+    parser.add_argument("-k", dest="pattern", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown (0.25 = 25%%)")
+    parser.add_argument("--min-delta", type=float, default=1.0,
+                        help="Smallest slowdown in us that can count as a regression")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    results, noise = run(args.pattern, args.rounds)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "unit": "us",
+        "results": results,
+        "noise": noise,
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        baseline, baseline_noise = {}, {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                saved = json.load(f)
+            baseline, baseline_noise = saved["results"], saved.get("noise", {})
+        baseline.update(results)
+        baseline_noise.update(noise)
+        report["results"], report["noise"] = baseline, baseline_noise
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        # Noisy in either run means a change of that size proves nothing
+        for name, spread in saved.get("noise", {}).items():
+            if name in noise:
+                noise[name] = max(noise[name], spread)
+        regressions = compare(results, saved["results"], args.threshold, noise, args.min_delta)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold * 100:.0f}%")
+            sys.exit(1)
@@ -0,0 +1,89 @@
+"""Shared pytest fixtures
+
+Living at the repository root, this also puts the root on sys.path so the
+flat modules (mqtt_service, backend, ...) import from tests/.
+
+mqtt_broker is an in-process EmbeddedBroker on a free port, so the MQTT
+tests never need an external broker; termchat_service runs
+mqtt_service.py against it with the stub AI provider. start_service runs
+services on a per-test private_broker instead.
+"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+import pytest
+
+from mqtt_broker import EmbeddedBroker
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def mqtt_broker():
+    with EmbeddedBroker("127.0.0.1", 0) as broker:
+        yield broker
+
+
+@contextmanager
+def service_process(broker, cwd, **env):
+    """Run mqtt_service.py against broker for the block; yields its admin token"""
+    env = dict(os.environ, AI_PROVIDER="stub", AI_STUB_LATENCY_MS="5", AI_STUB_JITTER_MS="0",
+               MQTT_HOST=broker.host, MQTT_PORT=str(broker.port), PORT=str(free_port()),
+               MQTT_EMBEDDED_BROKER="0", SERVICE_WORKERS="1", STATE_SNAPSHOT_FILE="",
+               PYTHONUNBUFFERED="1", **env)
+    service = subprocess.Popen([sys.executable, os.path.join(ROOT, "mqtt_service.py")], env=env, cwd=cwd,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    ready = threading.Event()
+    token = []
+
+    def watch():
+        for line in service.stdout:
+            if line.startswith("[SECURITY] ADMIN TOKEN: "):
+                token.append(line.split()[-1])
+            elif line.startswith("[MQTT] Connected. Code: Success"):
+                ready.set()
+
+    threading.Thread(target=watch, daemon=True).start()
+    try:
+        if not ready.wait(30):
+            pytest.fail("mqtt_service.py did not connect to the embedded broker")
+        time.sleep(0.2)  # Let the SUBACK arrive
+        yield token[0]
+    finally:
+        service.terminate()
+        try:
+            service.wait(15)
+        except subprocess.TimeoutExpired:
+            service.kill()
+
+
+@pytest.fixture(scope="session")
+def termchat_service(mqtt_broker, tmp_path_factory):
+    """(host, port) of the broker with mqtt_service.py connected and subscribed"""
+    with service_process(mqtt_broker, tmp_path_factory.mktemp("service")):
+        yield mqtt_broker.host, mqtt_broker.port
+
+
+@pytest.fixture
+def private_broker():
+    """A broker of the test's own, out of sight of the session's termchat_service"""
+    with EmbeddedBroker("127.0.0.1", 0) as broker:
+        yield broker
+
+
+@pytest.fixture
+def start_service(private_broker, tmp_path):
+    """start_service(**env) runs mqtt_service.py on private_broker until the test ends; returns its admin token"""
+    with ExitStack() as stack:
+        yield lambda **env: stack.enter_context(service_process(private_broker, tmp_path, **env))
@@ -0,0 +1,290 @@
+"""On-demand diagnostics for a running TermChat service
+
+Used by the admin commands in mqtt_service.py, so a hot or leaking
+process can be inspected without restarting it:
+
+- SamplingProfiler: samples every thread's stack from a background
+  thread for N seconds. Where the OS exposes per-thread CPU clocks a
+  thread is only counted when it was on the CPU for at least half the
+  time since the previous sample, so threads blocked in select(), a
+  lock or sleep() don't drown out the hot path.
+  Stacks are written in the collapsed ("folded") format that
+  flamegraph.pl and speedscope read.
+- HeapTracker: tracemalloc snapshots dumped to disk, top allocators and
+  the diff between the last two snapshots.
+- structure_sizes: item counts and approximate deep size of named
+  in-memory structures.
+
+Reports go to DIAG_DIR; every call returns a short text summary.
+"""
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+DIAG_DIR = os.getenv("DIAG_DIR", "diagnostics")
+DIAG_SAMPLE_INTERVAL_MS = float(os.getenv("DIAG_SAMPLE_INTERVAL_MS", 5))
+DIAG_TRACEMALLOC_FRAMES = int(os.getenv("DIAG_TRACEMALLOC_FRAMES", 1))
+
+# Per-thread CPU clocks let the profiler skip idle threads (Linux, most Unixes)
+CPU_CLOCKS_AVAILABLE = hasattr(time, "pthread_getcpuclockid")
+
+
+def report_path(kind, extension):
+    os.makedirs(DIAG_DIR, exist_ok=True)
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f".{int(now * 1000) % 1000:03d}"
+    return os.path.join(DIAG_DIR, f"{kind}-{stamp}.{extension}")
+
+
+def format_bytes(size):
+    for unit in ("B", "KB", "MB"):
+        if abs(size) < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}GB"
+
+
+def signed_bytes(size):
+    return ("+" if size >= 0 else "-") + format_bytes(abs(size))
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    def __init__(self, interval=DIAG_SAMPLE_INTERVAL_MS / 1000, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks = Counter()  # (thread name, code objects root first) -> samples
+        self.samples = 0
+        self.started = None
+        self.duration = 0.0
+        self.on_done = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, seconds, on_done=None):
+        """Profile for seconds; on_done(summary) is called with the result"""
+        with self._lock:
+            if self._thread is not None:
+                return f"Profiler already running ({time.monotonic() - self.started:.0f}s elapsed)"
+            self.stacks = Counter()
+            self.samples = 0
+            self.on_done = on_done
+            self.started = time.monotonic()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(seconds,),
+                                            name="diag-profiler", daemon=True)
+            self._thread.start()
+        mode = "CPU" if CPU_CLOCKS_AVAILABLE else "wall-clock"
+        return f"Profiling ({mode}) for {seconds:.0f}s every {self.interval * 1000:.0f}ms"
+
+    def stop(self):
+        """Stop early; the report is delivered through on_done as usual"""
+        with self._lock:
+            thread = self._thread
+        if thread is None:
+            return "Profiler is not running"
+        self._stop.set()
+        thread.join()
+        return "Profiler stopped"
+
+    def _run(self, seconds):
+        me = threading.get_ident()
+        names = {}
+        cpu_clocks = {}
+        last_cpu = {}
+        deadline = self.started + seconds
+        last_sample = time.monotonic()
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            now = time.monotonic()
+            elapsed, last_sample = now - last_sample, now
+            frames = sys._current_frames()
+            self.samples += 1
+            for ident, frame in frames.items():
+                if ident == me or not self._busy(ident, elapsed, cpu_clocks, last_cpu):
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(frame.f_code)
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                stack.reverse()
+                self.stacks[(names.get(ident, str(ident)), tuple(stack))] += 1
+            del frames
+        self.duration = time.monotonic() - self.started
+        summary = self._report()
+        with self._lock:
+            self._thread = None
+        print(f"[DIAG] {summary}")
+        if self.on_done:
+            try:
+                self.on_done(summary)
+            except Exception as e:
+                print(f"[DIAG] Could not deliver profile summary: {e}")
+
+    def _busy(self, ident, elapsed, cpu_clocks, last_cpu):
+        """Whether a thread mostly ran since the previous sample (always True without CPU clocks)"""
+        if not CPU_CLOCKS_AVAILABLE:
+            return True
+        try:
+            if ident not in cpu_clocks:
+                cpu_clocks[ident] = time.pthread_getcpuclockid(ident)
+            cpu = time.clock_gettime(cpu_clocks[ident])
+        except (OSError, OverflowError):
+            return False  # Thread exited between sampling and now
+        used = cpu - last_cpu.get(ident, cpu)
+        last_cpu[ident] = cpu
+        return used >= elapsed / 2
+
+    def _report(self):
+        path = report_path("profile", "folded")
+        self_counts = Counter()
+        with open(path, "w", encoding="utf-8") as f:
+            for (thread, stack), count in self.stacks.most_common():
+                labels = [_frame_label(code) for code in stack]
+                f.write(";".join([thread] + labels) + f" {count}\n")
+                if labels:
+                    self_counts[labels[-1]] += count
+        busy = sum(self.stacks.values())
+        if not busy:
+            return f"Profile {self.duration:.1f}s, {self.samples} samples, no busy threads -> {path}"
+        top = ", ".join(f"{label} {count / busy * 100:.0f}%" for label, count in self_counts.most_common(5))
+        return f"Profile {self.duration:.1f}s, {busy} busy samples -> {path}. Top self: {top}"
+
+
+class HeapTracker:
+    FILTERS = (
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        tracemalloc.Filter(False, "<unknown>"),
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    )
+
+    def __init__(self, frames=DIAG_TRACEMALLOC_FRAMES):
+        self.frames = frames
+        self.snapshots = []  # The last two (path, snapshot)
+        self._lock = threading.Lock()  # Commands run on executor threads and may overlap
+
+    def snapshot(self, limit=5):
+        """Take a snapshot, dump it to disk and summarise the top allocators"""
+        with self._lock:
+            return self._snapshot(limit)
+
+    def _snapshot(self, limit):
+        started = not tracemalloc.is_tracing()
+        if started:
+            # Only allocations made from now on are seen, so this first
+            # snapshot is just the baseline for the next diff
+            tracemalloc.start(self.frames)
+        snapshot = tracemalloc.take_snapshot().filter_traces(self.FILTERS)
+        path = report_path("heap", "snapshot")
+        snapshot.dump(path)
+        self.snapshots = (self.snapshots + [(path, snapshot)])[-2:]
+
+        stats = snapshot.statistics("lineno")
+        self._write_stats(path + ".txt", stats)
+        if started:
+            return f"tracemalloc started, baseline -> {path}; snapshot again later and diff"
+        current, peak = tracemalloc.get_traced_memory()
+        top = ", ".join(f"{self._where(stat)} {format_bytes(stat.size)}" for stat in stats[:limit])
+        return f"Heap traced {format_bytes(current)} (peak {format_bytes(peak)}) -> {path}. Top: {top}"
+
+    def diff(self, limit=5):
+        """Growth between the last two snapshots"""
+        with self._lock:
+            if len(self.snapshots) < 2:
+                return "Need two heap snapshots to diff"
+            (_, old), (new_path, new) = self.snapshots
+        stats = new.compare_to(old, "lineno")
+        path = new_path + ".diff.txt"
+        self._write_stats(path, stats)
+        total = sum(stat.size_diff for stat in stats)
+        top = ", ".join(f"{self._where(stat)} {signed_bytes(stat.size_diff)} ({stat.count_diff:+d} blocks)"
+                        for stat in stats[:limit])
+        return f"Heap change {signed_bytes(total)} -> {path}. Top: {top}"
+
+    def stop(self):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return "tracemalloc is not running"
+            tracemalloc.stop()
+            self.snapshots = []
+            return "tracemalloc stopped"
+
+    @staticmethod
+    def _where(stat):
+        frame = stat.traceback[0]
+        return f"{os.path.basename(frame.filename)}:{frame.lineno}"
+
+    @staticmethod
+    def _write_stats(path, stats):
+        with open(path, "w", encoding="utf-8") as f:
+            for stat in stats:
+                f.write(f"{stat}\n")
+
+
+def deep_sizeof(obj, max_objects=1_000_000):
+    """Approximate bytes held by obj and everything it references
+
+    Follows containers, instance __dict__s and gc referents; classes,
+    modules and functions are not followed. Shared objects count once.
+    Each container is copied onto the stack in one C call, so this can run
+    on a worker thread while the event loop keeps mutating the structures.
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack and len(seen) < max_objects:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, (type, type(sys), type(deep_sizeof))):
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif not isinstance(item, (str, bytes, int, float)):
+            stack.extend(gc.get_referents(item))
+    return size
+
+
+def structure_sizes(structures):
+    """Write the item count and deep size of named structures to disk; returns a summary"""
+    sizes = {}
+    for name, obj in structures.items():
+        try:
+            items = len(obj)
+        except TypeError:
+            items = None
+        sizes[name] = {"items": items, "bytes": deep_sizeof(obj)}
+    path = report_path("memory", "json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"rss_bytes": rss_bytes(), "structures": sizes}, f, indent=2)
+    ordered = sorted(sizes.items(), key=lambda kv: -kv[1]["bytes"])
+    listing = ", ".join(f"{name} {format_bytes(s['bytes'])}" + (f" ({s['items']})" if s["items"] is not None else "")
+                        for name, s in ordered)
+    return f"RSS {format_bytes(rss_bytes())} -> {path}. {listing}"
+
+
+def rss_bytes():
+    """Resident set size of this process (0 where /proc is missing)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Load Test for TermChat LT
+Drives many simulated clients against a local broker and reports
+throughput, end-to-end latency percentiles, drops and server CPU/RSS.
+
+Run the service against a local broker with the stub AI provider first:
+
+    AI_PROVIDER=stub MQTT_HOST=localhost python mqtt_service.py
+    python load_test.py --clients 200 --rate 100 --duration 30 --server-pid <pid>
+
+Every request carries a "ref" that the service echoes in its reply, so
+replies are matched to requests even though they share termchat/output.
+
+With --rooms N the clients are spread over N rooms and send on
+termchat/room/<room>/input; observer i reads only its room's output
+topic, and the report shows how many messages each observer had to
+receive (run the service with MQTT_GLOBAL_OUTPUT=0 to see the saving).
+"""
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import wire_format
+from test_ai import TEST_MESSAGES
+
+# Test configuration (defaults to a local broker, never the public one)
+BROKER = os.getenv("MQTT_HOST", "localhost")
+PORT = int(os.getenv("MQTT_PORT", 1883))
+INPUT_TOPIC = "termchat/input"
+ADMIN_TOPIC = "termchat/admin"
+OUTPUT_TOPIC = "termchat/output"
+ROOMS = ["living_room", "library", "studio", "workshop", "lounge", "think_tank"]
+
+NAVIGATION_MESSAGES = ["einu į biblioteka", "studija", "eiti į dirbtuvės", "poilsio kambarys", "laboratorija"]
+DEFAULT_MIX = "ai=0.5,nav=0.2,ping=0.25,admin=0.05"
+
+# The service ignores a user's messages sent less than a second apart
+USER_COOLDOWN = 1.0
+
+
+def parse_mix(spec):
+    """Parse "ai=0.5,nav=0.2" into ([kinds], [weights])"""
+    kinds, weights = [], []
+    for item in spec.split(","):
+        kind, weight = item.split("=")
+        if kind not in ("ai", "nav", "ping", "admin"):
+            raise ValueError(f"Unknown message kind: {kind}")
+        kinds.append(kind)
+        weights.append(float(weight))
+    return kinds, weights
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class ProcessSampler:
+    """Samples CPU% and RSS of a process from /proc once a second"""
+    def __init__(self, pid, interval=1.0):
+        self.pid = pid
+        self.interval = interval
+        self.cpu = []
+        self.rss_mb = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._ticks = os.sysconf("SC_CLK_TCK")
+
+    def _cpu_ticks(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        return int(fields[11]) + int(fields[12])  # utime + stime
+
+    def _rss(self):
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    def _run(self):
+        last_ticks, last_time = self._cpu_ticks(), time.monotonic()
+        while not self._stop.wait(self.interval):
+            try:
+                ticks, now = self._cpu_ticks(), time.monotonic()
+                self.cpu.append((ticks - last_ticks) / self._ticks / (now - last_time) * 100)
+                self.rss_mb.append(self._rss())
+                last_ticks, last_time = ticks, now
+            except (FileNotFoundError, ProcessLookupError):
+                print(f"⚠️  Server process {self.pid} is gone")
+                return
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def report(self):
+        if not self.cpu:
+            return {}
+        return {
+            "cpu_avg_pct": round(sum(self.cpu) / len(self.cpu), 1),
+            "cpu_max_pct": round(max(self.cpu), 1),
+            "rss_max_mb": round(max(self.rss_mb), 1),
+        }
+
+
+class LoadTester:
+    def __init__(self, args):
+        self.args = args
+        self.wire = wire_format.MSGPACK if args.wire == "msgpack" else wire_format.JSON
+        self.kinds, self.weights = parse_mix(args.mix)
+        self.pending = {}   # ref -> (send time, kind)
+        self.latencies = {kind: [] for kind in self.kinds}
+        self.sent = {kind: 0 for kind in self.kinds}
+        self.unmatched = 0
+        self.received = 0  # Every message the observers were sent, matched or not
+        self.rooms = ROOMS[:args.rooms]
+        self.lock = threading.Lock()
+        self.run_id = f"{random.randrange(16 ** 6):06x}"
+        self.senders = []
+        self.observers = []
+
+    def connect(self, client_id, topics=()):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+        connected = threading.Event()
+
+        def on_connect(client, userdata, flags, rc, properties=None):
+            for topic in topics:
+                client.subscribe(wire_format.topic_for(topic, self.wire))
+            connected.set()
+
+        client.on_connect = on_connect
+        if topics:
+            client.on_message = self.on_message
+        client.connect(self.args.host, self.args.port, 60)
+        client.loop_start()
+        if not connected.wait(10):
+            raise RuntimeError(f"{client_id} could not connect to {self.args.host}:{self.args.port}")
+        return client
+
+    def on_message(self, client, userdata, message, properties=None):
+        received = time.monotonic()
+        try:
+            data = wire_format.decode(message.payload, self.wire)
+        except Exception:
+            return
+        ref = data.get("ref") if isinstance(data, dict) else None
+        with self.lock:
+            self.received += 1
+            if not ref or not ref.startswith(self.run_id):
+                return
+            entry = self.pending.pop(ref, None)
+            if entry is None:
+                self.unmatched += 1  # Late duplicate, or the reply to an expired request
+                return
+            sent_at, kind = entry
+            self.latencies[kind].append((received - sent_at) * 1000)
+
+    def observer_topics(self, index):
+        """Output topics observer index reads: one room's with --rooms, else the global one"""
+        if not self.rooms:
+            return [OUTPUT_TOPIC]
+        topics = [f"termchat/room/{self.rooms[index % len(self.rooms)]}/output"]
+        if "admin" in self.kinds:
+            topics.append(OUTPUT_TOPIC)  # Admin replies aren't room traffic
+        return topics
+
+    def message_for(self, kind, user_id, ref, room=None):
+        if kind == "ai":
+            text = random.choice(TEST_MESSAGES)
+        elif kind == "nav":
+            text = random.choice(NAVIGATION_MESSAGES)
+        elif kind == "ping":
+            text = "test ping"
+        else:
+            text = f"{self.args.admin_token} status"
+        if kind == "admin":
+            topic = ADMIN_TOPIC
+        else:
+            topic = f"termchat/room/{room}/input" if room else INPUT_TOPIC
+        payload = {"id": user_id, "msg": text, "ref": ref, "timestamp": int(time.time() * 1000)}
+        return wire_format.topic_for(topic, self.wire), wire_format.encode(payload, self.wire)
+
+    def run(self):
+        args = self.args
+        observers = max(args.observers, len(self.rooms))  # At least one per room
+        print(f"🚀 Connecting {args.clients} clients and {observers} observers to {args.host}:{args.port}...")
+        for i in range(observers):
+            self.observers.append(self.connect(f"loadtest-{self.run_id}-obs{i}", self.observer_topics(i)))
+        for i in range(args.clients):
+            self.senders.append(self.connect(f"loadtest-{self.run_id}-{i}"))
+
+        per_client = args.rate / args.clients
+        if per_client > 1 / USER_COOLDOWN:
+            print(f"⚠️  {per_client:.2f} msg/s per client exceeds the service's rate limit; "
+                  f"expect drops (use more --clients)")
+
+        sampler = ProcessSampler(args.server_pid) if args.server_pid else None
+        if sampler:
+            sampler.start()
+
+        print(f"📤 Sending {args.rate} msg/s for {args.duration}s ({args.mix})")
+        start = time.monotonic()
+        interval = 1.0 / args.rate
+        seq = 0
+        while True:
+            # Fixed schedule, so a slow publish doesn't lower the offered load
+            due = start + seq * interval
+            now = time.monotonic()
+            if due - start >= args.duration:
+                break
+            if due > now:
+                time.sleep(due - now)
+            index = seq % args.clients
+            kind = random.choices(self.kinds, self.weights)[0]
+            ref = f"{self.run_id}-{seq}"
+            room = self.rooms[index % len(self.rooms)] if self.rooms else None
+            topic, payload = self.message_for(kind, f"load{self.run_id}{index}", ref, room)
+            with self.lock:
+                self.pending[ref] = (time.monotonic(), kind)
+                self.sent[kind] += 1
+            self.senders[index].publish(topic, payload)
+            seq += 1
+        elapsed = time.monotonic() - start
+
+        # Give the last replies time to arrive; whatever is left was dropped
+        deadline = time.monotonic() + args.timeout
+        while self.pending and time.monotonic() < deadline:
+            time.sleep(0.1)
+        if sampler:
+            sampler.stop()
+
+        for client in self.senders + self.observers:
+            client.loop_stop()
+            client.disconnect()
+        return self.report(elapsed, sampler)
+
+    def report(self, elapsed, sampler):
+        with self.lock:
+            all_latencies = sorted(l for values in self.latencies.values() for l in values)
+            total_sent = sum(self.sent.values())
+            result = {
+                "sent": total_sent,
+                "replies": len(all_latencies),
+                "dropped": len(self.pending),
+                "drop_rate": round(len(self.pending) / total_sent, 4) if total_sent else 0.0,
+                "late_or_duplicate": self.unmatched,
+                "received_per_observer": round(self.received / len(self.observers), 1) if self.observers else 0.0,
+                "send_rate": round(total_sent / elapsed, 1),
+                "throughput": round(len(all_latencies) / elapsed, 1),
+                "latency_ms": self.summarize(all_latencies),
+                "by_kind": {kind: dict(sent=self.sent[kind], **self.summarize(sorted(self.latencies[kind])))
+                            for kind in self.kinds},
+            }
+        if sampler:
+            result["server"] = sampler.report()
+        return result
+
+    @staticmethod
+    def summarize(values):
+        return {
+            "p50": round(percentile(values, 50), 1),
+            "p95": round(percentile(values, 95), 1),
+            "p99": round(percentile(values, 99), 1),
+            "max": round(values[-1], 1) if values else 0.0,
+        }
+
+
+def print_report(result):
+    print("\n" + "=" * 50)
+    print("📊 LOAD TEST RESULTS")
+    print("=" * 50)
+    print(f"Sent: {result['sent']} ({result['send_rate']} msg/s)")
+    print(f"Replies: {result['replies']} ({result['throughput']} msg/s)")
+    print(f"Dropped: {result['dropped']} ({result['drop_rate'] * 100:.2f}%)")
+    print(f"Received per observer: {result['received_per_observer']}")
+    lat = result["latency_ms"]
+    print(f"Latency ms: p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+    for kind, stats in result["by_kind"].items():
+        print(f"  {kind:<6} sent {stats['sent']:>6}  p50 {stats['p50']:>8}  p95 {stats['p95']:>8}  "
+              f"p99 {stats['p99']:>8}  max {stats['max']:>8}")
+    if result.get("server"):
+        server = result["server"]
+        print(f"Server: CPU avg {server['cpu_avg_pct']}% max {server['cpu_max_pct']}%, "
+              f"RSS max {server['rss_max_mb']} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the TermChat MQTT service")
+    parser.add_argument("--host", default=BROKER)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--clients", type=int, default=100, help="Simulated users, one connection each")
+    parser.add_argument("--observers", type=int, default=1, help="Connections that read termchat/output")
+    parser.add_argument("--rooms", type=int, default=0, choices=range(len(ROOMS) + 1),
+                        help="Spread clients over this many rooms and use the per-room topics")
+    parser.add_argument("--rate", type=float, default=50, help="Messages per second across all clients")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to send for")
+    parser.add_argument("--timeout", type=float, default=10, help="Seconds to wait for the last replies")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Message kinds and weights")
+    parser.add_argument("--admin-token", default="", help="Token printed by the service at startup")
+    parser.add_argument("--wire", choices=["json", "msgpack"], default="json")
+    parser.add_argument("--server-pid", type=int, help="Sample this process's CPU and RSS")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    result = LoadTester(args).run()
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
@@ -0,0 +1,116 @@
+"""Run a paho MQTT client on an asyncio event loop
+
+Instead of paho's own network thread (loop_start/loop_forever), the
+client's socket is registered with the event loop: reads and writes are
+driven by add_reader/add_writer and the keep-alive housekeeping by a
+task, so every paho callback runs on the loop thread alongside the rest
+of the service. Lost connections are re-established with the given
+backoff.
+
+Connecting is the exception: paho resolves the host and opens the TCP
+connection synchronously (up to its connect timeout against a blackholed
+broker), so connect() and reconnect() run on an executor thread and the
+socket hooks they trigger are handed back to the loop.
+"""
+import asyncio
+import socket
+import threading
+from functools import partial
+
+import paho.mqtt.client as mqtt
+
+
+class AsyncioMQTT:
+    def __init__(self, client, backoff, loop=None):
+        self.client = client
+        self.backoff = backoff
+        self.loop = loop or asyncio.get_running_loop()
+        self.closing = False
+        self._misc = None
+        self._reconnect = None
+        self._loop_thread = threading.get_ident()
+        client.on_socket_open = self._on_loop(self._on_socket_open)
+        client.on_socket_close = self._on_loop(self._on_socket_close)
+        client.on_socket_register_write = self._on_loop(self._on_socket_register_write)
+        client.on_socket_unregister_write = self._on_loop(self._on_socket_unregister_write)
+
+    def _on_loop(self, hook):
+        """Wrap a socket hook so it runs on the loop thread, whichever thread paho calls it from"""
+        def call(*args):
+            if threading.get_ident() == self._loop_thread:
+                hook(*args)
+            else:
+                self.loop.call_soon_threadsafe(hook, *args)
+        return call
+
+    def _on_socket_open(self, client, userdata, sock):
+        if self.closing:
+            client.disconnect()  # A connect that finished after disconnect() started
+            return
+        self.loop.add_reader(sock, client.loop_read)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 2048 * 1024)
+        self._misc = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self._misc:
+            self._misc.cancel()
+            self._misc = None
+        self.schedule_reconnect()
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self.loop.add_writer(sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.remove_writer(sock)
+
+    async def _misc_loop(self):
+        """Keep-alive pings and retries, once a second like paho's own loop"""
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def connect(self, host, port, keepalive=60, **kwargs):
+        """Connect in the background, retrying with backoff while the broker is unreachable"""
+        self._reconnect = self.loop.create_task(
+            self._connect(partial(self.client.connect, host, port, keepalive, **kwargs)))
+
+    async def _connect(self, connect):
+        try:
+            # DNS and the TCP connect block; the MQTT handshake then happens on the loop
+            await self.loop.run_in_executor(None, connect)
+            print("[MQTT] Connected to broker")
+            return
+        except Exception as e:
+            print(f"[ERROR] MQTT connection failed: {e}. Will retry...")
+        await self._reconnect_loop()
+
+    def schedule_reconnect(self):
+        if self.closing or (self._reconnect and not self._reconnect.done()):
+            return
+        self._reconnect = self.loop.create_task(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        while not self.closing and not self.client.is_connected():
+            delay = self.backoff.next_delay()
+            print(f"[MQTT] Connection lost. Reconnecting in {delay:.1f}s...")
+            await asyncio.sleep(delay)
+            if self.closing:
+                return
+            try:
+                await self.loop.run_in_executor(None, self.client.reconnect)
+                return  # on_connect resets the backoff once the broker accepts us
+            except Exception as e:
+                print(f"[MQTT] Reconnect failed: {e}")
+
+    async def disconnect(self, timeout=2):
+        """Send DISCONNECT and wait for the socket to close"""
+        self.closing = True
+        if self._reconnect:
+            self._reconnect.cancel()
+        if self.client.socket() is None:
+            return
+        self.client.disconnect()
+        deadline = self.loop.time() + timeout
+        while self.client.socket() is not None and self.loop.time() < deadline:
+            await asyncio.sleep(0.05)
@@ -0,0 +1,773 @@
+#!/usr/bin/env python3
+"""
+Embedded MQTT broker for TermChat tests and local benchmarks
+
+A small asyncio broker, so the service, the test scripts and the load
+tools can run offline against a broker that behaves the same every run:
+
+    python mqtt_broker.py --port 1883          # standalone
+    MQTT_EMBEDDED_BROKER=1 python mqtt_service.py
+
+    with EmbeddedBroker(port=0) as broker:     # in a test fixture
+        client.connect("127.0.0.1", broker.port)
+
+Supports MQTT 3.1, 3.1.1 and 5: QoS 0 and 1 (QoS 2 publishes are
+accepted and delivered as QoS 1), + and # wildcards, retained messages,
+$share/<group>/<filter> shared subscriptions (round robin over the
+group's connected members), wills, keep-alive, and persistent sessions
+that queue QoS 1 messages while the client is away. No authentication,
+TLS or websockets: it binds to 127.0.0.1 unless told otherwise.
+
+Subscriptions live in a topic trie, so routing a message costs one walk
+down its topic levels, not a match against every subscription.
+"""
+
+import argparse
+import asyncio
+import itertools
+import os
+import struct
+import threading
+from collections import OrderedDict, deque
+
+BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "127.0.0.1")
+BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", 1883))
+
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP, SUBSCRIBE, SUBACK, \
+    UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT, AUTH = range(1, 16)
+
+PROTOCOL_NAMES = {3: b"MQIsdp", 4: b"MQTT", 5: b"MQTT"}
+
+# MQTT 5 property id -> value type
+PROPERTY_TYPES = {
+    0x01: "byte", 0x02: "u32", 0x03: "str", 0x08: "str", 0x09: "bin", 0x0B: "varint",
+    0x11: "u32", 0x12: "str", 0x13: "u16", 0x15: "str", 0x16: "bin", 0x17: "byte",
+    0x18: "u32", 0x19: "byte", 0x1A: "str", 0x1C: "str", 0x1F: "str", 0x21: "u16",
+    0x22: "u16", 0x23: "u16", 0x24: "byte", 0x25: "byte", 0x26: "pair", 0x27: "u32",
+    0x28: "byte", 0x29: "byte", 0x2A: "byte",
+}
+SUBSCRIPTION_IDENTIFIER = 0x0B
+SESSION_EXPIRY_INTERVAL = 0x11
+ASSIGNED_CLIENT_IDENTIFIER = 0x12
+TOPIC_ALIAS = 0x23
+MAXIMUM_QOS = 0x24
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        value, byte = divmod(value, 128)
+        out.append(byte | (0x80 if value else 0))
+        if not value:
+            return bytes(out)
+
+
+def encode_string(value):
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    return struct.pack("!H", len(value)) + value
+
+
+def encode_properties(properties):
+    """properties: [(property id, encoded value)]"""
+    body = b"".join(encode_varint(pid) + raw for pid, raw in properties)
+    return encode_varint(len(body)) + body
+
+
+def packet(packet_type, flags, body):
+    return bytes([packet_type << 4 | flags]) + encode_varint(len(body)) + body
+
+
+class Reader:
+    """Cursor over the variable header and payload of one packet"""
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def remaining(self):
+        return len(self.data) - self.pos
+
+    def take(self, n):
+        if self.pos + n > len(self.data):
+            raise ProtocolError("Packet too short")
+        chunk = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return chunk
+
+    def byte(self):
+        return self.take(1)[0]
+
+    def u16(self):
+        return struct.unpack("!H", self.take(2))[0]
+
+    def u32(self):
+        return struct.unpack("!I", self.take(4))[0]
+
+    def varint(self):
+        value, shift = 0, 0
+        for _ in range(4):
+            byte = self.byte()
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+        raise ProtocolError("Malformed variable byte integer")
+
+    def binary(self):
+        return self.take(self.u16())
+
+    def string(self):
+        try:
+            return self.binary().decode("utf-8")
+        except UnicodeDecodeError:
+            raise ProtocolError("Invalid UTF-8 string")
+
+    def properties(self):
+        """[(property id, encoded value)] of an MQTT 5 property block"""
+        end = self.varint() + self.pos
+        properties = []
+        while self.pos < end:
+            pid = self.varint()
+            kind = PROPERTY_TYPES.get(pid)
+            start = self.pos
+            if kind == "byte":
+                self.take(1)
+            elif kind == "u16":
+                self.take(2)
+            elif kind == "u32":
+                self.take(4)
+            elif kind == "varint":
+                self.varint()
+            elif kind in ("str", "bin"):
+                self.binary()
+            elif kind == "pair":
+                self.binary()
+                self.binary()
+            else:
+                raise ProtocolError(f"Unknown property {pid:#x}")
+            properties.append((pid, self.data[start:self.pos]))
+        if self.pos != end:
+            raise ProtocolError("Malformed properties")
+        return properties
+
+
+def property_value(properties, pid, default=None):
+    for key, raw in properties:
+        if key == pid:
+            return int.from_bytes(raw, "big") if PROPERTY_TYPES[pid] in ("byte", "u16", "u32") else raw
+    return default
+
+
+def valid_topic(topic):
+    return bool(topic) and "+" not in topic and "#" not in topic and "\0" not in topic
+
+
+def valid_filter(topic_filter):
+    if not topic_filter or "\0" in topic_filter:
+        return False
+    levels = topic_filter.split("/")
+    for i, level in enumerate(levels):
+        if "#" in level and (level != "#" or i != len(levels) - 1):
+            return False
+        if "+" in level and level != "+":
+            return False
+    return True
+
+
+def topic_matches(topic_filter, topic):
+    """Whether a topic matches a filter (used for retained messages)"""
+    if topic.startswith("$") and topic_filter[:1] in ("+", "#"):
+        return False
+    filter_levels, topic_levels = topic_filter.split("/"), topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+def parse_shared(topic_filter):
+    """(group, filter) of a $share/<group>/<filter> subscription, else (None, filter)"""
+    if topic_filter.startswith("$share/"):
+        parts = topic_filter.split("/", 2)
+        if len(parts) == 3 and parts[1] and "+" not in parts[1] and "#" not in parts[1]:
+            return parts[1], parts[2]
+        raise ProtocolError(f"Invalid shared subscription: {topic_filter}")
+    return None, topic_filter
+
+
+class Message:
+    __slots__ = ("topic", "payload", "qos", "retain", "properties", "sender")
+
+    def __init__(self, topic, payload, qos=0, retain=False, properties=(), sender=None):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.properties = properties
+        self.sender = sender
+
+
+class Subscription:
+    __slots__ = ("filter", "qos", "no_local", "retain_as_published", "identifier", "group")
+
+    def __init__(self, topic_filter, qos, no_local=False, retain_as_published=False, identifier=None, group=None):
+        self.filter = topic_filter
+        self.qos = qos
+        self.no_local = no_local
+        self.retain_as_published = retain_as_published
+        self.identifier = identifier
+        self.group = group
+
+
+class _Node:
+    __slots__ = ("children", "subscribers", "shared")
+
+    def __init__(self):
+        self.children = {}
+        self.subscribers = {}   # client id -> Subscription
+        self.shared = {}        # group -> {client id: Subscription}
+
+
+class SubscriptionTree:
+    def __init__(self):
+        self.root = _Node()
+        self._round_robin = {}  # (group, filter) -> counter
+
+    def add(self, client_id, subscription):
+        """Store a subscription; returns False if it replaced an existing one"""
+        node = self.root
+        for level in subscription.filter.split("/"):
+            node = node.children.setdefault(level, _Node())
+        members = node.shared.setdefault(subscription.group, {}) if subscription.group else node.subscribers
+        existed = client_id in members
+        members[client_id] = subscription
+        return not existed
+
+    def remove(self, client_id, topic_filter, group=None):
+        path = [self.root]
+        levels = topic_filter.split("/")
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return False
+            path.append(node)
+        node = path[-1]
+        if group:
+            members = node.shared.get(group, {})
+            found = members.pop(client_id, None) is not None
+            if not members:
+                node.shared.pop(group, None)
+        else:
+            found = node.subscribers.pop(client_id, None) is not None
+        # Prune empty branches
+        for parent, level, child in zip(reversed(path[:-1]), reversed(levels), reversed(path[1:])):
+            if child.children or child.subscribers or child.shared:
+                break
+            del parent.children[level]
+        return found
+
+    def match(self, topic):
+        """(normal {client id: [Subscription]}, shared [(round robin key, {client id: Subscription})])"""
+        normal, shared = {}, []
+        levels = topic.split("/")
+        system = topic.startswith("$")
+
+        def collect(node, key):
+            for client_id, subscription in node.subscribers.items():
+                normal.setdefault(client_id, []).append(subscription)
+            for group, members in node.shared.items():
+                shared.append(((group, key), members))
+
+        def walk(node, i, path):
+            if i == len(levels):
+                collect(node, path)
+                hash_node = node.children.get("#")
+                if hash_node is not None:
+                    collect(hash_node, path + "/#")
+                return
+            wildcard_ok = not (system and i == 0)
+            if wildcard_ok:
+                hash_node = node.children.get("#")
+                if hash_node is not None:
+                    collect(hash_node, path + "/#")
+            child = node.children.get(levels[i])
+            if child is not None:
+                walk(child, i + 1, f"{path}/{levels[i]}")
+            if wildcard_ok:
+                plus = node.children.get("+")
+                if plus is not None:
+                    walk(plus, i + 1, path + "/+")
+
+        walk(self.root, 0, "")
+        return normal, shared
+
+    def pick(self, key, members, online):
+        """Next member of a shared group, preferring connected clients"""
+        candidates = [client_id for client_id in members if online(client_id)] or list(members)
+        counter = self._round_robin.setdefault(key, itertools.count())
+        return candidates[next(counter) % len(candidates)]
+
+
+class Session:
+    def __init__(self, client_id, persistent):
+        self.client_id = client_id
+        self.persistent = persistent
+        self.subscriptions = {}      # full filter (with $share prefix) -> Subscription
+        self.inflight = OrderedDict()  # packet id -> outbound QoS 1 publish awaiting PUBACK
+        self.pending = deque()       # (Message, qos, retain, subscription ids) queued while offline
+        self.incoming_qos2 = set()   # packet ids between PUBREC and PUBREL
+        self.connection = None
+        self._packet_ids = itertools.cycle(range(1, 65536))
+
+    def next_packet_id(self):
+        for _ in range(65535):
+            packet_id = next(self._packet_ids)
+            if packet_id not in self.inflight:
+                return packet_id
+        raise ProtocolError("No free packet ids")
+
+
+class Connection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.version = 4
+        self.keepalive = 0
+        self.session = None
+        self.will = None
+        self.closed = False
+
+    def send(self, data):
+        if not self.closed:
+            self.writer.write(data)
+
+    def buffered(self):
+        transport = self.writer.transport
+        return transport.get_write_buffer_size() if transport else 0
+
+
+class Broker:
+    def __init__(self, host=BROKER_HOST, port=BROKER_PORT, max_packet_size=1 << 20,
+                 max_pending=1000, max_write_buffer=4 << 20, connect_timeout=10):
+        self.host = host
+        self.port = port
+        self.max_packet_size = max_packet_size
+        self.max_pending = max_pending
+        self.max_write_buffer = max_write_buffer
+        self.connect_timeout = connect_timeout
+        self.sessions = {}
+        self.retained = {}          # topic -> Message
+        self.tree = SubscriptionTree()
+        self.stats = {"connections": 0, "received": 0, "sent": 0, "dropped": 0}
+        self.server = None
+        self._handlers = set()      # Tasks serving open connections
+        self._client_ids = itertools.count(1)
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"[BROKER] Listening on {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            # Closing the transports ends each handler's read loop
+            for task, writer in list(self._handlers):
+                writer.close()
+            if self._handlers:
+                await asyncio.wait([task for task, _ in self._handlers], timeout=5)
+            await self.server.wait_closed()
+            self.server = None
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    # --- Connection lifecycle ---
+
+    async def _read_packet(self, reader):
+        header = await reader.readexactly(1)
+        length, shift = 0, 0
+        for _ in range(4):
+            byte = (await reader.readexactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        else:
+            raise ProtocolError("Malformed remaining length")
+        if length > self.max_packet_size:
+            raise ProtocolError(f"Packet of {length} bytes is too large")
+        body = await reader.readexactly(length) if length else b""
+        return header[0] >> 4, header[0] & 0x0F, body
+
+    async def _handle(self, reader, writer):
+        conn = Connection(reader, writer)
+        handler = (asyncio.current_task(), writer)
+        self._handlers.add(handler)
+        graceful = False
+        try:
+            packet_type, _, body = await asyncio.wait_for(self._read_packet(reader), self.connect_timeout)
+            if packet_type != CONNECT or not self._on_connect(conn, Reader(body)):
+                return
+            while True:
+                timeout = conn.keepalive * 1.5 if conn.keepalive else None
+                packet_type, flags, body = await asyncio.wait_for(self._read_packet(reader), timeout)
+                if not self._dispatch(conn, packet_type, flags, Reader(body)):
+                    graceful = True
+                    return
+                if conn.buffered() > self.max_write_buffer:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        except ProtocolError as e:
+            print(f"[BROKER] Protocol error from {self._client_name(conn)}: {e}")
+        finally:
+            self._on_close(conn, graceful)
+            writer.close()
+            self._handlers.discard(handler)
+
+    def _client_name(self, conn):
+        return conn.session.client_id if conn.session else "unknown client"
+
+    def _on_connect(self, conn, r):
+        name = r.binary()
+        version = r.byte()
+        if PROTOCOL_NAMES.get(version) != name:
+            # v3.1.1 return code 1 / v5 reason 0x84: unsupported protocol version
+            conn.send(packet(CONNACK, 0, b"\x00\x84\x00" if version == 5 else b"\x00\x01"))
+            return False
+        conn.version = version
+        flags = r.byte()
+        conn.keepalive = r.u16()
+        properties = r.properties() if version == 5 else []
+        client_id = r.string()
+        if flags & 0x04:
+            will_properties = r.properties() if version == 5 else []
+            will_topic = r.string()
+            will_payload = r.binary()
+            conn.will = Message(will_topic, will_payload, min((flags >> 3) & 3, 1), bool(flags & 0x20),
+                                self._forwardable(will_properties))
+        clean = bool(flags & 0x02)
+        persistent = not clean if version < 5 else property_value(properties, SESSION_EXPIRY_INTERVAL, 0) > 0
+
+        assigned = not client_id
+        if assigned:
+            if version < 5 and not clean:
+                conn.send(packet(CONNACK, 0, b"\x00\x02"))  # Identifier rejected
+                return False
+            client_id = f"auto-{os.getpid()}-{next(self._client_ids)}"
+
+        session = self.sessions.get(client_id)
+        if session and session.connection:
+            # Session takeover: the old connection is dropped, its will published
+            old = session.connection
+            session.connection = None
+            old.closed = True
+            old.writer.close()
+            self._publish_will(old)
+        if session and clean:
+            self._drop_session(session)
+            session = None
+        present = session is not None
+        if session is None:
+            session = self.sessions[client_id] = Session(client_id, persistent)
+        session.persistent = persistent
+        session.connection = conn
+        conn.session = session
+        self.stats["connections"] += 1
+
+        if version == 5:
+            ack_properties = [(MAXIMUM_QOS, b"\x01")]
+            if assigned:
+                ack_properties.append((ASSIGNED_CLIENT_IDENTIFIER, encode_string(client_id)))
+            conn.send(packet(CONNACK, 0, bytes([int(present), 0]) + encode_properties(ack_properties)))
+        else:
+            conn.send(packet(CONNACK, 0, bytes([int(present), 0])))
+
+        if present:
+            # Redeliver unacknowledged messages, then what queued up offline
+            for packet_id, (message, retain, identifiers) in session.inflight.items():
+                conn.send(self._encode_publish(conn, message, 1, retain, identifiers, packet_id, dup=True))
+            while session.pending:
+                self._send_publish(session, *session.pending.popleft())
+        return True
+
+    def _on_close(self, conn, graceful):
+        session = conn.session
+        if session is None or session.connection is not conn:
+            return  # Never connected, or taken over by a newer connection
+        session.connection = None
+        if not graceful:
+            self._publish_will(conn)
+        if not session.persistent:
+            self._drop_session(session)
+
+    def _publish_will(self, conn):
+        will, conn.will = conn.will, None
+        if will is not None:
+            self.route(will)
+
+    def _drop_session(self, session):
+        for subscription in session.subscriptions.values():
+            self.tree.remove(session.client_id, subscription.filter, subscription.group)
+        if self.sessions.get(session.client_id) is session:
+            del self.sessions[session.client_id]
+
+    # --- Packets ---
+
+    def _dispatch(self, conn, packet_type, flags, r):
+        """Handle one packet; returns False on DISCONNECT"""
+        session = conn.session
+        if packet_type == PUBLISH:
+            self._on_publish(conn, flags, r)
+        elif packet_type == PUBACK:
+            session.inflight.pop(r.u16(), None)
+        elif packet_type == PUBREL:
+            packet_id = r.u16()
+            session.incoming_qos2.discard(packet_id)
+            conn.send(packet(PUBCOMP, 0, struct.pack("!H", packet_id)))
+        elif packet_type in (PUBREC, PUBCOMP):
+            pass  # We never send QoS 2
+        elif packet_type == SUBSCRIBE:
+            self._on_subscribe(conn, r)
+        elif packet_type == UNSUBSCRIBE:
+            self._on_unsubscribe(conn, r)
+        elif packet_type == PINGREQ:
+            conn.send(packet(PINGRESP, 0, b""))
+        elif packet_type == DISCONNECT:
+            reason = r.byte() if conn.version == 5 and r.remaining() else 0
+            if reason == 0x04:  # Disconnect with will message
+                self._publish_will(conn)
+            conn.will = None
+            return False
+        else:
+            raise ProtocolError(f"Unexpected packet type {packet_type}")
+        return True
+
+    def _on_publish(self, conn, flags, r):
+        qos = (flags >> 1) & 3
+        if qos == 3:
+            raise ProtocolError("Invalid QoS 3")
+        topic = r.string()
+        packet_id = r.u16() if qos else None
+        properties = r.properties() if conn.version == 5 else []
+        payload = r.data[r.pos:]
+        if not valid_topic(topic):
+            raise ProtocolError(f"Invalid topic name: {topic!r}")
+        self.stats["received"] += 1
+
+        if qos == 2:
+            # Accepted once per packet id and forwarded at QoS 1
+            conn.send(packet(PUBREC, 0, struct.pack("!H", packet_id)))
+            if packet_id in conn.session.incoming_qos2:
+                return
+            conn.session.incoming_qos2.add(packet_id)
+        elif qos == 1:
+            conn.send(packet(PUBACK, 0, struct.pack("!H", packet_id)))
+
+        message = Message(topic, payload, min(qos, 1), bool(flags & 0x01),
+                          self._forwardable(properties), conn.session.client_id)
+        self.route(message)
+
+    @staticmethod
+    def _forwardable(properties):
+        """Properties passed on to subscribers (aliases and subscription ids are per connection)"""
+        return tuple((pid, raw) for pid, raw in properties if pid not in (TOPIC_ALIAS, SUBSCRIPTION_IDENTIFIER))
+
+    def route(self, message):
+        """Store (if retained) and deliver a message to every matching subscriber"""
+        if message.retain:
+            if message.payload:
+                self.retained[message.topic] = message
+            else:
+                self.retained.pop(message.topic, None)
+
+        normal, shared = self.tree.match(message.topic)
+        for client_id, subscriptions in normal.items():
+            if client_id == message.sender and any(s.no_local for s in subscriptions):
+                continue
+            session = self.sessions.get(client_id)
+            if session is None:
+                continue
+            qos = min(message.qos, max(s.qos for s in subscriptions))
+            retain = message.retain and any(s.retain_as_published for s in subscriptions)
+            identifiers = [s.identifier for s in subscriptions if s.identifier]
+            self._send_publish(session, message, qos, retain, identifiers)
+
+        for key, members in shared:
+            client_id = self.tree.pick(key, members, self._online)
+            subscription = members[client_id]
+            self._send_publish(self.sessions[client_id], message, min(message.qos, subscription.qos), False,
+                               [subscription.identifier] if subscription.identifier else [])
+
+    def _online(self, client_id):
+        session = self.sessions.get(client_id)
+        return session is not None and session.connection is not None
+
+    def _send_publish(self, session, message, qos, retain, identifiers):
+        conn = session.connection
+        if conn is None:
+            if session.persistent and qos:
+                if len(session.pending) >= self.max_pending:
+                    session.pending.popleft()
+                    self.stats["dropped"] += 1
+                session.pending.append((message, qos, retain, identifiers))
+            return
+        if qos == 0 and conn.buffered() > self.max_write_buffer:
+            self.stats["dropped"] += 1  # Slow consumer: shed QoS 0 instead of buffering forever
+            return
+        packet_id = None
+        if qos:
+            packet_id = session.next_packet_id()
+            session.inflight[packet_id] = (message, retain, identifiers)
+        conn.send(self._encode_publish(conn, message, qos, retain, identifiers, packet_id))
+        self.stats["sent"] += 1
+
+    @staticmethod
+    def _encode_publish(conn, message, qos, retain, identifiers, packet_id=None, dup=False):
+        body = encode_string(message.topic)
+        if qos:
+            body += struct.pack("!H", packet_id)
+        if conn.version == 5:
+            properties = list(message.properties)
+            properties += [(SUBSCRIPTION_IDENTIFIER, encode_varint(i)) for i in identifiers]
+            body += encode_properties(properties)
+        flags = (0x08 if dup else 0) | qos << 1 | int(retain)
+        return packet(PUBLISH, flags, body + message.payload)
+
+    def _on_subscribe(self, conn, r):
+        session = conn.session
+        packet_id = r.u16()
+        identifier = None
+        if conn.version == 5:
+            identifier = property_value(r.properties(), SUBSCRIPTION_IDENTIFIER)
+            if identifier is not None:
+                identifier = Reader(identifier).varint()
+        codes, retained = [], []
+        while r.remaining():
+            full_filter = r.string()
+            options = r.byte()
+            qos = options & 3
+            try:
+                group, topic_filter = parse_shared(full_filter)
+            except ProtocolError:
+                codes.append(0x80 if conn.version < 5 else 0x8F)
+                continue
+            if qos == 3 or not valid_filter(topic_filter):
+                codes.append(0x80 if conn.version < 5 else 0x8F)
+                continue
+            qos = min(qos, 1)
+            subscription = Subscription(topic_filter, qos, identifier=identifier, group=group)
+            retain_handling = 0
+            if conn.version == 5:
+                subscription.no_local = bool(options & 0x04)
+                subscription.retain_as_published = bool(options & 0x08)
+                retain_handling = (options >> 4) & 3
+            new = self.tree.add(session.client_id, subscription)
+            session.subscriptions[full_filter] = subscription
+            codes.append(qos)
+            if group is None and (retain_handling == 0 or (retain_handling == 1 and new)):
+                retained.append(subscription)
+        if not codes:
+            raise ProtocolError("SUBSCRIBE without topic filters")
+
+        header = struct.pack("!H", packet_id) + (encode_properties([]) if conn.version == 5 else b"")
+        conn.send(packet(SUBACK, 0, header + bytes(codes)))
+        for subscription in retained:
+            for message in list(self.retained.values()):
+                if topic_matches(subscription.filter, message.topic):
+                    self._send_publish(session, message, min(message.qos, subscription.qos), True,
+                                       [subscription.identifier] if subscription.identifier else [])
+
+    def _on_unsubscribe(self, conn, r):
+        session = conn.session
+        packet_id = r.u16()
+        if conn.version == 5:
+            r.properties()
+        codes = []
+        while r.remaining():
+            full_filter = r.string()
+            subscription = session.subscriptions.pop(full_filter, None)
+            if subscription:
+                self.tree.remove(session.client_id, subscription.filter, subscription.group)
+            codes.append(0x00 if subscription else 0x11)  # Success / no subscription existed
+        if conn.version == 5:
+            conn.send(packet(UNSUBACK, 0, struct.pack("!H", packet_id) + encode_properties([]) + bytes(codes)))
+        else:
+            conn.send(packet(UNSUBACK, 0, struct.pack("!H", packet_id)))
+
+
+class EmbeddedBroker:
+    """Runs a Broker on its own event loop thread, for tests and scripts
+
+    port=0 picks a free port; read it back from .port after start().
+    """
+    def __init__(self, host="127.0.0.1", port=0, **options):
+        self.broker = Broker(host, port, **options)
+        self.loop = None
+        self._thread = None
+
+    @property
+    def host(self):
+        return self.broker.host
+
+    @property
+    def port(self):
+        return self.broker.port
+
+    def start(self):
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            try:
+                self.loop.run_until_complete(self.broker.start())
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.broker.stop())
+            self.loop.close()
+
+        self._thread = threading.Thread(target=run, name="mqtt-broker", daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self
+
+    def stop(self):
+        if self._thread:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the embedded TermChat MQTT broker")
+    parser.add_argument("--host", default=BROKER_HOST)
+    parser.add_argument("--port", type=int, default=BROKER_PORT)
+    parser.add_argument("--max-packet-size", type=int, default=1 << 20)
+    args = parser.parse_args()
+    try:
+        asyncio.run(Broker(args.host, args.port, max_packet_size=args.max_packet_size).serve_forever())
+    except KeyboardInterrupt:
+        print("[BROKER] Stopped")
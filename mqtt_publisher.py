@@ -0,0 +1,158 @@
+"""Outbound MQTT publisher with a bounded queue
+
+Replies are queued by the message handlers and published from a task on the
+client's asyncio event loop (see mqtt_asyncio), so a slow broker backs up
+this queue instead of the network reads. QoS is configurable per topic and
+queue latency is tracked for the admin/health reports.
+
+While the client is disconnected, messages are held in a bounded offline
+buffer and sent once the connection is back. When that buffer is full the
+oldest (or newest) message is dropped.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+
+
+def parse_topic_qos(spec):
+    """Parse "termchat/output=1,termchat/messages=0" into {topic: qos}"""
+    topic_qos = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        topic, qos = item.rsplit("=", 1)
+        qos = int(qos)
+        if qos not in (0, 1, 2):
+            raise ValueError(f"Invalid QoS {qos} for {topic}")
+        topic_qos[topic.strip()] = qos
+    return topic_qos
+
+
+class OutboundPublisher:
+    """A queue of outbound messages drained by a task on the client's event loop
+
+    publish() may be called from other threads too (executor jobs, the
+    profiler); those calls are handed to the loop thread.
+    """
+    def __init__(self, client, loop=None, maxsize=1000, default_qos=0, topic_qos=None, max_inflight=20,
+                 offline_size=500, offline_drop="oldest"):
+        if offline_drop not in ("oldest", "newest"):
+            raise ValueError(f"Invalid offline drop policy: {offline_drop}")
+        self.client = client
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.default_qos = default_qos
+        self.topic_qos = topic_qos or {}
+        self.offline = deque()
+        self.offline_size = offline_size
+        self.offline_drop = offline_drop
+        self.published = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=1000)  # Seconds each message spent queued
+        self._task = None
+        self._loop_thread = threading.get_ident()
+        client.max_inflight_messages_set(max_inflight)
+
+    def qos_for(self, topic):
+        """QoS for a topic: the most specific configured prefix wins"""
+        best, best_len = self.default_qos, -1
+        for prefix, qos in self.topic_qos.items():
+            if (topic == prefix or topic.startswith(prefix + "/")) and len(prefix) > best_len:
+                best, best_len = qos, len(prefix)
+        return best
+
+    def publish(self, topic, payload, properties=None):
+        """Queue a message; returns False if the queue is full and it was dropped"""
+        item = (time.monotonic(), topic, payload, properties)
+        if threading.get_ident() != self._loop_thread:
+            self.loop.call_soon_threadsafe(self._put, item)
+            return True
+        return self._put(item)
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print(f"[MQTT] Outbound queue full, dropped message to {item[1]}")
+            return False
+
+    def start(self):
+        self._task = self.loop.create_task(self._run())
+
+    async def stop(self, timeout=5):
+        """Flush what is queued and stop the publisher task"""
+        if self._task:
+            await self.queue.put(None)
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        burst = 0
+        while True:
+            try:
+                item = self.queue.get_nowait()
+                burst += 1
+                if burst % 64 == 0:
+                    await asyncio.sleep(0)  # Let the loop read while a backlog drains
+            except asyncio.QueueEmpty:
+                burst = 0
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), 0.5)
+                except asyncio.TimeoutError:
+                    item = False
+            if self.offline and self.client.is_connected():
+                self._flush_offline()
+            if item is None:
+                break
+            if item:
+                self._send(item)
+
+    def _buffer_offline(self, item):
+        if len(self.offline) >= self.offline_size:
+            self.dropped += 1
+            if self.offline_drop == "newest":
+                return
+            self.offline.popleft()
+        self.offline.append(item)
+
+    def _flush_offline(self):
+        print(f"[MQTT] Sending {len(self.offline)} messages buffered while offline")
+        while self.offline and self.client.is_connected():
+            self._send(self.offline.popleft())
+
+    def _send(self, item):
+        enqueued, topic, payload, properties = item
+        if not self.client.is_connected():
+            self._buffer_offline(item)
+            return
+        try:
+            self.client.publish(topic, payload, qos=self.qos_for(topic), properties=properties)
+            self.published += 1
+        except Exception as e:
+            print(f"[MQTT] Publish to {topic} failed: {e}")
+        self.latencies.append(time.monotonic() - enqueued)
+
+    def metrics(self):
+        """Queue depth, counters and queue latency in milliseconds"""
+        latencies = sorted(self.latencies)
+        if latencies:
+            avg_ms = sum(latencies) / len(latencies) * 1000
+            p95_ms = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+            max_ms = latencies[-1] * 1000
+        else:
+            avg_ms = p95_ms = max_ms = 0.0
+        return {
+            "queued": self.queue.qsize(),
+            "offline": len(self.offline),
+            "published": self.published,
+            "dropped": self.dropped,
+            "latency_avg_ms": round(avg_ms, 2),
+            "latency_p95_ms": round(p95_ms, 2),
+            "latency_max_ms": round(max_ms, 2),
+        }
@@ -1,16 +1,32 @@
 import sys
 import signal
+import asyncio
+import itertools
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 import json
 import os
 import threading
+import multiprocessing
 import random
 import string
 import time
+import zlib
+from collections import Counter
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
-from http.server import HTTPServer, SimpleHTTPRequestHandler
 from zhipuai import ZhipuAI
+import diagnostics
+import presence
+import state_snapshot
+import tracing
+import wire_format
+from mqtt_asyncio import AsyncioMQTT
+from mqtt_publisher import OutboundPublisher, parse_topic_qos
+from termAi.checkpoint import load_local_model
 
 # Database imports (with fallback)
 try:
@@ -65,8 +81,63 @@ admin_token = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8
 # Load Config with Render support
 load_dotenv()
 ZHIPU_API_KEY = os.getenv("ZHIPU_API_KEY")
+# AI_PROVIDER=stub answers with a canned reply after a simulated delay, for
+# load tests that must not depend on (or pay for) the real API
+AI_PROVIDER = os.getenv("AI_PROVIDER", "zhipu")
+AI_STUB_LATENCY_MS = float(os.getenv("AI_STUB_LATENCY_MS", 200))
+AI_STUB_JITTER_MS = float(os.getenv("AI_STUB_JITTER_MS", 50))
+# AI requests are awaited on the event loop: at most AI_MAX_CONCURRENCY provider
+# calls at once (blocking SDK calls on AI_EXECUTOR_WORKERS threads), and at most
+# AI_MAX_PENDING requests waiting or in flight before new ones are turned away
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", 64))
+AI_EXECUTOR_WORKERS = int(os.getenv("AI_EXECUTOR_WORKERS", 16))
+AI_MAX_PENDING = int(os.getenv("AI_MAX_PENDING", 5000))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 10))
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
 PORT = int(os.getenv("PORT", 10000))
+MQTT_HOST = os.getenv("MQTT_HOST", "broker.emqx.io")
+MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
+# Run the embedded broker (mqtt_broker.py) in-process on MQTT_PORT, for offline use
+MQTT_EMBEDDED_BROKER = os.getenv("MQTT_EMBEDDED_BROKER", "0") == "1"
+
+# Horizontal scaling: replicas split the inbound topics through an MQTT v5
+# shared subscription and forward each user to the replica holding their state
+MQTT_SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "")
+REPLICA_INDEX = int(os.getenv("REPLICA_INDEX", 0))
+REPLICA_COUNT = max(1, int(os.getenv("REPLICA_COUNT", 1)))
+MQTT_PROTOCOL = mqtt.MQTTv5 if MQTT_SHARE_GROUP else mqtt.MQTTv311
+
+# Outbound publishing: per-topic QoS, inflight window and queue size.
+# MQTT_COMPAT_MESSAGES=0 drops the duplicate reply on termchat/messages for
+# deployments whose clients all read termchat/output
+MQTT_QOS = int(os.getenv("MQTT_QOS", 0))
+MQTT_TOPIC_QOS = parse_topic_qos(os.getenv("MQTT_TOPIC_QOS", ""))
+MQTT_MAX_INFLIGHT = int(os.getenv("MQTT_MAX_INFLIGHT", 20))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("OUTBOUND_QUEUE_SIZE", 1000))
+MQTT_COMPAT_MESSAGES = os.getenv("MQTT_COMPAT_MESSAGES", "1") != "0"
+
+# MQTT_ROOM_OUTPUT=1 sends replies to termchat/room/<room>/output for the
+# sender's room; with MQTT_GLOBAL_OUTPUT=0 as well, clients only receive their
+# own room's traffic. Off by default: each copy is extra broker fan-out, and
+# only clients that follow their room (index_clean.html) read those topics
+MQTT_ROOM_OUTPUT = os.getenv("MQTT_ROOM_OUTPUT", "0") != "0"
+MQTT_GLOBAL_OUTPUT = os.getenv("MQTT_GLOBAL_OUTPUT", "1") != "0"
+
+# Reconnect backoff (seconds) and the buffer for replies made while offline
+MQTT_RECONNECT_MIN = float(os.getenv("MQTT_RECONNECT_MIN", 1))
+MQTT_RECONNECT_MAX = float(os.getenv("MQTT_RECONNECT_MAX", 60))
+OFFLINE_BUFFER_SIZE = int(os.getenv("OFFLINE_BUFFER_SIZE", 500))
+OFFLINE_DROP_POLICY = os.getenv("OFFLINE_DROP_POLICY", "oldest")  # or "newest"
+
+# Local termAi model for fallback replies (train one with python -m termAi.train)
+TERMAI_CHECKPOINT = os.getenv("TERMAI_CHECKPOINT", "")
+TERMAI_TOKENIZER = os.getenv("TERMAI_TOKENIZER", "termai_tokenizer.json")
+
+# Multi-process mode: a supervisor spawns SERVICE_WORKERS processes, each
+# owning the rooms whose name hashes to it
+SERVICE_WORKERS = max(1, int(os.getenv("SERVICE_WORKERS", 1)))
+WORKER_INDEX = None  # Set inside worker processes
+IS_SUPERVISOR = False
 
 # Database setup
 db = None
@@ -100,19 +171,34 @@ if 'RENDER' in os.environ:
     PORT = int(os.environ.get('PORT', 10000))
 
 print(f"[TERMOS] God Mode Backend Starting...")
-print(f"[SECURITY] ADMIN TOKEN: {admin_token}")
+if __name__ != "__mp_main__":
+    # Workers get the supervisor's token, so only the top process prints one
+    print(f"[SECURITY] ADMIN TOKEN: {admin_token}")
 print(f"[CONFIG] API Key: {bool(ZHIPU_API_KEY)}")
+if AI_PROVIDER == "stub":
+    print(f"[CONFIG] AI provider: stub ({AI_STUB_LATENCY_MS:.0f}±{AI_STUB_JITTER_MS:.0f}ms)")
 print(f"[CONFIG] Port: {PORT}")
 print(f"[CONFIG] Platform: {'Render' if 'RENDER' in os.environ else 'Local'}")
+print(f"[CONFIG] Broker: {MQTT_HOST}:{MQTT_PORT}")
+if MQTT_SHARE_GROUP or REPLICA_COUNT > 1:
+    print(f"[CONFIG] Replica: {REPLICA_INDEX + 1}/{REPLICA_COUNT}, share group: {MQTT_SHARE_GROUP or 'none'}")
 
 # AI Client
 zhipu_client = ZhipuAI(api_key=ZHIPU_API_KEY) if ZHIPU_API_KEY else None
 
+# Local model: weights are memory-mapped, so worker processes share them
+local_model = load_local_model(TERMAI_CHECKPOINT, TERMAI_TOKENIZER)
+
 # Global State
-active_users = {}
+publisher = None  # OutboundPublisher, created with the MQTT client
+active_users = presence.PresenceStore()
+room_histories = {}  # Conversation per room for termchat/room/<room>/input
+user_histories = {}  # Conversation per user on the global topics when replicas partition users
 admin_sessions = set()
 loaded_plugins = {}
 plugin_triggers = {}
+profiler = diagnostics.SamplingProfiler()
+heap_tracker = diagnostics.HeapTracker()
 
 # Plugin system setup
 if PLUGIN_SYSTEM_AVAILABLE:
@@ -128,21 +214,46 @@ if PLUGIN_SYSTEM_AVAILABLE:
 # User activity cleanup task
 def cleanup_inactive_users():
     """Remove inactive users periodically"""
-    current_time = time.time()
-    inactive_users = []
-    
-    for user_id, data in active_users.items():
-        if current_time - data.get('last_message', 0) > 3600:  # 1 hour timeout
-            inactive_users.append(user_id)
-    
-    for user_id in inactive_users:
-        del active_users[user_id]
-        print(f"[CLEANUP] Removed inactive user: {user_id}")
+    inactive_users = active_users.remove_inactive(time.time() - 3600)  # 1 hour timeout
+    if inactive_users:
+        print(f"[CLEANUP] Removed {len(inactive_users)} inactive users")
+    # Histories of users that expired or were evicted from presence
+    for user_id in [u for u in user_histories if u not in active_users]:
+        del user_histories[user_id]
+
+def global_room(user_id):
+    """Room a global-topic message from user_id is in
+
+    A single process keeps one shared current_room. Replicas partition
+    users, so each user's room is kept on their presence record, where
+    the owner replica holds all of their state.
+    """
+    if REPLICA_COUNT > 1:
+        user = active_users.get(user_id)
+        if user is not None and user.room:
+            return user.room
+    return current_room
 
-# Schedule cleanup every 10 minutes
-def start_cleanup_timer():
-    cleanup_inactive_users()
-    threading.Timer(600, start_cleanup_timer).start()
+def global_history(user_id):
+    """Conversation a global-topic message from user_id joins (see global_room)"""
+    if REPLICA_COUNT > 1:
+        return user_histories.setdefault(user_id, [])
+    return conv_history
+
+def history_size():
+    return (len(conv_history) + sum(len(h) for h in room_histories.values())
+            + sum(len(h) for h in user_histories.values()))
+
+async def periodic(interval, job):
+    """Run job every interval seconds (awaiting it if it is async) until cancelled"""
+    while True:
+        try:
+            result = job()
+            if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+                await result
+        except Exception as e:
+            print(f"[ERROR] Periodic job {getattr(job, '__name__', job)} failed: {e}")
+        await asyncio.sleep(interval)
 
 # Room-Specific AI Prompts (Multilingual)
 ROOM_PROMPTS = {
@@ -159,6 +270,30 @@ ROOM_PROMPTS = {
     "think_tank": """You are AI Strategist. Solve problems, generate ideas, plan projects. Analyze and suggest solutions. IMPORTANT: Respond in the same language as the user's message."""
 }
 
+# Navigation keywords -> room
+NAV_MAP = {
+    "biblioteka": "library",
+    "studija": "studio", 
+    "dirbtuvės": "workshop",
+    "poilsio": "lounge",
+    "laboratorija": "think_tank"
+}
+
+ROOM_NAMES = {
+    "library": "📚 Biblioteka",
+    "studio": "🎨 Studija", 
+    "workshop": "💻 Dirbtuvės",
+    "lounge": "🎭 Poilsio kambarys",
+    "think_tank": "🧠 Laboratorija"
+}
+
+def match_navigation(text_lower):
+    """Room a message asks to enter, or None"""
+    for keyword, room_name in NAV_MAP.items():
+        if keyword in text_lower:
+            return room_name
+    return None
+
 # AI Tools/Functions for Agentic Behavior
 AI_TOOLS = [
     {
@@ -411,8 +546,24 @@ def get_recent_messages(room, limit=50):
         except Exception as e:
             print(f"[DATABASE] Failed to get messages: {e}")
     return []
+def stub_delay():
+    """Simulated API latency in seconds (AI_PROVIDER=stub)"""
+    delay = AI_STUB_LATENCY_MS + random.uniform(-AI_STUB_JITTER_MS, AI_STUB_JITTER_MS)
+    return max(0.0, delay) / 1000
+
+def stub_reply(messages):
+    last_msg = messages[-1].get('content', '') if messages else ''
+    return f"Stub reply to: {last_msg[:100]}"
+
+def stub_ai_call(messages):
+    """Canned reply after a simulated API delay (AI_PROVIDER=stub)"""
+    time.sleep(stub_delay())
+    return stub_reply(messages)
+
 def ai_call(messages, room):
     """AI API call with room context and function calling"""
+    if AI_PROVIDER == "stub":
+        return stub_ai_call(messages)
     if not zhipu_client:
         return get_fallback_response(messages)
     
@@ -450,11 +601,35 @@ def ai_call(messages, room):
         print(f"[AI ERROR] {e}")
         return get_fallback_response(messages)
 
+ai_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+ai_executor = ThreadPoolExecutor(max_workers=AI_EXECUTOR_WORKERS, thread_name_prefix="ai")
+ai_tasks = set()  # In-flight respond_with_ai tasks
+
+async def ai_call_async(messages, room):
+    """ai_call without blocking the event loop
+
+    The stub provider sleeps asynchronously, so thousands of requests can be
+    in flight; the blocking provider SDK runs on the AI executor threads.
+    """
+    async with ai_semaphore:
+        if AI_PROVIDER == "stub":
+            await asyncio.sleep(stub_delay())
+            return stub_reply(messages)
+        return await asyncio.get_running_loop().run_in_executor(ai_executor, ai_call, messages, room)
+
+def local_model_reply(text, max_new_tokens=60):
+    """Reply from the local termAi model, or None if there is none"""
+    return local_model.reply(text, max_new_tokens) if local_model is not None else None
+
 def get_fallback_response(messages):
     """Multilingual fallback AI responses"""
     if not messages:
         return "Hello! I'm TERMAI. How can I help? / Labas! Aš esu TERMAI. Kaip galiu padėti?"
     
+    reply = local_model_reply(messages[-1].get('content', ''))
+    if reply:
+        return reply
+    
     last_msg = messages[-1].get('content', '').lower() if messages else ''
     
     # Detect language and respond accordingly
@@ -482,8 +657,22 @@ def get_fallback_response(messages):
         else:
             return "I understand! I'm TERMAI. Feel free to ask me anything!"
 
+def check_admin_token(parts):
+    """Error message for a malformed or unauthorised admin command, else None"""
+    if len(parts) < 2:
+        return "No command provided"
+    
+    token = parts[0]
+    if token != admin_token:
+        return "INVALID TOKEN. Access Denied."
+    return None
+
 def handle_admin(payload):
-    """Enhanced admin command handler with plugin support"""
+    """Enhanced admin command handler with plugin support
+
+    Commands whose work blocks (profile stop, heap, memory, snapshot) return a
+    callable instead of the reply; run_admin calls it on an executor thread.
+    """
     global current_room, conv_history
     
     try:
@@ -501,19 +690,18 @@ def handle_admin(payload):
         pass
     
     parts = payload.split()
-    if len(parts) < 2:
-        return "No command provided"
-    
-    token = parts[0]
-    if token != admin_token:
-        return "INVALID TOKEN. Access Denied."
+    error = check_admin_token(parts)
+    if error:
+        return error
     
     cmd = parts[1]
     if cmd == "status":
         plugin_count = len(loaded_plugins)
-        return f"Users: {len(active_users)}, Room: {current_room}, History: {len(conv_history)}, Plugins: {plugin_count}"
+        return f"Users: {len(active_users)}, Room: {current_room}, History: {history_size()}, Plugins: {plugin_count}"
     elif cmd == "reset":
         conv_history = []
+        room_histories.clear()
+        user_histories.clear()
         return "System reset complete"
     elif cmd == "plugins":
         if not loaded_plugins:
@@ -524,6 +712,8 @@ def handle_admin(payload):
             triggers = ", ".join(plugin['triggers']) if plugin['triggers'] else "None"
             plugin_list.append(f"{name} ({status}) - Triggers: {triggers}")
         return "Loaded plugins:\n" + "\n".join(plugin_list)
+    elif cmd == "rooms":
+        return format_room_counts(active_users.room_counts())
     elif cmd.startswith("room") and len(parts) > 2:
         new_room = parts[2]
         if new_room in ROOM_PROMPTS:
@@ -532,9 +722,199 @@ def handle_admin(payload):
         return f"Invalid room: {new_room}"
     elif cmd == "users":
         return f"Active users: {list(active_users.keys())}"
+    elif cmd == "profile":
+        action = parts[2] if len(parts) > 2 else "start"
+        if action == "stop":
+            return profiler.stop  # Joins the sampler while it writes its report
+        try:
+            if action != "start":
+                raise ValueError(action)
+            seconds = min(600.0, float(parts[3]) if len(parts) > 3 else 30.0)
+        except ValueError:
+            return "Usage: profile start [seconds] | profile stop"
+        return profiler.start(seconds, on_done=publish_admin_notice)
+    elif cmd == "heap":
+        action = parts[2] if len(parts) > 2 else "snapshot"
+        if action == "snapshot":
+            return heap_tracker.snapshot
+        elif action == "diff":
+            return heap_tracker.diff
+        elif action == "stop":
+            return heap_tracker.stop
+        return "Usage: heap snapshot | heap diff | heap stop"
+    elif cmd == "memory":
+        return partial(diagnostics.structure_sizes, memory_structures())
+    elif cmd == "outbound":
+        if not publisher:
+            return "Outbound publisher not running"
+        m = publisher.metrics()
+        return (f"Outbound: queued {m['queued']}, published {m['published']}, dropped {m['dropped']}, "
+                f"latency avg {m['latency_avg_ms']}ms p95 {m['latency_p95_ms']}ms max {m['latency_max_ms']}ms")
+    elif cmd == "snapshot":
+        if not state_snapshot.STATE_SNAPSHOT_FILE:
+            return "State snapshots are disabled (STATE_SNAPSHOT_FILE is empty)"
+        return partial(write_state_snapshot, collect_state())  # Compressed and written off the loop
     else:
         return f"Unknown command: {cmd}"
 
+def run_admin(payload, answer):
+    """Run an admin command and pass its reply to answer() on the event loop"""
+    resp = handle_admin(payload)
+    if not callable(resp):
+        answer(resp)
+        return
+    def done(future):
+        error = future.exception()
+        answer(f"Admin error: {error}" if error else future.result())
+    asyncio.get_running_loop().run_in_executor(None, resp).add_done_callback(done)
+
+def format_room_counts(counts):
+    if not counts:
+        return "No users in any room"
+    return "Room members: " + ", ".join(f"{room} {count}" for room, count in counts.most_common())
+
+def memory_structures():
+    """The service's long-lived in-memory structures, for the memory command"""
+    structures = {
+        "active_users": active_users,
+        "conv_history": conv_history,
+        "room_histories": room_histories,
+        "user_histories": user_histories,
+        "loaded_plugins": loaded_plugins,
+        "plugin_triggers": plugin_triggers,
+        "admin_sessions": admin_sessions,
+        "publish_properties_cache": _publish_properties,
+    }
+    if publisher:
+        structures["outbound_offline_buffer"] = publisher.offline
+        structures["outbound_latencies"] = publisher.latencies
+    return structures
+
+# --- STATE SNAPSHOTS ---
+snapshot_lock = threading.Lock()  # The periodic and shutdown snapshots may overlap
+_last_snapshot = None
+
+def snapshot_path():
+    """This process's snapshot file (replicas and workers each keep their own)"""
+    path = state_snapshot.STATE_SNAPSHOT_FILE
+    if REPLICA_COUNT > 1:
+        path += f".r{REPLICA_INDEX}"
+    if WORKER_INDEX is not None:
+        path += f".w{WORKER_INDEX}"
+    return path
+
+def collect_state():
+    """Copy of the state worth keeping across restarts (call on the event loop)"""
+    return {
+        "current_room": current_room,
+        "conv_history": list(conv_history),
+        "room_histories": {room: list(history) for room, history in room_histories.items()},
+        "user_histories": {user_id: list(history) for user_id, history in user_histories.items()},
+        "active_users": active_users.records(),
+        "plugins": {name: {"code": plugin['code'], "triggers": plugin['triggers'], "active": plugin['active']}
+                    for name, plugin in loaded_plugins.items()},
+    }
+
+def collect_memories():
+    """Everything in the vector memory collection, with embeddings so restoring doesn't recompute them"""
+    data = vector_db.get(include=["documents", "metadatas", "embeddings"])
+    embeddings = data.get("embeddings")
+    return {
+        "ids": list(data["ids"]),
+        "documents": list(data["documents"]),
+        "metadatas": list(data["metadatas"]),
+        "embeddings": [[float(x) for x in e] for e in embeddings] if embeddings is not None else None,
+    }
+
+def write_state_snapshot(state):
+    """Add the vector memories and save the snapshot if anything changed (blocking)"""
+    global _last_snapshot
+    if vector_db:
+        try:
+            state["memories"] = collect_memories()
+        except Exception as e:
+            print(f"[SNAPSHOT] Could not read vector memories: {e}")
+    with snapshot_lock:
+        if state == _last_snapshot:
+            return "State unchanged since the last snapshot"
+        path = snapshot_path()
+        started = time.perf_counter()
+        try:
+            size = state_snapshot.save(path, state, {"workers": SERVICE_WORKERS})
+        except OSError as e:
+            print(f"[SNAPSHOT] Could not write {path}: {e}")
+            return f"Snapshot failed: {e}"
+        _last_snapshot = state
+    summary = f"Saved {diagnostics.format_bytes(size)} in {(time.perf_counter() - started) * 1000:.1f}ms -> {path}"
+    print(f"[SNAPSHOT] {summary}")
+    return summary
+
+def snapshot_state():
+    """Periodic job: collect on the loop, compress and write on an executor thread"""
+    return asyncio.get_running_loop().run_in_executor(None, write_state_snapshot, collect_state())
+
+def restore_state():
+    """Load this process's snapshot, if there is one, before serving messages"""
+    global current_room, conv_history, _last_snapshot
+    path = snapshot_path()
+    try:
+        loaded = state_snapshot.load(path)
+    except (OSError, ValueError) as e:
+        print(f"[SNAPSHOT] Ignoring unreadable snapshot {path}: {e}")
+        return
+    if loaded is None:
+        return
+    state, meta, saved_at = loaded
+    if meta.get("workers", 1) != SERVICE_WORKERS:
+        # Rooms are sharded by worker count, so the histories would land on the wrong workers
+        print(f"[SNAPSHOT] Ignoring {path}: saved with {meta.get('workers')} workers, running {SERVICE_WORKERS}")
+        return
+    
+    started = time.perf_counter()
+    try:
+        memories = apply_state(state)
+    except Exception as e:
+        # A snapshot from another version or a partial one must not stop the service starting
+        print(f"[SNAPSHOT] Ignoring {path}, could not restore it: {e!r}")
+        current_room, conv_history = "living_room", []
+        room_histories.clear()
+        user_histories.clear()
+        active_users.clear()
+        return
+    _last_snapshot = state
+    print(f"[SNAPSHOT] Restored {history_size()} history messages, "
+          f"{len(active_users)} users, {len(loaded_plugins)} plugins, "
+          f"{len(memories['ids']) if memories else 0} memories in {(time.perf_counter() - started) * 1000:.1f}ms "
+          f"(saved {time.time() - saved_at:.0f}s ago)")
+
+def apply_state(state):
+    """Load collect_state() output into the globals; returns the vector memories it held"""
+    global current_room, conv_history
+    current_room = state.get("current_room", current_room)
+    conv_history = state.get("conv_history", [])
+    room_histories.update(state.get("room_histories", {}))
+    user_histories.update(state.get("user_histories", {}))
+    active_users.restore(state.get("active_users", []))
+    for name, plugin in state.get("plugins", {}).items():
+        success, message = load_plugin(name, plugin['code'], plugin['triggers'])
+        if success:
+            loaded_plugins[name]['active'] = plugin['active']
+        else:
+            print(f"[SNAPSHOT] Plugin {name} not restored: {message}")
+    memories = state.get("memories")
+    if memories and memories["ids"] and vector_db:
+        try:
+            vector_db.upsert(ids=memories["ids"], documents=memories["documents"],
+                             metadatas=memories["metadatas"], embeddings=memories["embeddings"])
+        except Exception as e:
+            print(f"[SNAPSHOT] Vector memories not restored: {e}")
+    return memories
+
+def publish_admin_notice(msg):
+    """Admin message not tied to a request, e.g. a finished profile"""
+    if publisher:
+        publish_event(publisher.client, "termchat/output", {"type": "admin", "id": "ADMIN", "msg": msg})
+
 def execute_ai_function(function_name, arguments, user_id):
     """Execute AI function calls with plugin support"""
     try:
@@ -565,118 +945,295 @@ def execute_ai_function(function_name, arguments, user_id):
     except Exception as e:
         return {"action": "error", "message": f"Function error: {str(e)}"}
 
+class ReconnectBackoff:
+    """Exponential backoff with jitter, so replicas don't reconnect in lockstep"""
+    def __init__(self, min_delay=1, max_delay=60):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.attempt = 0
+
+    def next_delay(self):
+        delay = min(self.max_delay, self.min_delay * 2 ** self.attempt)
+        self.attempt += 1
+        # "Equal jitter": at least half the exponential delay, never zero
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def reset(self):
+        self.attempt = 0
+
+reconnect_backoff = ReconnectBackoff(MQTT_RECONNECT_MIN, MQTT_RECONNECT_MAX)
+
 def on_disconnect(client, userdata, flags, reason_code, properties=None):
-    print(f"[MQTT] Disconnected. Code: {reason_code}. Reconnecting...")
-    time.sleep(5)
-    try:
-        client.reconnect()
-        print("[MQTT] Reconnected successfully")
-    except Exception as e:
-        print(f"[MQTT] Reconnect failed: {e}. Will retry...")
+    # Reconnecting is left to AsyncioMQTT; never block the event loop here
+    print(f"[MQTT] Disconnected. Code: {reason_code}")
+
+_publish_properties = {}
+
+def publish_properties(wire):
+    """MQTT v5 content-type property for a wire format (None on MQTT 3.1.1)"""
+    if MQTT_PROTOCOL != mqtt.MQTTv5:
+        return None
+    if wire not in _publish_properties:
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.ContentType = wire_format.CONTENT_TYPES[wire]
+        _publish_properties[wire] = properties
+    return _publish_properties[wire]
+
+def publish_raw(client, topic, payload, properties=None):
+    """Publish through the outbound queue (directly if there is none)"""
+    if publisher:
+        publisher.publish(topic, payload, properties)
+    else:
+        client.publish(topic, payload, qos=MQTT_QOS, properties=properties)
+
+def reply_to(data, user_id, ref):
+    """Add correlation fields to a reply when the request carried a ref"""
+    if ref is not None:
+        data["to"] = user_id
+        data["ref"] = ref
+    return data
+
+def publish_event(client, base_topic, data, wire=wire_format.JSON):
+    """Publish a message in the client's wire format (JSON by default)"""
+    with tracing.span("publish"):
+        publish_raw(client, wire_format.topic_for(base_topic, wire), wire_format.encode(data, wire),
+                    publish_properties(wire))
+
+def publish_reply(client, room, data, wire=wire_format.JSON):
+    """Publish a reply to the sender's room output and/or the global termchat/output"""
+    if MQTT_ROOM_OUTPUT and room:
+        publish_event(client, room_output_topic(room), data, wire)
+    if MQTT_GLOBAL_OUTPUT or not MQTT_ROOM_OUTPUT or not room:
+        publish_event(client, "termchat/output", data, wire)
+
+def publish_compat_message(client, text, wire=wire_format.JSON):
+    """Duplicate an AI reply on termchat/messages for clients that read only that topic"""
+    if MQTT_COMPAT_MESSAGES and MQTT_GLOBAL_OUTPUT:
+        publish_event(client, "termchat/messages", {
+            "user": "TERMAI",
+            "text": text
+        }, wire)
+
+def shared_topic(topic):
+    """Wrap an inbound topic in a $share subscription when replicas are grouped"""
+    if MQTT_SHARE_GROUP:
+        return f"$share/{MQTT_SHARE_GROUP}/{topic}"
+    return topic
+
+def replica_topic(index, topic="termchat/input"):
+    """Private topic of one replica that carries forwarded messages"""
+    return f"termchat/replica/{index}/" + topic[len("termchat/"):]
+
+def room_input_topic(room):
+    """Per-room inbound topic served by the worker owning the room"""
+    return f"termchat/room/{room}/input"
+
+def room_output_topic(room):
+    """Per-room topic carrying the replies and events of one room"""
+    return f"termchat/room/{room}/output"
+
+def room_from_topic(topic):
+    """Room of a termchat/room/<room>/input topic, else None"""
+    parts = topic.split("/")
+    if len(parts) == 4 and parts[0] == "termchat" and parts[1] == "room" and parts[3] == "input":
+        return parts[2]
+    return None
+
+def owner_worker(room):
+    """Worker process owning a room (hash partitioned by room name)"""
+    return zlib.crc32(room.encode()) % SERVICE_WORKERS
+
+def owned_rooms():
+    """Rooms served by this process"""
+    if WORKER_INDEX is None:
+        return list(ROOM_PROMPTS)
+    return [room for room in ROOM_PROMPTS if owner_worker(room) == WORKER_INDEX]
+
+def handles_global_topics():
+    """Whether this process serves the legacy global input topics"""
+    return WORKER_INDEX is None or owner_worker("living_room") == WORKER_INDEX
+
+def owner_replica(key):
+    """Replica holding the conversation state for a user (stable across processes)"""
+    return zlib.crc32(str(key).encode()) % REPLICA_COUNT
+
+def subscription_topics():
+    """All topics the service listens on"""
+    wires = [wire_format.JSON]
+    if wire_format.MSGPACK_AVAILABLE:
+        # Compact MessagePack variants of the high-volume topics
+        wires.append(wire_format.MSGPACK)
+    
+    if IS_SUPERVISOR:
+        # The supervisor only answers admin commands, workers do the chat
+        return [wire_format.topic_for("termchat/admin", wire) for wire in wires]
+    
+    topics = []
+    for wire in wires:
+        if handles_global_topics():
+            topics.append(shared_topic(wire_format.topic_for("termchat/input", wire)))
+            topics.append(shared_topic(wire_format.topic_for("termchat/messages", wire)))
+        if WORKER_INDEX is None:
+            topics.append(wire_format.topic_for("termchat/admin", wire))
+        for room in owned_rooms():
+            topics.append(shared_topic(wire_format.topic_for(room_input_topic(room), wire)))
+    if REPLICA_COUNT > 1:
+        topics.append(f"termchat/replica/{REPLICA_INDEX}/#")
+    if handles_global_topics():
+        topics.append("termchat/tunnel/+")
+        topics.append("termchat/room/+")
+    return topics
 
 def on_connect(client, u, flags, rc, p=None):
     print(f"[MQTT] Connected. Code: {rc}")
-    client.subscribe("termchat/input")
-    client.subscribe("termchat/messages")
-    client.subscribe("termchat/admin")
-    client.subscribe("termchat/tunnel/+")
-    client.subscribe("termchat/room/+")
+    if rc != 0:
+        return
+    reconnect_backoff.reset()
+    if getattr(flags, "session_present", False):
+        return  # Broker kept our subscriptions
+    # One batched SUBSCRIBE; repeating it after a reconnect is harmless
+    topics = list(dict.fromkeys(subscription_topics()))
+    client.subscribe([(topic, MQTT_QOS) for topic in topics])
 
 # ==========================================
 # CORRECTED FUNCTION
 # ==========================================
 
 def on_message(client, userdata, message, properties=None):
+    """Handle one inbound message, timing its stages when tracing is on"""
+    trace = tracing.start_trace("on_message", {"topic": message.topic})
+    pending = None
+    try:
+        with trace.activate():
+            pending = handle_message(client, message, trace)
+    finally:
+        if pending is None:
+            trace.finish()
+        else:
+            # The AI reply is still being awaited; finish once it is published
+            pending.add_done_callback(lambda task: trace.finish())
+
+def handle_message(client, message, trace=tracing.NO_TRACE):
+    """Handle one message; returns the reply task when an AI reply is pending"""
     # 1. DECLARE GLOBALS AT THE VERY START
     global current_room, conv_history
-    topic = message.topic
-    payload = message.payload.decode()
-    
-    try:
-        # Parse JSON if possible
-        data = json.loads(payload)
-        user_id = data.get("id", "unknown")
-        message_text = data.get("msg", payload)
-    except:
-        # Fallback to plain text
-        user_id = "system"
-        message_text = payload
+    with trace.span("parse"):
+        topic, wire = wire_format.detect_format(message)
+        
+        try:
+            # Parse JSON (or MessagePack) if possible
+            data = wire_format.decode(message.payload, wire)
+            payload = message.payload.decode() if wire == wire_format.JSON else json.dumps(data)
+            user_id = str(data.get("id", "unknown"))  # Clients may send numbers; state is keyed by str
+            message_text = data.get("msg", payload)
+            ref = data.get("ref")  # Optional request id echoed in the reply
+            own_echo = data.get("user") == "TERMAI"  # Our publish_compat_message copy
+        except:
+            # Fallback to plain text
+            payload = message.payload.decode(errors="replace")
+            user_id = "system"
+            message_text = payload
+            ref = None
+            own_echo = False
+    trace.set("user", user_id)
+    if own_echo:
+        # termchat/messages is both an input and the compat output; "TERMAI"
+        # in the echoed text would otherwise trigger a reply to ourselves
+        trace.set("outcome", "own_echo")
+        return
 
     print(f"[MQTT] {topic}: {user_id} -> {message_text[:50]}...")
 
+    # Replica routing: keep every conversation on one replica
+    with trace.span("route"):
+        replica_prefix = replica_topic(REPLICA_INDEX, "termchat/")
+        if topic.startswith(replica_prefix):
+            topic = "termchat/" + topic[len(replica_prefix):]  # Forwarded to us by another replica
+        elif REPLICA_COUNT > 1 and (topic in ["termchat/input", "termchat/messages"] or room_from_topic(topic)):
+            owner = owner_replica(room_from_topic(topic) or user_id)
+            if owner != REPLICA_INDEX:
+                # With a shared subscription only we got this message, so hand it
+                # over; without one the owner received its own copy already
+                trace.set("outcome", "forwarded")
+                if MQTT_SHARE_GROUP:
+                    publish_raw(client, wire_format.topic_for(replica_topic(owner, topic), wire), message.payload,
+                                publish_properties(wire))
+                return
+
+        room = room_from_topic(topic)
+        sender_room = room or global_room(user_id)
+
     # Handle both termchat/input and termchat/messages topics
-    if topic in ["termchat/input", "termchat/messages"]:
-        # Validate message content
-        if len(message_text) > 500:
-            print(f"[SECURITY] Message too long from {user_id}: {len(message_text)} chars")
-            return
-            
-        # Rate limiting per user
-        current_time = time.time()
-        if user_id in active_users:
-            last_msg_time = active_users[user_id].get('last_message', 0)
-            if current_time - last_msg_time < 1:  # 1 second cooldown
+    if topic in ["termchat/input", "termchat/messages"] or room:
+        with trace.span("validate"):
+            # Validate message content
+            if len(message_text) > 500:
+                print(f"[SECURITY] Message too long from {user_id}: {len(message_text)} chars")
+                trace.set("outcome", "too_long")
+                return
+                
+            # Rate limiting per user
+            current_time = time.time()
+            user = active_users.get(user_id)
+            if user is not None and current_time - user.last_message < 1:  # 1 second cooldown
                 print(f"[RATE_LIMIT] User {user_id} sending too fast")
+                trace.set("outcome", "rate_limited")
                 return
-        
-        # Update user activity
-        active_users[user_id] = {
-            'last_message': current_time,
-            'message_count': active_users.get(user_id, {}).get('message_count', 0) + 1
-        }
+            
+            # Update user activity and room membership
+            active_users.touch(user_id, current_time, sender_room)
         
     elif topic == "termchat/admin":
-        resp = handle_admin(message_text)
-        client.publish("termchat/output", json.dumps({
-            "type": "admin",
-            "id": "ADMIN",
-            "msg": resp
-        }))
+        trace.set("outcome", "admin")
+        def answer(resp):
+            if REPLICA_COUNT > 1:
+                resp = f"[replica {REPLICA_INDEX + 1}/{REPLICA_COUNT}] {resp}"
+            publish_event(client, "termchat/output", reply_to({
+                "type": "admin",
+                "id": "ADMIN",
+                "msg": resp
+            }, user_id, ref), wire)
+        with trace.span("admin"):
+            run_admin(message_text, answer)
         return
 
     # 3. TUNNEL & VIDEO (Pass-through)
-    if "termchat/tunnel" in topic or "termchat/room" in topic:
+    if room is None and ("termchat/tunnel" in topic or "termchat/room" in topic):
         # We just pass these through; frontend handles signaling
+        trace.set("outcome", "passthrough")
         return
 
     # 4. NAVIGATION (Room Switching)
-    text_lower = message_text.lower()
-    nav_map = {
-        "biblioteka": "library",
-        "studija": "studio", 
-        "dirbtuvės": "workshop",
-        "poilsio": "lounge",
-        "laboratorija": "think_tank"
-    }
-    for keyword, room_name in nav_map.items():
-        if keyword in text_lower:
+    with trace.span("navigation"):
+        text_lower = message_text.lower()
+        room_name = match_navigation(text_lower)
+    if room_name:
+        trace.set("outcome", "navigation")
+        # Announced in the room being left, where the client is still listening
+        publish_reply(client, sender_room, reply_to({
+            "type": "navigation",
+            "id": "TERMOS",
+            "msg": f"Įėjote į: {ROOM_NAMES.get(room_name, room_name)}",
+            "room": room_name
+        }, user_id, ref), wire)
+        active_users.move(user_id, room_name)
+        if room is None and REPLICA_COUNT > 1:
+            user_histories.pop(user_id, None)  # Only this user moves
+        elif room is None:
             current_room = room_name
             conv_history = []  # Clear memory
-            
-            room_names = {
-                "library": "📚 Biblioteka",
-                "studio": "🎨 Studija", 
-                "workshop": "💻 Dirbtuvės",
-                "lounge": "🎭 Poilsio kambarys",
-                "think_tank": "🧠 Laboratorija"
-            }
-            
-            client.publish("termchat/output", json.dumps({
-                "type": "navigation",
-                "id": "TERMOS",
-                "msg": f"Įėjote į: {room_names.get(room_name, room_name)}",
-                "room": room_name
-            }))
-            return
+        # On sharded room topics the client switches topic itself
+        return
 
     # 5. AI / GAME / APP GENERATION
     # Check for simple ping test first
     if message_text.lower().strip() == "test ping":
-        client.publish("termchat/output", json.dumps({
+        trace.set("outcome", "ping")
+        publish_reply(client, sender_room, reply_to({
             "type": "chat",
             "id": "SYSTEM",
             "msg": "Pong! Backend is working correctly."
-        }))
+        }, user_id, ref), wire)
         return
     
     # Check if AI should respond
@@ -684,131 +1241,398 @@ def on_message(client, userdata, message, properties=None):
     should_respond = any(trigger in text_lower for trigger in ai_triggers)
     
     if should_respond:
-        # Get System Prompt for current room
-        system_content = ROOM_PROMPTS.get(current_room, ROOM_PROMPTS["living_room"])
+        trace.set("outcome", "ai")
+        if room:
+            # Sharded room topic: room comes from the topic, history is per room
+            return start_ai_reply(client, room, room_histories.setdefault(room, []), user_id, message_text, wire, ref)
+        return start_ai_reply(client, sender_room, global_history(user_id), user_id, message_text, wire, ref)
+
+def start_ai_reply(client, room, history, user_id, message_text, wire=wire_format.JSON, ref=None):
+    """Start respond_with_ai as a task on the event loop; None if too many are pending"""
+    if len(ai_tasks) >= AI_MAX_PENDING:
+        print(f"[AI] {len(ai_tasks)} requests pending, turning away {user_id}")
+        publish_reply(client, room, reply_to({
+            "type": "chat",
+            "id": "TERMAI",
+            "msg": "AI Error: too many requests, try again later"
+        }, user_id, ref), wire)
+        return None
+    task = asyncio.get_running_loop().create_task(
+        respond_with_ai(client, room, history, user_id, message_text, wire, ref))
+    ai_tasks.add(task)
+    task.add_done_callback(ai_tasks.discard)
+    return task
+
+async def respond_with_ai(client, room, history, user_id, message_text, wire=wire_format.JSON, ref=None):
+    """Ask the AI on behalf of a user and publish the reply
+
+    history is the room's conversation list and is updated in place.
+    """
+    with tracing.span("prompt"):
+        # Get System Prompt for the room
+        system_content = ROOM_PROMPTS.get(room, ROOM_PROMPTS["living_room"])
         # Add JSON constraint for specific rooms
-        if current_room in ["workshop", "studio", "lounge"]:
+        if room in ["workshop", "studio", "lounge"]:
             system_content += " IMPORTANT: If creating app/game, return ONLY JSON."
 
         sys_msg = {"role": "system", "content": system_content}
-        conv_history.append({"role": "user", "content": f"{user_id}: {message_text}"})
+        history.append({"role": "user", "content": f"{user_id}: {message_text}"})
         
         # FORCE CLEANUP: Never keep more than 10 items in memory total
-        if len(conv_history) > 10:
-            conv_history = conv_history[-10:]
+        if len(history) > 10:
+            del history[:-10]
             
-        messages_to_send = [sys_msg] + conv_history[-10:]
+        messages_to_send = [sys_msg] + history[-10:]
+    
+    # Enhanced error handling and logging
+    try:
+        with tracing.span("ai_call"):
+            reply = await ai_call_async(messages_to_send, room)
+        
+        # Validate AI response
+        if not reply or len(reply) > 1000:
+            reply = "AI response error or too long"
         
-        # Enhanced error handling and logging
+        # Check if response is JSON (for apps/games)
         try:
-            reply = ai_call(messages_to_send, current_room)
-            
-            # Validate AI response
-            if not reply or len(reply) > 1000:
-                reply = "AI response error or too long"
-            
-            # Check if response is JSON (for apps/games)
-            try:
+            with tracing.span("json_detect"):
                 json_response = json.loads(reply)
-                if json_response.get("type") in ["app", "game"]:
-                    # Send as special JSON message
-                    client.publish("termchat/output", json.dumps({
-                        "type": "creation",
-                        "id": "TERMAI",
-                        "msg": "Sukūriau jums:",
-                        "creation": json_response
-                    }))
-                    conv_history.append({"role": "assistant", "content": reply})
-                    return
-            except json.JSONDecodeError:
-                pass  # Not JSON, send as regular message
-            
-            # Sanitize AI response
+            if json_response.get("type") in ["app", "game"]:
+                # Send as special JSON message
+                publish_reply(client, room, reply_to({
+                    "type": "creation",
+                    "id": "TERMAI",
+                    "msg": "Sukūriau jums:",
+                    "creation": json_response
+                }, user_id, ref), wire)
+                history.append({"role": "assistant", "content": reply})
+                return
+        except json.JSONDecodeError:
+            pass  # Not JSON, send as regular message
+        
+        # Sanitize AI response
+        with tracing.span("sanitize"):
             if reply.startswith("AI Error:"):
-                reply = get_fallback_response(messages_to_send)
+                # May run the local model, so keep it off the event loop
+                reply = await asyncio.get_running_loop().run_in_executor(
+                    ai_executor, get_fallback_response, messages_to_send)
             
             reply = str(reply).replace('<', '&lt;').replace('>', '&gt;')[:500]
-            
-            client.publish("termchat/output", json.dumps({
-                "type": "chat",
-                "id": "TERMAI", 
-                "msg": reply
-            }))
-            # Also publish to messages topic for compatibility
-            client.publish("termchat/messages", json.dumps({
-                "user": "TERMAI",
-                "text": reply
-            }))
-            conv_history.append({"role": "assistant", "content": reply})
-            
-        except Exception as e:
-            error_msg = f"AI Error: {str(e)[:100]}"
-            print(f"[ERROR] AI Failed: {e}")
-            client.publish("termchat/output", json.dumps({
-                "type": "chat",
-                "id": "TERMAI",
-                "msg": error_msg
-            }))
-            client.publish("termchat/messages", json.dumps({
-                "user": "TERMAI",
-                "text": error_msg
-            }))
-
-def run_http_server():
-    """HTTP server for health checks"""
-    class HealthHandler(SimpleHTTPRequestHandler):
-        def do_GET(self):
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            status = f"""
+        
+        publish_reply(client, room, reply_to({
+            "type": "chat",
+            "id": "TERMAI", 
+            "msg": reply
+        }, user_id, ref), wire)
+        # Also publish to messages topic for compatibility
+        publish_compat_message(client, reply, wire)
+        history.append({"role": "assistant", "content": reply})
+        
+    except Exception as e:
+        error_msg = f"AI Error: {str(e)[:100]}"
+        print(f"[ERROR] AI Failed: {e}")
+        publish_reply(client, room, reply_to({
+            "type": "chat",
+            "id": "TERMAI",
+            "msg": error_msg
+        }, user_id, ref), wire)
+        publish_compat_message(client, error_msg, wire)
+
+def health_page(reports=None):
+    """Status page for health checks; reports are the workers' answers in the supervisor"""
+    if IS_SUPERVISOR:
+        status = f"""
+            <h1>TermOS LT - God Mode Backend</h1>
+            <p>Status: ONLINE</p>
+            <p>Workers: {len(reports)}/{SERVICE_WORKERS}</p>
+            <p>Active Users: {len(set(u for _, _, stats in reports for u in stats['users']))}</p>
+            <p>Conversation History: {sum(stats['history'] for _, _, stats in reports)} messages</p>
+            """
+    else:
+        status = f"""
             <h1>TermOS LT - God Mode Backend</h1>
             <p>Status: ONLINE</p>
             <p>Current Room: {current_room}</p>
             <p>Active Users: {len(active_users)}</p>
-            <p>Conversation History: {len(conv_history)} messages</p>
+            <p>Conversation History: {history_size()} messages</p>
+            <p>AI Requests In Flight: {len(ai_tasks)}</p>
             """
-            self.wfile.write(status.encode())
-    
-    server = HTTPServer(('0.0.0.0', PORT), HealthHandler)
-    print(f"[HTTP] Health server running on port {PORT}")
-    server.serve_forever()
+    if publisher:
+        m = publisher.metrics()
+        status += f"""<p>Outbound Queue: {m['queued']} queued, {m['dropped']} dropped, p95 {m['latency_p95_ms']}ms</p>
+            """
+    return status
 
-# --- STARTUP ---
-if __name__ == '__main__':
-    print("[TERMOS] Starting God Mode Backend...")
+async def handle_health_request(reader, writer):
+    """Minimal HTTP/1.0 health server: any GET returns the status page"""
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 10)
+        while await asyncio.wait_for(reader.readline(), 10) not in (b"\r\n", b"\n", b""):
+            pass  # Headers are not needed
+        method = request_line.split(b" ", 1)[0]
+        if method in (b"GET", b"HEAD"):
+            reports = None
+            if IS_SUPERVISOR:
+                reports = await asyncio.get_running_loop().run_in_executor(None, query_workers, None)
+            body = health_page(reports).encode()
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-type: text/html\r\n" +
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() +
+                         (body if method == b"GET" else b""))
+        else:
+            writer.write(b"HTTP/1.0 501 Not Implemented\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def run_service(message_handler=None, control_conn=None, worker_ctx=None, http=True):
+    """Run the service on one asyncio event loop until SIGTERM/SIGINT
+
+    The MQTT client, health server, periodic jobs and AI requests are all
+    tasks on this loop; shutdown stops them in the reverse order.
+    """
+    global publisher
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    broker = None
+    if MQTT_EMBEDDED_BROKER and WORKER_INDEX is None:
+        from mqtt_broker import BROKER_HOST, Broker
+        broker = Broker(BROKER_HOST, MQTT_PORT)
+        await broker.start()
+
+    snapshots = bool(state_snapshot.STATE_SNAPSHOT_FILE) and not IS_SUPERVISOR
+    if snapshots:
+        restore_state()  # Warm before the first message arrives
+
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, protocol=MQTT_PROTOCOL)
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_message = message_handler or on_message
+    network = AsyncioMQTT(client, reconnect_backoff, loop)
     
-    # Start cleanup timer
-    start_cleanup_timer()
+    publisher = OutboundPublisher(client, loop, maxsize=OUTBOUND_QUEUE_SIZE, default_qos=MQTT_QOS,
+                                       topic_qos=MQTT_TOPIC_QOS, max_inflight=MQTT_MAX_INFLIGHT,
+                                       offline_size=OFFLINE_BUFFER_SIZE, offline_drop=OFFLINE_DROP_POLICY)
+    publisher.start()
+    network.connect(MQTT_HOST, MQTT_PORT, 60)
     
-    # Start HTTP server in background
-    http_thread = threading.Thread(target=run_http_server)
-    http_thread.daemon = True
-    http_thread.start()
+    jobs = []
+    if not IS_SUPERVISOR:
+        jobs.append(loop.create_task(periodic(600, cleanup_inactive_users)))
+    if snapshots and state_snapshot.STATE_SNAPSHOT_INTERVAL > 0:
+        jobs.append(loop.create_task(periodic(state_snapshot.STATE_SNAPSHOT_INTERVAL, snapshot_state)))
+    if worker_ctx is not None:
+        jobs.append(loop.create_task(periodic(5, lambda: loop.run_in_executor(None, restart_dead_workers, worker_ctx))))
+    if control_conn is not None:
+        loop.add_reader(control_conn.fileno(), serve_control_request, control_conn)
+    server = None
+    if http:
+        server = await asyncio.start_server(handle_health_request, '0.0.0.0', PORT)
+        print(f"[HTTP] Health server running on port {PORT}")
     
-    # Start MQTT client
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-    client.on_connect = on_connect
-    client.on_disconnect = on_disconnect
-    client.on_message = on_message
+    await stop.wait()
+    print("[TERMOS] Shutting down...")
+    if server:
+        server.close()
+    for job in jobs:
+        job.cancel()
+    if control_conn is not None:
+        loop.remove_reader(control_conn.fileno())
+    if worker_ctx is not None:
+        await loop.run_in_executor(None, stop_workers)  # While the broker is still up
+    if ai_tasks:
+        print(f"[TERMOS] Waiting for {len(ai_tasks)} AI replies")
+        await asyncio.wait(list(ai_tasks), timeout=SHUTDOWN_TIMEOUT)
+    if snapshots:
+        await snapshot_state()
+    await publisher.stop()
+    await network.disconnect()
+    ai_executor.shutdown(wait=False, cancel_futures=True)
+    if broker:
+        await broker.stop()
+
+# ==========================================
+# MULTI-PROCESS MODE (SERVICE_WORKERS > 1)
+# ==========================================
+
+workers = {}  # worker index -> (process, control connection)
+workers_lock = threading.Lock()
+control_request_ids = itertools.count(1)  # Matches worker answers to supervisor requests
+
+def worker_stats():
+    """Counters a worker reports to the supervisor"""
+    return {
+        "worker": WORKER_INDEX,
+        "rooms": owned_rooms(),
+        "users": list(active_users.keys()),
+        "members": dict(active_users.room_counts()),
+        "history": history_size(),
+        "plugins": len(loaded_plugins),
+    }
+
+def serve_control_request(conn):
+    """Answer one supervisor request in a worker (called by the event loop when the pipe is readable)"""
+    try:
+        request_id, payload = conn.recv()
+    except (EOFError, OSError):
+        print(f"[WORKER {WORKER_INDEX}] Supervisor gone, exiting")
+        os._exit(0)
+    # Stats are read in answer(), on the loop, once a blocking command is done
+    answer = lambda resp: conn.send((request_id, resp, worker_stats()))
+    if payload is None:
+        answer(None)
+        return
+    try:
+        run_admin(payload, answer)
+    except Exception as e:
+        answer(f"Worker error: {e}")
+
+def run_worker(index, conn, token):
+    """Entry point of a worker process"""
+    global WORKER_INDEX, admin_token
+    WORKER_INDEX = index
+    admin_token = token
+    print(f"[WORKER {index}] Rooms: {', '.join(owned_rooms()) or 'none'}")
+    asyncio.run(run_service(control_conn=conn, http=False))
+
+def start_worker(ctx, index):
+    parent_conn, child_conn = ctx.Pipe()
+    process = ctx.Process(target=run_worker, args=(index, child_conn, admin_token),
+                          name=f"termchat-worker-{index}", daemon=True)
+    process.start()
+    workers[index] = (process, parent_conn)
+    print(f"[SUPERVISOR] Started worker {index} (pid {process.pid})")
+
+def restart_dead_workers(ctx):
+    """Restart workers that died (runs on an executor thread every 5s)"""
+    with workers_lock:
+        for index, (process, conn) in list(workers.items()):
+            if not process.is_alive():
+                print(f"[SUPERVISOR] Worker {index} exited ({process.exitcode}), restarting")
+                conn.close()
+                start_worker(ctx, index)
+
+def stop_workers(timeout=SHUTDOWN_TIMEOUT):
+    """SIGTERM every worker and wait for their graceful shutdown"""
+    with workers_lock:
+        for process, _ in workers.values():
+            process.terminate()
+        for process, conn in workers.values():
+            process.join(timeout)
+            conn.close()
+        workers.clear()
+
+def query_workers(payload, timeout=5):
+    """Send an admin payload (None = stats only) to every worker
+
+    Returns a list of (worker index, response, stats) for workers that answered.
+    Requests carry an id, so a late answer to an earlier, timed-out request
+    is discarded instead of being taken for this one's.
+    """
+    reports = []
+    request_id = next(control_request_ids)
+    with workers_lock:
+        for index, (process, conn) in workers.items():
+            try:
+                conn.send((request_id, payload))
+            except (OSError, ValueError) as e:
+                print(f"[SUPERVISOR] Worker {index} unreachable: {e}")
+        for index, (process, conn) in workers.items():
+            deadline = time.monotonic() + timeout
+            try:
+                while conn.poll(max(0.0, deadline - time.monotonic())):
+                    answer_id, resp, stats = conn.recv()
+                    if answer_id == request_id:
+                        reports.append((index, resp, stats))
+                        break
+                    print(f"[SUPERVISOR] Discarding worker {index}'s late answer to request {answer_id}")
+                else:
+                    print(f"[SUPERVISOR] Worker {index} did not answer")
+            except (EOFError, OSError) as e:
+                print(f"[SUPERVISOR] Worker {index} unreachable: {e}")
+    return reports
+
+def supervisor_admin(payload):
+    """Run an admin command on every worker and aggregate the answers"""
+    parts = payload.split()
+    try:
+        data = json.loads(payload)
+        is_upload = isinstance(data, dict) and data.get('action') == 'upload_plugin'
+    except json.JSONDecodeError:
+        is_upload = False
+    
+    if not is_upload:
+        error = check_admin_token(parts)
+        if error:
+            return error
     
+    reports = query_workers(payload)
+    if not reports:
+        return "No workers available"
+    
+    cmd = parts[1] if len(parts) > 1 and not is_upload else None
+    if cmd == "status":
+        users = set(u for _, _, stats in reports for u in stats['users'])
+        history = sum(stats['history'] for _, _, stats in reports)
+        plugins = max(stats['plugins'] for _, _, stats in reports)
+        return f"Workers: {len(reports)}/{SERVICE_WORKERS}, Users: {len(users)}, History: {history}, Plugins: {plugins}"
+    elif cmd == "users":
+        users = sorted(set(u for _, _, stats in reports for u in stats['users']))
+        return f"Active users: {users}"
+    elif cmd == "reset":
+        return f"System reset complete on {len(reports)} workers"
+    elif cmd == "rooms":
+        counts = Counter()
+        for _, _, stats in reports:
+            counts.update(stats['members'])
+        return format_room_counts(counts)
+    return "\n".join(f"[worker {index}] {resp}" for index, resp, _ in reports)
+
+def on_supervisor_message(client, userdata, message, properties=None):
+    topic, wire = wire_format.detect_format(message)
     try:
-        client.connect("broker.emqx.io", 1883, 60)
-        print("[MQTT] Connected to broker")
+        data = wire_format.decode(message.payload, wire)
+        payload = message.payload.decode() if wire == wire_format.JSON else json.dumps(data)
+        message_text = data.get("msg", payload)
+        user_id, ref = data.get("id", "unknown"), data.get("ref")
+    except:
+        message_text = message.payload.decode(errors="replace")
+        user_id, ref = "system", None
+    
+    if topic == "termchat/admin":
+        # Waiting for the workers blocks, so it runs off the event loop
+        def answer(future):
+            error = future.exception()
+            publish_event(client, "termchat/output", reply_to({
+                "type": "admin",
+                "id": "ADMIN",
+                "msg": f"Supervisor error: {error}" if error else future.result()
+            }, user_id, ref), wire)
         
-        # For Render, we need to handle the event loop differently
-        if 'RENDER' in os.environ:
-            print("[RENDER] Starting MQTT loop for cloud deployment")
-            client.loop_start()
-            # Keep the main thread alive
-            while True:
-                time.sleep(1)
-        else:
-            client.loop_forever()
-            
-    except KeyboardInterrupt:
-        print("[TERMOS] Shutting down...")
-        client.disconnect()
-    except Exception as e:
-        print(f"[ERROR] MQTT connection failed: {e}")
-        sys.exit(1)
\ No newline at end of file
+        asyncio.get_running_loop().run_in_executor(None, supervisor_admin, message_text).add_done_callback(answer)
+
+def run_supervisor():
+    """Spawn one worker per shard and serve admin commands across them"""
+    global IS_SUPERVISOR
+    IS_SUPERVISOR = True
+    print(f"[SUPERVISOR] Starting {SERVICE_WORKERS} workers")
+    
+    ctx = multiprocessing.get_context("spawn")
+    with workers_lock:
+        for index in range(SERVICE_WORKERS):
+            start_worker(ctx, index)
+    
+    asyncio.run(run_service(on_supervisor_message, worker_ctx=ctx))
+
+# --- STARTUP ---
+if __name__ == '__main__':
+    print("[TERMOS] Starting God Mode Backend...")
+    
+    if SERVICE_WORKERS > 1:
+        run_supervisor()
+    else:
+        asyncio.run(run_service())
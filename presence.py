@@ -0,0 +1,111 @@
+"""Compact presence store for active chat users
+
+Every message touches its sender's record, so records are small
+__slots__ objects updated in place rather than a fresh dict per message
+(about 90 bytes per user instead of 220). Each record also holds the
+room the user is in, so room membership is tracked (and evicted) with
+presence rather than in a separate structure. The store is bounded: when it
+grows past max_users the least recently active tenth is evicted in one
+batch, so a flood of one-off browser nicknames can't grow it without
+bound and touching a user stays O(1) amortised.
+"""
+import os
+import sys
+from collections import Counter
+
+PRESENCE_MAX_USERS = int(os.getenv("PRESENCE_MAX_USERS", 50000))
+
+
+class Presence:
+    __slots__ = ("last_message", "message_count", "room")
+
+    def __init__(self, last_message=0.0, message_count=0, room=None):
+        self.last_message = last_message
+        self.message_count = message_count
+        self.room = room
+
+
+class PresenceStore:
+    def __init__(self, max_users=PRESENCE_MAX_USERS):
+        self.max_users = max_users
+        self.evicted = 0
+        self._users = {}  # user id -> Presence
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id):
+        return user_id in self._users
+
+    def __iter__(self):
+        return iter(self._users)
+
+    def keys(self):
+        return self._users.keys()
+
+    def get(self, user_id):
+        return self._users.get(user_id)
+
+    def touch(self, user_id, now, room=None):
+        """Record a message from a user (sent in room, if given); returns their (updated) record"""
+        record = self._users.get(user_id)
+        if record is None:
+            if isinstance(user_id, str):
+                user_id = sys.intern(user_id)  # One copy of each id string
+            record = self._users[user_id] = Presence(now)
+            if len(self._users) > self.max_users:
+                self._evict(max(1, self.max_users // 10))
+        record.last_message = now
+        record.message_count += 1
+        if room is not None and record.room != room:
+            record.room = sys.intern(room)
+        return record
+
+    def move(self, user_id, room):
+        """Move a known user to another room (navigation); False if they aren't tracked"""
+        record = self._users.get(user_id)
+        if record is None:
+            return False
+        record.room = sys.intern(room)
+        return True
+
+    def members(self, room):
+        return [user_id for user_id, record in self._users.items() if record.room == room]
+
+    def room_counts(self):
+        """Users per room"""
+        return Counter(record.room for record in self._users.values() if record.room is not None)
+
+    def _evict(self, count):
+        """Drop the count least recently active users (more on ties)"""
+        times = sorted(record.last_message for record in self._users.values())
+        self.evicted += len(self.remove_inactive(times[count - 1], inclusive=True))
+
+    def remove_inactive(self, cutoff, inclusive=False):
+        """Drop users whose last message is older than cutoff; returns their ids"""
+        if inclusive:
+            removed = [user_id for user_id, record in self._users.items() if record.last_message <= cutoff]
+        else:
+            removed = [user_id for user_id, record in self._users.items() if record.last_message < cutoff]
+        for user_id in removed:
+            del self._users[user_id]
+        return removed
+
+    def records(self):
+        """(user id, last message, message count, room) for every user, for snapshots"""
+        return [[user_id, record.last_message, record.message_count, record.room]
+                for user_id, record in self._users.items()]
+
+    def restore(self, records):
+        """Load records() output back, keeping the most recently active within max_users"""
+        if len(records) > self.max_users:
+            records = sorted(records, key=lambda r: r[1])[-self.max_users:]
+        for user_id, last_message, message_count, *room in records:
+            room = room[0] if room else None  # Older snapshots have no room
+            if isinstance(user_id, str):
+                user_id = sys.intern(user_id)
+            self._users[user_id] = Presence(last_message, message_count,
+                                                        sys.intern(room) if room else None)
+
+    def clear(self):
+        self._users.clear()
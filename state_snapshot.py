@@ -0,0 +1,79 @@
+"""Warm-restart snapshots of the service's in-memory state
+
+Layout:
+
+    b"TCSNAP1\\n"             magic
+    uint32 (little endian)   format version
+    uint32                   CRC32 of the compressed body
+    uint64                   body length
+    zlib-compressed JSON     {"saved_at": ..., "meta": ..., "state": ...}
+
+Files are written to a temporary name, fsynced and renamed over the old
+snapshot, so a crash mid-write leaves the previous snapshot intact. A
+truncated or corrupted file fails the checksum and is rejected rather
+than half-restored. JSON keeps the file readable by later versions of
+the service; bump FORMAT_VERSION when the state layout changes
+incompatibly.
+"""
+import json
+import os
+import struct
+import time
+import zlib
+
+MAGIC = b"TCSNAP1\n"
+HEADER = struct.Struct("<IIQ")  # format version, body CRC32, body length
+FORMAT_VERSION = 1
+
+STATE_SNAPSHOT_FILE = os.getenv("STATE_SNAPSHOT_FILE", "termchat_state.snap")
+STATE_SNAPSHOT_INTERVAL = float(os.getenv("STATE_SNAPSHOT_INTERVAL", 60))
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+def encode(state, meta=None):
+    """Snapshot bytes for a JSON-serialisable state dict"""
+    document = {"saved_at": time.time(), "meta": meta or {}, "state": state}
+    body = zlib.compress(json.dumps(document, separators=(",", ":")).encode("utf-8"), 6)
+    return MAGIC + HEADER.pack(FORMAT_VERSION, zlib.crc32(body), len(body)) + body
+
+
+def decode(data):
+    """(state, meta, saved_at) from snapshot bytes; raises SnapshotError"""
+    if data[:len(MAGIC)] != MAGIC:
+        raise SnapshotError("not a TermChat state snapshot")
+    try:
+        version, checksum, length = HEADER.unpack_from(data, len(MAGIC))
+    except struct.error:
+        raise SnapshotError("truncated header")
+    if version != FORMAT_VERSION:
+        raise SnapshotError(f"unsupported format version {version}")
+    body = data[len(MAGIC) + HEADER.size:]
+    if len(body) != length or zlib.crc32(body) != checksum:
+        raise SnapshotError("checksum mismatch (truncated or corrupted)")
+    document = json.loads(zlib.decompress(body).decode("utf-8"))
+    return document["state"], document.get("meta", {}), document.get("saved_at", 0.0)
+
+
+def save(filename, state, meta=None):
+    """Write a snapshot atomically; returns its size in bytes"""
+    data = encode(state, meta)
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+    return len(data)
+
+
+def load(filename):
+    """(state, meta, saved_at), or None when there is no snapshot"""
+    try:
+        with open(filename, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    return decode(data)
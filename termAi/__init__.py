@@ -1,5 +1,6 @@
-from .core import Tensor, Softmax
+from .core import Tensor, Softmax, cross_entropy, no_grad
 from .models import Linear, SimpleChatBot, MiniGPT, TransformerBlock
+from .tokenizer import BPETokenizer
 from .chat_interface import VirtualUser
 from .data_collector import ChatLogger
 
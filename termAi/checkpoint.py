@@ -0,0 +1,146 @@
+"""Checkpoint files for TermAI models
+
+Layout:
+
+    b"TERMAI01"              magic
+    uint64 (little endian)   header length
+    JSON header              {"config": ..., "metadata": ..., "tensors": {name: {dtype, shape, offset}}}
+    padding, then every array stored contiguously at a 64-byte aligned offset
+
+load_checkpoint() maps the file with np.memmap and returns views into it,
+so loading copies nothing: the weights are paged in on first use and
+several processes loading the same file share the same physical pages.
+"""
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+
+from .models import MiniGPT
+from .tokenizer import BPETokenizer, EOS_ID
+
+MAGIC = b"TERMAI01"
+ALIGNMENT = 64
+
+# Stored dtypes that are used as-is after loading. float16 saves space on
+# disk but NumPy has no fast float16 matmul, so it is upcast on load.
+ZERO_COPY_DTYPES = ("float32", "float64")
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def save_checkpoint(model, filename, dtype=np.float32, metadata=None):
+    """Write a model's state_dict() (cast to dtype) and config, atomically"""
+    dtype = np.dtype(dtype)
+    arrays = {name: np.ascontiguousarray(array, dtype=dtype)
+              for name, array in model.state_dict().items()}
+
+    tensors, offset = {}, 0
+    for name, array in arrays.items():
+        tensors[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({
+        "config": model.config() if hasattr(model, "config") else {},
+        "metadata": metadata or {},
+        "tensors": tensors,
+    }).encode("utf-8")
+    # Offsets in the header are relative to the aligned start of the data
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for name, array in arrays.items():
+            f.seek(data_start + tensors[name]["offset"])
+            f.write(array.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+
+def read_header(filename):
+    """(header dict, data start offset) of a checkpoint file"""
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a TermAI checkpoint")
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length).decode("utf-8"))
+    return header, _align(len(MAGIC) + 8 + length)
+
+
+def load_checkpoint(filename):
+    """Return (state, header) with state arrays viewing a read-only memmap"""
+    header, data_start = read_header(filename)
+    mapped = np.memmap(filename, dtype=np.uint8, mode="r")
+    state = {}
+    for name, info in header["tensors"].items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"]))
+        start = data_start + info["offset"]
+        array = mapped[start:start + count * dtype.itemsize].view(dtype).reshape(info["shape"])
+        if dtype.name not in ZERO_COPY_DTYPES:
+            array = array.astype(np.float32)
+        state[name] = array
+    return state, header
+
+
+def load_model(filename):
+    """Build a MiniGPT from a checkpoint, with weights memory-mapped
+
+    The weights are read-only; use load_state_dict(state, copy=True) on a
+    model that is going to be trained further.
+    """
+    state, header = load_checkpoint(filename)
+    model = MiniGPT(**header["config"])
+    model.load_state_dict(state, copy=False)
+    return model
+
+
+class LocalModel:
+    """A checkpointed model and its tokenizer, answering chat messages
+
+    generate() reuses the model's scratch buffers and KV cache, so replies
+    are serialised by a lock; callers on several threads can share one.
+    """
+    def __init__(self, model, tokenizer, temperature=0.7, top_p=0.9):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.temperature = temperature
+        self.top_p = top_p
+        self._lock = threading.Lock()
+
+    def reply(self, text, max_new_tokens=60):
+        """The model's reply to text, or None if it has none or generation failed"""
+        try:
+            prompt = self.tokenizer.encode(text + "\n")[-(self.model.context_length // 2):]
+            if not prompt:
+                return None
+            with self._lock:
+                ids = self.model.generate(prompt, max_new_tokens, temperature=self.temperature,
+                                          top_p=self.top_p, eos_id=EOS_ID)
+            return self.tokenizer.decode(ids[len(prompt):]).strip() or None
+        except Exception as e:
+            print(f"[TERMAI] Local model failed: {e}")
+            return None
+
+
+def load_local_model(checkpoint, tokenizer_file="termai_tokenizer.json"):
+    """LocalModel for a checkpoint (weights memory-mapped, so processes share them), or None
+
+    Returns None when no checkpoint is configured or it can't be loaded.
+    """
+    if not checkpoint:
+        return None
+    try:
+        local = LocalModel(load_model(checkpoint), BPETokenizer.load(tokenizer_file))
+    except Exception as e:
+        print(f"[TERMAI] Local model not loaded: {e}")
+        return None
+    print(f"[TERMAI] Local model loaded from {checkpoint}")
+    return local
@@ -0,0 +1,196 @@
+"""Deduplicate and compact ChatLogger training logs
+
+    python -m termAi.compact --logs termchat_logs.jsonl --out termchat_compact.jsonl
+
+Writes one {"input", "output", "count"} record per distinct turn. Exact
+duplicates (same text up to case and whitespace) are merged first, then
+near-duplicates found with MinHash over word shingles from
+utils.tokenize: candidates share an LSH band and are merged when their
+estimated Jaccard similarity reaches the threshold. One turn of each
+group is kept, with count set to the number of logged turns it stands for.
+
+Memory stays bounded for logs larger than RAM: records are spilled to
+hashed partition files that are deduplicated one at a time, signatures
+live in a memory-mapped file, and only two integers per distinct record
+(cluster parent and count) are held in memory.
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import zlib
+from array import array
+
+import numpy as np
+
+from .data_collector import ChatLogger
+from .utils import tokenize
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def exact_key(record):
+    """Text used for exact matching: case and whitespace don't matter"""
+    return " ".join(str(record.get("input", "")).lower().split()) + "\t" + \
+        " ".join(str(record.get("output", "")).lower().split())
+
+
+def shingles(record, size=2):
+    """Word n-grams of a record's input and output"""
+    words = tokenize(str(record.get("input", ""))) + ["|"] + tokenize(str(record.get("output", "")))
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    def __init__(self, num_perm=64, bands=8, seed=1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm {num_perm} is not divisible by bands {bands}")
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+
+    def signature(self, shingle_set):
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingle_set),
+                             dtype=np.uint64, count=len(shingle_set)) % MERSENNE_PRIME
+        # (a * x + b) mod p for every permutation and shingle; fits in uint64
+        permuted = (hashes[:, None] * self.a + self.b) % MERSENNE_PRIME
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def band_keys(self, signature):
+        """One 64-bit key per LSH band"""
+        return [int.from_bytes(hashlib.blake2b(band.tobytes(), digest_size=8,
+                                               person=bytes([i])).digest(), "little")
+                for i, band in enumerate(signature.reshape(self.bands, self.rows))]
+
+
+def _find(parent, i):
+    root = i
+    while parent[root] != root:
+        root = parent[root]
+    while parent[i] != root:  # Path compression
+        parent[i], i = root, parent[i]
+    return root
+
+
+def _union(parent, i, j):
+    """Join two clusters, keeping the earlier record as the root"""
+    ri, rj = _find(parent, i), _find(parent, j)
+    if ri != rj:
+        parent[max(ri, rj)] = min(ri, rj)
+
+
+def compact(logs, out, threshold=0.8, partitions=64, num_perm=64, bands=8, workdir=None):
+    """Write the deduplicated dataset to out; returns counts for the report"""
+    hasher = MinHasher(num_perm, bands)
+    stats = {"records": 0, "exact_duplicates": 0, "near_duplicates": 0, "written": 0}
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        # 1. Spill every record into a partition chosen by its exact key
+        part_paths = [os.path.join(tmp, f"part{i}.jsonl") for i in range(partitions)]
+        part_files = [open(path, "w", encoding="utf-8") for path in part_paths]
+        try:
+            for record in ChatLogger(logs).iter_records():
+                key = exact_key(record)
+                digest = hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest()
+                part_files[int.from_bytes(digest, "little") % partitions].write(
+                    json.dumps([key, record]) + "\n")
+                stats["records"] += 1
+        finally:
+            for f in part_files:
+                f.close()
+
+        # 2. Exact dedup one partition at a time; give each distinct record
+        #    an id, store its signature and spill its LSH band keys
+        unique_path = os.path.join(tmp, "unique.jsonl")
+        sig_path = os.path.join(tmp, "signatures.bin")
+        band_paths = [os.path.join(tmp, f"bands{i}.bin") for i in range(partitions)]
+        counts = array('q')
+        with open(unique_path, "w", encoding="utf-8") as unique_file, \
+                open(sig_path, "wb") as sig_file:
+            band_files = [open(path, "wb") for path in band_paths]
+            try:
+                for path in part_paths:
+                    seen = {}
+                    with open(path, "r", encoding="utf-8") as f:
+                        for line in f:
+                            key, record = json.loads(line)
+                            if key in seen:
+                                seen[key][1] += 1
+                            else:
+                                seen[key] = [record, 1]
+                    os.remove(path)
+                    for record, count in seen.values():
+                        record_id = len(counts)
+                        counts.append(count)
+                        unique_file.write(json.dumps(record) + "\n")
+                        signature = hasher.signature(shingles(record))
+                        sig_file.write(signature.tobytes())
+                        for band_key in hasher.band_keys(signature):
+                            array('Q', [band_key, record_id]).tofile(band_files[band_key % partitions])
+            finally:
+                for f in band_files:
+                    f.close()
+        stats["exact_duplicates"] = stats["records"] - len(counts)
+
+        # 3. Records sharing a band bucket are candidates; merge the ones
+        #    whose signatures agree on at least threshold of the hashes
+        total = len(counts)
+        parent = array('q', range(total))
+        if total:
+            signatures = np.memmap(sig_path, dtype=np.uint32, mode="r", shape=(total, num_perm))
+            for path in band_paths:
+                pairs = np.fromfile(path, dtype=np.uint64).reshape(-1, 2)
+                os.remove(path)
+                if not len(pairs):
+                    continue
+                pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+                starts = np.flatnonzero(np.diff(pairs[:, 0], prepend=pairs[0, 0] + 1))
+                for start, end in zip(starts, list(starts[1:]) + [len(pairs)]):
+                    if end - start < 2:
+                        continue
+                    ids = pairs[start:end, 1].astype(np.int64)
+                    similarity = (signatures[ids[1:]] == signatures[ids[0]]).mean(axis=1)
+                    for other in ids[1:][similarity >= threshold]:
+                        _union(parent, int(ids[0]), int(other))
+
+        # 4. Write one record per cluster with the cluster's total count
+        cluster_counts = array('q', bytes(8 * total))
+        for i in range(total):
+            cluster_counts[_find(parent, i)] += counts[i]
+        with open(unique_path, "r", encoding="utf-8") as f, \
+                open(out + ".tmp", "w", encoding="utf-8") as out_file:
+            for i, line in enumerate(f):
+                if parent[i] != i:
+                    stats["near_duplicates"] += counts[i]
+                    continue
+                record = json.loads(line)
+                record["count"] = cluster_counts[i]
+                out_file.write(json.dumps(record) + "\n")
+                stats["written"] += 1
+        os.replace(out + ".tmp", out)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deduplicate TermChat training logs")
+    parser.add_argument("--logs", default="termchat_logs.jsonl")
+    parser.add_argument("--out", default="termchat_compact.jsonl")
+    parser.add_argument("--threshold", type=float, default=0.8,
+                        help="Estimated Jaccard similarity at which turns are merged")
+    parser.add_argument("--partitions", type=int, default=64)
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--bands", type=int, default=8)
+    parser.add_argument("--workdir", default=None, help="Where to put temporary partitions")
+    args = parser.parse_args()
+
+    stats = compact(args.logs, args.out, args.threshold, args.partitions,
+                    args.num_perm, args.bands, args.workdir)
+    print(f"[Compact] {stats['records']} records -> {stats['written']} written "
+          f"({stats['exact_duplicates']} exact duplicates, "
+          f"{stats['near_duplicates']} near duplicates) to {args.out}")
@@ -1,61 +1,447 @@
 import numpy as np
 
+_grad_enabled = True
+
+
+def is_grad_enabled():
+    return _grad_enabled
+
+
+class no_grad:
+    """Inference mode: ops build no graph and create no backward closures
+
+        with no_grad():
+            logits = model(tokens)
+    """
+    def __enter__(self):
+        global _grad_enabled
+        self._previous = _grad_enabled
+        _grad_enabled = False
+        return self
+
+    def __exit__(self, *exc):
+        global _grad_enabled
+        _grad_enabled = self._previous
+        return False
+
+
+def _unbroadcast(grad, shape):
+    """Sum a broadcast gradient back down to an operand's shape"""
+    # Leading axes added by broadcasting
+    while grad.ndim > len(shape):
+        grad = grad.sum(axis=0)
+    # Axes that were size 1 in the operand
+    for axis, size in enumerate(shape):
+        if size == 1 and grad.shape[axis] != 1:
+            grad = grad.sum(axis=axis, keepdims=True)
+    return grad
+
+
+def _grad_dtype(data):
+    return data.dtype if np.issubdtype(data.dtype, np.floating) else np.float64
+
+
 class Tensor:
-    def __init__(self, data, requires_grad=False):
-        # Ensure data is a numpy array
-        self.data = np.array(data)
+    def __init__(self, data, requires_grad=False, _parents=()):
+        # Ensure data is a numpy array (without copying one that already is)
+        self.data = np.asarray(data)
         self.requires_grad = requires_grad
         self.grad = None
+        self._parents = _parents
         self._backward = lambda: None
 
     def __repr__(self):
         return f"Tensor(data={self.data}, grad={self.grad})"
 
-    def backward(self):
-        # Topological sort for backpropagation (simplified)
+    @property
+    def shape(self):
+        return self.data.shape
+
+    @property
+    def ndim(self):
+        return self.data.ndim
+
+    @property
+    def T(self):
+        return self.transpose()
+
+    def zero_grad(self):
+        self.grad = None
+
+    def _topological_order(self):
+        # Iterative depth-first search, so deep graphs can't hit the recursion limit
         topo = []
         visited = set()
-        def build_topo(v):
-            if v not in visited:
-                visited.add(v)
-                # If we had a computation graph history, we would traverse parents here
-                topo.append(v)
-        build_topo(self)
-        
+        stack = [(self, False)]
+        while stack:
+            node, parents_done = stack.pop()
+            if parents_done:
+                topo.append(node)
+                continue
+            if node in visited:
+                continue
+            visited.add(node)
+            stack.append((node, True))
+            for parent in node._parents:
+                if parent not in visited:
+                    stack.append((parent, False))
+        return topo
+
+    def backward(self, grad=None):
+        if not self.requires_grad:
+            raise RuntimeError("backward() on a tensor that does not require grad "
+                               "(no leaf had requires_grad=True, or it was built under no_grad)")
+        topo = self._topological_order()
+
+        # Preallocate every gradient buffer once; ops accumulate into them in place.
+        # Leaves keep their gradient between calls until zero_grad()
+        for node in topo:
+            if node.requires_grad and (node.grad is None or node._parents):
+                node.grad = np.zeros(node.data.shape, dtype=_grad_dtype(node.data))
+
+        self.grad += np.ones_like(self.grad) if grad is None else grad
+
         # Go backwards
         for node in reversed(topo):
             node._backward()
 
-    # Example basic operation: Addition
+    def _make(self, data, parents):
+        """Result tensor of an op, tracking parents only when a gradient is needed"""
+        requires_grad = _grad_enabled and any(p.requires_grad for p in parents)
+        return Tensor(data, requires_grad=requires_grad, _parents=parents if requires_grad else ())
+
+    @staticmethod
+    def _wrap(other):
+        return other if isinstance(other, Tensor) else Tensor(other)
+
+    # --- Elementwise arithmetic (broadcasting aware) ---
+
     def __add__(self, other):
-        other = other if isinstance(other, Tensor) else Tensor(other)
-        out = Tensor(self.data + other.data)
+        other = self._wrap(other)
+        out = self._make(self.data + other.data, (self, other))
 
-        def _backward():
-            self.grad += out.grad
-            other.grad += out.grad
-        
-        out._backward = _backward
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    self.grad += _unbroadcast(out.grad, self.data.shape)
+                if other.requires_grad:
+                    other.grad += _unbroadcast(out.grad, other.data.shape)
+
+            out._backward = _backward
         return out
 
-    # Example basic operation: Multiplication
+    def __radd__(self, other):
+        return self + other
+
+    def __neg__(self):
+        return self * -1.0
+
+    def __sub__(self, other):
+        return self + (-self._wrap(other))
+
+    def __rsub__(self, other):
+        return self._wrap(other) - self
+
     def __mul__(self, other):
-        other = other if isinstance(other, Tensor) else Tensor(other)
-        out = Tensor(self.data * other.data)
+        other = self._wrap(other)
+        out = self._make(self.data * other.data, (self, other))
+
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    self.grad += _unbroadcast(other.data * out.grad, self.data.shape)
+                if other.requires_grad:
+                    other.grad += _unbroadcast(self.data * out.grad, other.data.shape)
+
+            out._backward = _backward
+        return out
+
+    def __rmul__(self, other):
+        return self * other
+
+    def __truediv__(self, other):
+        other = self._wrap(other)
+        return self * other ** -1.0
+
+    def __rtruediv__(self, other):
+        return self._wrap(other) * self ** -1.0
+
+    def __pow__(self, exponent):
+        # Scalar exponents only
+        out = self._make(self.data ** exponent, (self,))
+
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    self.grad += exponent * self.data ** (exponent - 1) * out.grad
+
+            out._backward = _backward
+        return out
+
+    # --- Linear algebra ---
+
+    def __matmul__(self, other):
+        other = self._wrap(other)
+        out = self._make(np.matmul(self.data, other.data), (self, other))
+
+        if out.requires_grad:
+            def _backward():
+                a, b, g = self.data, other.data, out.grad
+                if a.ndim == 1 and b.ndim == 1:
+                    grad_a, grad_b = g * b, g * a
+                else:
+                    # Promote vectors to matrices so the batched formulas apply
+                    a2 = a[np.newaxis, :] if a.ndim == 1 else a
+                    b2 = b[:, np.newaxis] if b.ndim == 1 else b
+                    g2 = np.expand_dims(g, -2) if a.ndim == 1 else g
+                    g2 = np.expand_dims(g2, -1) if b.ndim == 1 else g2
+                    grad_a = np.matmul(g2, np.swapaxes(b2, -1, -2))
+                    grad_b = np.matmul(np.swapaxes(a2, -1, -2), g2)
+                    if a.ndim == 1:
+                        grad_a = grad_a.squeeze(-2)
+                    if b.ndim == 1:
+                        grad_b = grad_b.squeeze(-1)
+                if self.requires_grad:
+                    self.grad += _unbroadcast(grad_a, a.shape)
+                if other.requires_grad:
+                    other.grad += _unbroadcast(grad_b, b.shape)
+
+            out._backward = _backward
+        return out
+
+    def matmul(self, other):
+        return self @ other
+
+    # --- Reductions ---
+
+    def sum(self, axis=None, keepdims=False):
+        out = self._make(self.data.sum(axis=axis, keepdims=keepdims), (self,))
+
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    g = out.grad
+                    if axis is not None and not keepdims:
+                        g = np.expand_dims(g, axis)
+                    self.grad += np.broadcast_to(g, self.data.shape)
+
+            out._backward = _backward
+        return out
+
+    def mean(self, axis=None, keepdims=False):
+        count = self.data.size if axis is None else np.prod([self.data.shape[a] for a in np.atleast_1d(axis)])
+        return self.sum(axis=axis, keepdims=keepdims) * (1.0 / count)
+
+    # --- Elementwise functions ---
+
+    def exp(self):
+        out = self._make(np.exp(self.data), (self,))
+
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    self.grad += out.data * out.grad
+
+            out._backward = _backward
+        return out
 
+    def log(self):
+        out = self._make(np.log(self.data), (self,))
+
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    self.grad += out.grad / self.data
+
+            out._backward = _backward
+        return out
+
+    def relu(self):
+        out = self._make(np.maximum(self.data, 0), (self,))
+
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    self.grad += (self.data > 0) * out.grad
+
+            out._backward = _backward
+        return out
+
+    # --- Shape ops ---
+
+    def reshape(self, *shape):
+        out = self._make(self.data.reshape(*shape), (self,))
+
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    self.grad += out.grad.reshape(self.data.shape)
+
+            out._backward = _backward
+        return out
+
+    def transpose(self, *axes):
+        axes = axes or tuple(reversed(range(self.data.ndim)))
+        out = self._make(self.data.transpose(axes), (self,))
+
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    self.grad += out.grad.transpose(np.argsort(axes))
+
+            out._backward = _backward
+        return out
+
+    def __getitem__(self, index):
+        index = index.data if isinstance(index, Tensor) else index
+        out = self._make(self.data[index], (self,))
+
+        if out.requires_grad:
+            basic = isinstance(index, (int, slice)) or (
+                isinstance(index, tuple) and all(isinstance(i, (int, slice)) for i in index))
+
+            def _backward():
+                if self.requires_grad:
+                    if basic:
+                        # Plain slicing never repeats an element
+                        self.grad[index] += out.grad
+                    else:
+                        # add.at accumulates repeated indices (e.g. the same token twice)
+                        np.add.at(self.grad, index, out.grad)
+
+            out._backward = _backward
+        return out
+
+    # --- Probabilities ---
+
+    def softmax(self, axis=-1):
+        # Shift data for numerical stability
+        shifted = self.data - np.max(self.data, axis=axis, keepdims=True)
+        exp_data = np.exp(shifted)
+        out = self._make(exp_data / np.sum(exp_data, axis=axis, keepdims=True), (self,))
+
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    s, g = out.data, out.grad
+                    self.grad += s * (g - np.sum(g * s, axis=axis, keepdims=True))
+
+            out._backward = _backward
+        return out
+
+    def log_softmax(self, axis=-1):
+        shifted = self.data - np.max(self.data, axis=axis, keepdims=True)
+        log_probs = shifted - np.log(np.sum(np.exp(shifted), axis=axis, keepdims=True))
+        out = self._make(log_probs, (self,))
+
+        if out.requires_grad:
+            def _backward():
+                if self.requires_grad:
+                    g = out.grad
+                    self.grad += g - np.exp(out.data) * np.sum(g, axis=axis, keepdims=True)
+
+            out._backward = _backward
+        return out
+
+
+def cross_entropy(logits, targets, ignore_index=None):
+    """Mean cross-entropy of logits (..., vocab) against integer targets (...)
+
+    Positions whose target equals ignore_index (e.g. padding) don't count.
+    """
+    targets = np.asarray(targets.data if isinstance(targets, Tensor) else targets)
+    vocab = logits.data.shape[-1]
+    flat_logits = logits.data.reshape(-1, vocab)
+    flat_targets = targets.reshape(-1)
+    mask = np.ones(flat_targets.shape, dtype=bool) if ignore_index is None else flat_targets != ignore_index
+    count = max(int(mask.sum()), 1)
+    safe_targets = np.where(mask, flat_targets, 0)
+
+    shifted = flat_logits - flat_logits.max(axis=1, keepdims=True)
+    log_norm = np.log(np.exp(shifted).sum(axis=1))
+    picked = shifted[np.arange(len(safe_targets)), safe_targets]
+    loss = np.sum((log_norm - picked) * mask) / count
+
+    out = logits._make(loss, (logits,))
+
+    if out.requires_grad:
         def _backward():
-            self.grad += other.data * out.grad
-            other.grad += self.data * out.grad
+            if logits.requires_grad:
+                probs = np.exp(shifted - log_norm[:, None])
+                probs[np.arange(len(safe_targets)), safe_targets] -= 1.0
+                probs *= (mask / count)[:, None]
+                logits.grad += (probs * out.grad).reshape(logits.data.shape)
 
         out._backward = _backward
-        return out
+    return out
+
+
+# --- Buffer-reusing inference ops ---
+# These write into a caller-provided `out` array (typically from an Arena)
+# when no gradient is needed, and fall back to the graph ops otherwise.
+
+def _data(x):
+    return x.data if isinstance(x, Tensor) else x
+
+
+def _needs_graph(*tensors):
+    return _grad_enabled and any(isinstance(t, Tensor) and t.requires_grad for t in tensors)
+
+
+def matmul(a, b, out=None):
+    if out is None or _needs_graph(a, b):
+        return Tensor._wrap(a) @ b
+    return Tensor(np.matmul(_data(a), _data(b), out=out))
+
+
+def add(a, b, out=None):
+    if out is None or _needs_graph(a, b):
+        return Tensor._wrap(a) + b
+    return Tensor(np.add(_data(a), _data(b), out=out))
+
+
+def softmax(x, axis=-1, out=None):
+    """Numerically stable softmax; axis=None normalises over the whole array"""
+    if out is None or _needs_graph(x):
+        return Softmax(axis)(Tensor._wrap(x))
+    data = _data(x)
+    np.subtract(data, np.max(data, axis=axis, keepdims=True), out=out)
+    np.exp(out, out=out)
+    out /= np.sum(out, axis=axis, keepdims=True)
+    return Tensor(out)
+
+
+class Arena:
+    """Scratch buffers reused across inference calls
+
+    Modules ask for a buffer by key and shape; the first request (or a
+    bigger one) allocates, later ones return a view of the same memory.
+    Results built in the arena are only valid until the next forward pass.
+    """
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+        self._buffers = {}
+
+    def get(self, key, shape):
+        size = int(np.prod(shape))
+        buffer = self._buffers.get(key)
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size, dtype=self.dtype)
+            self._buffers[key] = buffer
+        return buffer[:size].reshape(shape)
+
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for buffer in self._buffers.values())
+
 
 class Softmax:
-    def __init__(self):
-        pass
-    
+    def __init__(self, axis=-1):
+        # Normalise each row (last axis); axis=None normalises the whole array
+        self.axis = axis
+
     def __call__(self, x_tensor):
-        # Shift data for numerical stability
-        exp_data = np.exp(x_tensor.data - np.max(x_tensor.data))
-        softmax_data = exp_data / np.sum(exp_data)
-        return Tensor(softmax_data)
\ No newline at end of file
+        if self.axis is None:
+            flat = x_tensor.reshape(-1).softmax(axis=0)
+            return flat.reshape(*x_tensor.data.shape)
+        return x_tensor.softmax(axis=self.axis)
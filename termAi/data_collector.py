@@ -1,9 +1,86 @@
+import atexit
+import bisect
+import glob
+import gzip
 import json
 import os
+import random
+import threading
+import time
+import zlib
+from array import array
+from contextlib import contextmanager
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+try:
+    import fcntl  # Serialises writers in different processes (POSIX only)
+except ImportError:
+    fcntl = None
+
+COMPRESSED_SUFFIXES = {"gzip": ".gz", "zstd": ".zst"}
+
+
+@contextmanager
+def _locked(f):
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
 
 class ChatLogger:
-    def __init__(self, filename="termchat_logs.jsonl"):
+    """
+    Conversation log in JSONL, one {"input", "output"} record per line.
+
+    The active file can be rotated by size (max_bytes) and/or by day
+    (rotate_daily). Rotated shards are optionally compressed ("gzip" or
+    "zstd") in independent blocks of block_records records, so reading
+    record N only decompresses its block. Every shard has a sidecar
+    "<shard>.idx" offset index for O(1) random access.
+
+    Writes are buffered: log_interaction() only queues the record, and a
+    background thread appends the queue every flush_interval seconds or
+    once buffer_records are waiting. The file I/O and rotation happen
+    outside the queue lock, so callers never wait for a compressing
+    rotation. Writes and rotations are serialised across processes by an
+    flock on "<file>.lock". close() (also run at exit once the logger has
+    written) flushes and fsyncs. A record left half-written by a crashed
+    writer is skipped by readers and cut off before the next append.
+    """
+    def __init__(self, filename="termchat_logs.jsonl", max_bytes=None, rotate_daily=False,
+                 compress=None, block_records=256, flush_interval=1.0, buffer_records=100):
+        if compress not in (None, "gzip", "zstd"):
+            raise ValueError(f"Unknown compression: {compress}")
+        if compress == "zstd" and not ZSTD_AVAILABLE:
+            raise ValueError("zstd compression needs the zstandard package")
         self.filename = filename
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.compress = compress
+        self.block_records = block_records
+        self._indexes = {}  # shard path -> (size when indexed, index array)
+        self._block_cache = (None, None, None)  # (shard, block number, records)
+
+        self.flush_interval = flush_interval
+        self.buffer_records = buffer_records
+        self._lock = threading.Lock()  # Guards _pending; never held during file I/O
+        self._io_lock = threading.RLock()  # Serialises writes and rotation in this process
+        self._pending = []  # Encoded lines waiting for the flusher
+        self._data_file = None
+        self._index_file = None
+        self._lock_file = None
+        self._wake = threading.Event()
+        self._flusher = None
+        self._closed = False
 
     def log_interaction(self, user_input, ai_response):
         """
@@ -13,25 +90,358 @@ class ChatLogger:
             "input": user_input,
             "output": ai_response
         }
-        
-        # Open file in append mode ('a')
-        with open(self.filename, 'a') as f:
-            f.write(json.dumps(entry) + "\n")
-        
-        print(f"[DataCollector] Saved interaction to {self.filename}")
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+
+        # Only queue it here; the flusher thread does the file I/O
+        with self._lock:
+            if self._closed:
+                raise ValueError("ChatLogger is closed")
+            self._pending.append(line)
+            full = len(self._pending) >= self.buffer_records
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="chatlogger-flush")
+                self._flusher.daemon = True
+                self._flusher.start()
+                # Only loggers that wrote need the final flush; read-only ones stay collectable
+                atexit.register(self.close)
+        if full:
+            self._wake.set()
+
+    def _flush_loop(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[DataCollector] Flush to {self.filename} failed: {e}")
+
+    def flush(self):
+        """Append queued records and their offsets to the active file"""
+        # The I/O lock is taken first so batches reach the file in queue order
+        with self._io_lock:
+            with self._lock:
+                lines, self._pending = self._pending, []
+            if not lines:
+                return
+            with _locked(self._get_lock_file()):
+                self._repair_tail()
+                self._maybe_rotate()
+                data_file, index_file = self._open_files()
+                data = b"".join(lines)
+                # Append mode: the OS puts the data at the current end of
+                # the file, wherever other processes left it
+                data_file.write(data)
+                data_file.flush()
+                offset = data_file.tell() - len(data)
+                offsets = array('Q')
+                for line in lines:
+                    offsets.append(offset)
+                    offset += len(line)
+                offsets.tofile(index_file)
+                index_file.flush()
+
+    def close(self):
+        """Flush everything, fsync and close the files"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        with self._io_lock:
+            self.flush()
+            self._close_files(sync=True)
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+        atexit.unregister(self.close)
+
+    def _get_lock_file(self):
+        # A separate file, because the data file itself is renamed by rotation
+        if self._lock_file is None:
+            self._lock_file = open(self.filename + ".lock", 'ab')
+        return self._lock_file
+
+    def _open_files(self):
+        # Reopen if another process rotated the file away under us
+        try:
+            current = os.stat(self.filename).st_ino
+        except FileNotFoundError:
+            current = None
+        if self._data_file is not None and os.fstat(self._data_file.fileno()).st_ino != current:
+            self._close_files()
+        if self._data_file is None:
+            self._data_file = open(self.filename, 'ab')
+            self._index_file = open(self.filename + ".idx", 'ab')
+        return self._data_file, self._index_file
+
+    def _repair_tail(self):
+        """Cut off a record a crashed writer left without its newline (called holding the file lock)"""
+        try:
+            f = open(self.filename, 'rb+')
+        except FileNotFoundError:
+            return
+        with f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return
+            # Scan back for the end of the last complete record
+            good, end = 0, size
+            while end > 0:
+                start = max(0, end - (1 << 16))
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline >= 0:
+                    good = start + newline + 1
+                    break
+                end = start
+            f.truncate(good)
+        try:
+            with open(self.filename + ".idx", 'rb+') as f:
+                index = self._read_index(f)
+                kept = array('Q', (offset for offset in index if offset < good))
+                if len(kept) != len(index) or f.tell() % kept.itemsize:
+                    f.seek(0)
+                    kept.tofile(f)
+                    f.truncate()
+        except FileNotFoundError:
+            pass
+        self._indexes.pop(self.filename, None)
+        print(f"[DataCollector] Dropped a truncated record ({size - good} bytes) at the end of {self.filename}")
+
+    def _close_files(self, sync=False):
+        for f in (self._data_file, self._index_file):
+            if f is not None:
+                f.flush()
+                if sync:
+                    os.fsync(f.fileno())
+                f.close()
+        self._data_file = self._index_file = None
 
     def load_training_data(self):
         """
         Reads the logs to prepare for training.
+        Loads everything into memory; prefer iter_records() for big logs.
         """
-        if not os.path.exists(self.filename):
-            return []
-        
-        data = []
-        with open(self.filename, 'r') as f:
+        return list(self.iter_records())
+
+    # --- Reading ---
+
+    def shards(self):
+        """Log files oldest first: rotated shards, then the active file"""
+        stem, ext = os.path.splitext(self.filename)
+        rotated = [path for path in glob.glob(f"{glob.escape(stem)}.*{ext}*")
+                   if path != self.filename and not path.endswith((".idx", ".tmp", ".lock"))]
+        active = [self.filename] if os.path.exists(self.filename) else []
+        return sorted(rotated) + active
+
+    def iter_records(self):
+        """Yield every record, streaming shard by shard"""
+        self.flush()
+        for shard in self.shards():
+            for line in self._iter_lines(shard):
+                if line.strip():
+                    yield json.loads(line)
+
+    def __len__(self):
+        self.flush()
+        return sum(self._record_count(shard) for shard in self.shards())
+
+    def get_record(self, n):
+        """Record number n (0-based, across all shards) without reading the others"""
+        self.flush()
+        shards = self.shards()
+        counts = [self._record_count(shard) for shard in shards]
+        starts = [0]
+        for count in counts:
+            starts.append(starts[-1] + count)
+        if n < 0:
+            n += starts[-1]
+        if not 0 <= n < starts[-1]:
+            raise IndexError(f"Record {n} out of range ({starts[-1]} records)")
+        i = bisect.bisect_right(starts, n) - 1
+        return self._read_record(shards[i], n - starts[i])
+
+    def iter_shuffled(self, seed=None):
+        """Yield all records in random order, one random access at a time"""
+        order = list(range(len(self)))
+        random.Random(seed).shuffle(order)
+        for n in order:
+            yield self.get_record(n)
+
+    def _iter_lines(self, shard):
+        if shard.endswith(".gz"):
+            with gzip.open(shard, "rb") as f:
+                yield from f
+        elif shard.endswith(".zst"):
+            with open(shard, "rb") as raw:
+                with zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True) as f:
+                    buffered = b""
+                    for chunk in iter(lambda: f.read(1 << 16), b""):
+                        lines = (buffered + chunk).split(b"\n")
+                        buffered = lines.pop()
+                        for line in lines:
+                            yield line
+                    if buffered:
+                        yield buffered
+        else:
+            with open(shard, "rb") as f:
+                for line in f:
+                    if line.endswith(b"\n"):  # Not a half-written last record
+                        yield line
+
+    # --- Offset index ---
+    # Plain shards: the byte offset of every record.
+    # Compressed shards: [record count, block size, block offsets..., file size].
+
+    def _is_compressed(self, shard):
+        return shard.endswith((".gz", ".zst"))
+
+    def _index(self, shard):
+        size = os.path.getsize(shard)
+        cached = self._indexes.get(shard)
+        if cached and cached[0] == size:
+            return cached[1]
+        try:
+            with open(shard + ".idx", 'rb') as f:
+                index = self._read_index(f)
+        except FileNotFoundError:
+            index = array('Q')
+        if not self._is_compressed(shard):
+            index = self._extend_index(shard, index, size)
+        elif not index:
+            raise ValueError(f"Missing block index for {shard}")
+        self._indexes[shard] = (size, index)
+        return index
+
+    @staticmethod
+    def _read_index(f):
+        # A writer that crashed mid-append can leave a partial last entry
+        data = f.read()
+        index = array('Q')
+        index.frombytes(data[:len(data) - len(data) % index.itemsize])
+        return index
+
+    def _extend_index(self, shard, index, size):
+        """Index any records appended after the sidecar was last written"""
+        # Start from the last known record, which may itself be incomplete
+        start = index.pop() if index else 0
+        if start > size:
+            index, start = array('Q'), 0
+        with open(shard, 'rb') as f:
+            f.seek(start)
+            offset = start
             for line in f:
-                data.append(json.loads(line))
-        return data
+                if line.strip() and line.endswith(b"\n"):
+                    index.append(offset)
+                offset += len(line)
+        return index
+
+    def _record_count(self, shard):
+        index = self._index(shard)
+        return index[0] if self._is_compressed(shard) else len(index)
+
+    def _read_record(self, shard, n):
+        index = self._index(shard)
+        if not self._is_compressed(shard):
+            with open(shard, 'rb') as f:
+                f.seek(index[n])
+                return json.loads(f.readline())
+        block_records = index[1]
+        block, position = divmod(n, block_records)
+        if self._block_cache[:2] != (shard, block):
+            start, end = index[2 + block], index[3 + block]
+            with open(shard, 'rb') as f:
+                f.seek(start)
+                data = f.read(end - start)
+            if shard.endswith(".gz"):
+                data = zlib.decompress(data, wbits=31)
+            else:
+                data = zstandard.ZstdDecompressor().decompress(data)
+            self._block_cache = (shard, block, data.splitlines())
+        return json.loads(self._block_cache[2][position])
+
+    # --- Rotation ---
+
+    def _current_period(self):
+        return time.strftime("%Y%m%d")
+
+    def _maybe_rotate(self):
+        """Rotate if due (called holding the file lock)"""
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return
+        too_big = self.max_bytes and stat.st_size >= self.max_bytes
+        # Judged by the file's last write rather than per process, so a
+        # file another process already rotated today isn't rotated again
+        new_day = (self.rotate_daily and
+                   time.strftime("%Y%m%d", time.localtime(stat.st_mtime)) != self._current_period())
+        if too_big or new_day:
+            self._close_files()
+            self._rotate()
+
+    def rotate(self):
+        """Close the active file as a numbered shard and start a new one"""
+        with self._io_lock, _locked(self._get_lock_file()):
+            self._close_files()
+            return self._rotate()
+
+    def _rotate(self):
+        if not os.path.exists(self.filename):
+            return None
+        stem, ext = os.path.splitext(self.filename)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        suffix = COMPRESSED_SUFFIXES.get(self.compress, "")
+        # The counter keeps names unique and sortable within one second
+        n = 0
+        while glob.glob(f"{glob.escape(stem)}.{stamp}.{n:03d}{ext}*"):
+            n += 1
+        shard = f"{stem}.{stamp}.{n:03d}{ext}{suffix}"
+
+        if self.compress:
+            self._write_compressed(self.filename, shard)
+            os.remove(self.filename)
+        else:
+            os.replace(self.filename, shard)
+            if os.path.exists(self.filename + ".idx"):
+                os.replace(self.filename + ".idx", shard + ".idx")
+        if os.path.exists(self.filename + ".idx"):
+            os.remove(self.filename + ".idx")
+        self._indexes.pop(self.filename, None)
+        return shard
+
+    def _write_compressed(self, source, shard):
+        """Compress source into independent blocks and write the block index"""
+        if self.compress == "gzip":
+            compress = lambda data: gzip.compress(data, mtime=0)
+        else:
+            compress = zstandard.ZstdCompressor().compress
+        offsets, count = array('Q'), 0
+        with open(source, 'rb') as src, open(shard + ".tmp", 'wb') as out:
+            block = []
+            for line in src:
+                if not line.strip():
+                    continue
+                block.append(line if line.endswith(b"\n") else line + b"\n")
+                count += 1
+                if len(block) == self.block_records:
+                    offsets.append(out.tell())
+                    out.write(compress(b"".join(block)))
+                    block = []
+            if block:
+                offsets.append(out.tell())
+                out.write(compress(b"".join(block)))
+            offsets.append(out.tell())
+        index = array('Q', [count, self.block_records]) + offsets
+        with open(shard + ".idx", 'wb') as f:
+            index.tofile(f)
+        os.replace(shard + ".tmp", shard)
 
 # Example Usage within TermChat LT
 if __name__ == "__main__":
@@ -46,4 +456,4 @@ if __name__ == "__main__":
     
     # 2. Later, load it to train the model
     training_data = logger.load_training_data()
-    print(f"Ready to train on {len(training_data)} examples.")
\ No newline at end of file
+    print(f"Ready to train on {len(training_data)} examples.")
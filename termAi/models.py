@@ -1,64 +1,224 @@
 import numpy as np
 import random
-from .core import Tensor, Softmax
+import zlib
+from .core import Tensor, Softmax, Arena, no_grad, is_grad_enabled, matmul, add, softmax
 
-class Linear:
+def _scratch(module, name, shape):
+    """Arena buffer for an inference result, or None when building a graph"""
+    arena = getattr(module, "arena", None)
+    if arena is None or is_grad_enabled():
+        return None
+    return arena.get((id(module), name), shape)
+
+class Module:
+    """Parameter bookkeeping shared by the layers
+
+    Subclasses list their weights in named_parameters(); parameters(),
+    state_dict() and load_state_dict() are built on top of it.
+    """
+    def named_parameters(self, prefix=""):
+        return []
+
+    def parameters(self):
+        return [tensor for _, tensor in self.named_parameters()]
+
+    def state_dict(self):
+        """{name: array} of every parameter"""
+        return {name: tensor.data for name, tensor in self.named_parameters()}
+
+    def load_state_dict(self, state, copy=True):
+        """Load arrays by name; copy=False adopts them as-is (e.g. memmaps)"""
+        params = dict(self.named_parameters())
+        missing = params.keys() - state.keys()
+        unexpected = state.keys() - params.keys()
+        if missing or unexpected:
+            raise KeyError(f"State dict mismatch: missing {sorted(missing)}, unexpected {sorted(unexpected)}")
+        for name, tensor in params.items():
+            array = state[name]
+            if array.shape != tensor.shape:
+                raise ValueError(f"Shape mismatch for {name}: {array.shape} vs {tensor.shape}")
+            tensor.data = np.array(array, dtype=tensor.data.dtype) if copy else array
+
+class Linear(Module):
     def __init__(self, in_features, out_features):
-        self.weights = Tensor(np.random.randn(in_features, out_features) * 0.1)
-        self.bias = Tensor(np.zeros(out_features))
+        self.weights = Tensor(np.random.randn(in_features, out_features) * 0.1, requires_grad=True)
+        self.bias = Tensor(np.zeros(out_features), requires_grad=True)
+        self.arena = None
 
     def __call__(self, x):
         # x * weights + bias
-        return Tensor(np.dot(x.data, self.weights.data) + self.bias.data)
+        x = x if isinstance(x, Tensor) else Tensor(x)
+        out = _scratch(self, "out", x.shape[:-1] + self.bias.shape)
+        return add(matmul(x, self.weights, out=out), self.bias, out=out)
     
-    def parameters(self):
-        return [self.weights, self.bias]
+    def named_parameters(self, prefix=""):
+        return [(prefix + "weights", self.weights), (prefix + "bias", self.bias)]
 
-class Embedding:
+class Embedding(Module):
     def __init__(self, vocab_size, embed_size):
-        self.weights = Tensor(np.random.randn(vocab_size, embed_size) * 0.1)
+        self.weights = Tensor(np.random.randn(vocab_size, embed_size) * 0.1, requires_grad=True)
     
     def __call__(self, x):
         # Simple lookup - in practice this would be more sophisticated
-        return Tensor(self.weights.data[x] if isinstance(x, int) else self.weights.data)
-
-class SelfAttention:
-    def __init__(self, embed_size):
-        # Weights for Query, Key, and Value
-        self.W_q = Tensor(np.random.randn(embed_size, embed_size) * 0.1)
-        self.W_k = Tensor(np.random.randn(embed_size, embed_size) * 0.1)
-        self.W_v = Tensor(np.random.randn(embed_size, embed_size) * 0.1)
-        self.softmax = Softmax()
+        if isinstance(x, (int, np.integer)):
+            return self.weights[x]
+        if isinstance(x, (list, tuple, np.ndarray)):
+            ids = np.asarray(x)
+            if ids.dtype.kind in "iu":
+                return self.weights[ids]
+        return self.weights
+
+    def named_parameters(self, prefix=""):
+        return [(prefix + "weights", self.weights)]
+
+def causal_mask(query_len, key_len):
+    """True where a query may not look: keys after its own position
+
+    Queries are the last query_len positions of a key_len long sequence,
+    so the same mask works for a full pass and for cached decoding.
+    """
+    offset = key_len - query_len
+    return np.arange(key_len)[None, :] > np.arange(query_len)[:, None] + offset
+
+class SelfAttention(Module):
+    def __init__(self, embed_size, num_heads=1, causal=True):
+        if embed_size % num_heads:
+            raise ValueError(f"embed_size {embed_size} is not divisible by num_heads {num_heads}")
+        self.embed_size = embed_size
+        self.num_heads = num_heads
+        self.head_size = embed_size // num_heads
+        self.causal = causal
+        # Query, Key and Value weights fused into one (C, 3C) projection
+        self.W_qkv = Tensor(np.random.randn(embed_size, 3 * embed_size) * 0.1, requires_grad=True)
+        self.softmax = Softmax(axis=-1)
+        self.arena = None
+        self._masks = {}
+
+    def _mask(self, query_len, key_len):
+        """Additive causal mask: -inf where attention is not allowed, else 0"""
+        key = (query_len, key_len)
+        if key not in self._masks:
+            self._masks[key] = np.where(causal_mask(query_len, key_len), -np.inf, 0.0)
+        return self._masks[key]
 
     def __call__(self, x_tensor):
-        # x_tensor shape: (context_length, embed_size)
+        # x_tensor shape: (batch, context_length, embed_size), (context_length, embed_size)
+        # or a single (embed_size,) token
+        shape = x_tensor.shape
+        if x_tensor.ndim < 3:
+            x_tensor = x_tensor.reshape(1, -1, shape[-1])
+        
+        if self.arena is not None and not is_grad_enabled():
+            out = self._forward_inference(x_tensor.data)
+        else:
+            out = self._forward_graph(x_tensor)
+        return out.reshape(*shape) if len(shape) < 3 else out
+
+    def _forward_graph(self, x_tensor):
+        B, T, C = x_tensor.shape
+        H, D = self.num_heads, self.head_size
         
-        # 1. Calculate Q, K, V (Query, Key, Value)
+        # 1. Calculate Q, K, V (Query, Key, Value) in one matmul, split per head
         # This represents: "What am I looking for?", "What do I contain?", "What do I offer?"
-        Q = np.dot(x_tensor.data, self.W_q.data)
-        K = np.dot(x_tensor.data, self.W_k.data)
-        V = np.dot(x_tensor.data, self.W_v.data)
+        qkv = (x_tensor @ self.W_qkv).reshape(B, T, 3, H, D).transpose(2, 0, 3, 1, 4)
+        Q, K, V = qkv[0], qkv[1], qkv[2]  # (B, H, T, D)
         
-        # 2. Attention Scores
+        # 2. Attention Scores, scaled so numbers don't get too huge
         # How much focus should word A put on word B?
-        score = np.dot(Q, K.T) 
-        
-        # 3. Scale (prevent numbers from getting too huge)
-        embed_size = K.shape[1]
-        scaled_scores = score / np.sqrt(embed_size)
+        scores = (Q @ K.transpose(0, 1, 3, 2)) * (1.0 / np.sqrt(D))
+        if self.causal:
+            # A word may only look at itself and earlier words
+            scores = scores + self._mask(T, T)
         
-        # 4. Softmax (Convert to probabilities)
-        attention_weights = self.softmax(Tensor(scaled_scores)).data
+        # 3. Softmax per row (Convert to probabilities)
+        attention_weights = self.softmax(scores)
         
-        # 5. Weighted Sum
+        # 4. Weighted Sum, heads concatenated back to (B, T, C)
         # The final output is the sum of values, weighted by attention
-        output_data = np.dot(attention_weights, V)
+        return (attention_weights @ V).transpose(0, 2, 1, 3).reshape(B, T, C)
+
+    def _forward_inference(self, x):
+        B, T, C = x.shape
+        H, D = self.num_heads, self.head_size
+        qkv = np.matmul(x, self.W_qkv.data, out=_scratch(self, "qkv", (B, T, 3 * C)))
+        # One copy into contiguous per-head blocks keeps the matmuls on BLAS
+        heads = _scratch(self, "heads", (3, B, H, T, D))
+        np.copyto(heads, qkv.reshape(B, T, 3, H, D).transpose(2, 0, 3, 1, 4))
+        return self.attend(heads[0], heads[1], heads[2])
+
+    def attend(self, Q, K, V):
+        """Inference attention of queries (B, H, t, D) over keys/values (B, H, S, D)
+
+        The queries are the last t of the S positions. Returns (B, t, C),
+        written into the arena when there is one.
+        """
+        B, H, t, D = Q.shape
+        S = K.shape[2]
         
-        return Tensor(output_data)
+        context = _scratch(self, "context", (B, H, t, D))
+        if context is None:
+            context = np.empty((B, H, t, D), dtype=Q.dtype)
+        # Score one sequence at a time: a (H, t, S) block stays in cache
+        # where the whole (B, H, t, S) tensor would not
+        scores = _scratch(self, "scores", (H, t, S))
+        for b in range(B):
+            scores = np.matmul(Q[b], K[b].swapaxes(-1, -2), out=scores)
+            scores *= 1.0 / np.sqrt(D)
+            if self.causal:
+                scores += self._mask(t, S)
+            weights = softmax(scores, axis=-1, out=scores).data
+            np.matmul(weights, V[b], out=context[b])
+        
+        # Concatenate the heads back into (B, t, C)
+        out = _scratch(self, "out", (B, t, H * D))
+        if out is None:
+            out = np.empty((B, t, H * D), dtype=context.dtype)
+        np.copyto(out.reshape(B, t, H, D), context.transpose(0, 2, 1, 3))
+        return Tensor(out)
+
+    def step(self, x, cache):
+        """Attention for new tokens x (B, t, C), appending their keys and
+        values to the layer cache and attending over everything cached
+        """
+        B, t, C = x.shape
+        H, D = self.num_heads, self.head_size
+        start, end = cache.length, cache.length + t
+        if end > cache.max_length:
+            raise ValueError(f"KV cache full: {end} > {cache.max_length} positions")
+        
+        qkv = np.matmul(x, self.W_qkv.data, out=_scratch(self, "qkv", (B, t, 3 * C)))
+        split = qkv.reshape(B, t, 3, H, D).transpose(2, 0, 3, 1, 4)
+        Q = _scratch(self, "heads", (B, H, t, D))
+        if Q is None:
+            Q = np.empty((B, H, t, D), dtype=qkv.dtype)
+        np.copyto(Q, split[0])
+        cache.keys[:B, :, start:end] = split[1]
+        cache.values[:B, :, start:end] = split[2]
+        cache.length = end
+        return self.attend(Q, cache.keys[:B, :, :end], cache.values[:B, :, :end])
+
+    def named_parameters(self, prefix=""):
+        return [(prefix + "W_qkv", self.W_qkv)]
+
+class KVCache:
+    """Preallocated keys and values of one attention layer
+
+    Holds up to max_length positions for batch_size sequences; length is
+    how many positions are filled.
+    """
+    def __init__(self, batch_size, num_heads, max_length, head_size, dtype=np.float64):
+        self.keys = np.zeros((batch_size, num_heads, max_length, head_size), dtype=dtype)
+        self.values = np.zeros_like(self.keys)
+        self.max_length = max_length
+        self.length = 0
 
-class TransformerBlock:
-    def __init__(self, embed_size):
-        self.attention = SelfAttention(embed_size)
+    def reset(self):
+        self.length = 0
+
+class TransformerBlock(Module):
+    def __init__(self, embed_size, num_heads=1):
+        self.attention = SelfAttention(embed_size, num_heads)
+        self.arena = None
         # In a full model, you would add a FeedForward Network here
     
     def __call__(self, x):
@@ -67,18 +227,42 @@ class TransformerBlock:
         
         # Add the input back to the output (Helps the AI learn faster)
         # Note: Simplified element-wise addition
-        return Tensor(attended.data + x.data)
+        return add(attended, x, out=_scratch(self, "out", x.shape))
+
+    def step(self, x, cache):
+        attended = self.attention.step(x, cache)
+        return np.add(attended.data, x, out=_scratch(self, "out", x.shape))
 
-class MiniGPT:
-    def __init__(self, vocab_size, embed_size, num_layers):
+    def named_parameters(self, prefix=""):
+        return self.attention.named_parameters(prefix + "attention.")
+
+class MiniGPT(Module):
+    def __init__(self, vocab_size, embed_size, num_layers, context_length=128, num_heads=1):
         self.embedding = Embedding(vocab_size, embed_size)
+        self.context_length = context_length
+        self.num_heads = num_heads
         # STACK THE BLOCKS - This is "Scaling"
-        self.blocks = [TransformerBlock(embed_size) for _ in range(num_layers)]
+        self.blocks = [TransformerBlock(embed_size, num_heads) for _ in range(num_layers)]
         self.head = Linear(embed_size, vocab_size) # Output layer
+        
+        # Inference scratch space shared by all layers, sized up front by a
+        # dummy pass so no_grad() forward passes don't allocate
+        self.arena = Arena()
+        for block in self.blocks:
+            block.arena = block.attention.arena = self.arena
+        self.head.arena = self.arena
+        with no_grad():
+            self._forward(Tensor(np.zeros((context_length, embed_size))))
 
     def __call__(self, x):
-        x = self.embedding(x)
-        
+        """Logits for the input
+
+        Under no_grad() the result lives in the model's arena and is
+        overwritten by the next call; copy it if you need to keep it.
+        """
+        return self._forward(self.embedding(x))
+
+    def _forward(self, x):
         # Pass data through every layer in the stack
         for block in self.blocks:
             x = block(x)
@@ -86,9 +270,114 @@ class MiniGPT:
         logits = self.head(x)
         return logits
 
-class SimpleChatBot:
-    def __init__(self, vocab_size=10):
+    def new_cache(self, batch_size=1, max_length=None):
+        """One preallocated KVCache per layer"""
+        embed_size = self.embedding.weights.shape[1]
+        return [KVCache(batch_size, self.num_heads, max_length or self.context_length,
+                        embed_size // self.num_heads, self.embedding.weights.data.dtype)
+                for _ in self.blocks]
+
+    def step(self, ids, caches):
+        """Logits (B, vocab) for the last of the new token ids (B, t)
+
+        Only the new tokens are run through the layers; earlier positions
+        come from the caches, so each generated token costs O(T).
+        """
+        x = self.embedding.weights.data[ids]
+        for block, cache in zip(self.blocks, caches):
+            x = block.step(x, cache)
+        return self.head(x[:, -1]).data
+
+    def generate(self, prompt, max_new_tokens=50, temperature=1.0, top_k=None, top_p=None,
+                 max_length=None, eos_id=None, rng=None):
+        """Continue a prompt of token ids, one token at a time
+
+        prompt is a list or array of ids (T,) or a batch (B, T). temperature=0
+        picks greedily; top_k and top_p restrict sampling to the most likely
+        tokens. Generation stops after max_new_tokens, at max_length total
+        tokens (at most context_length) or once every sequence produced
+        eos_id. Returns the prompt plus the new ids, shaped like the prompt.
+        """
+        ids = np.asarray(prompt, dtype=np.int64)
+        unbatched = ids.ndim == 1
+        if unbatched:
+            ids = ids[None, :]
+        B, T = ids.shape
+        if T == 0:
+            raise ValueError("generate() needs at least one prompt token")
+        
+        max_length = min(max_length or self.context_length, self.context_length)
+        if T > max_length:
+            raise ValueError(f"Prompt of {T} tokens is longer than max_length {max_length}")
+        total = min(T + max_new_tokens, max_length)
+        rng = rng if rng is not None else np.random.default_rng()
+        
+        tokens = np.empty((B, total), dtype=np.int64)
+        tokens[:, :T] = ids
+        finished = np.zeros(B, dtype=bool)
+        caches = self.new_cache(B, total)
+        
+        with no_grad():
+            logits = self.step(ids, caches)  # Prefill the caches with the whole prompt
+            for pos in range(T, total):
+                next_ids = sample_logits(logits, temperature, top_k, top_p, rng)
+                if eos_id is not None:
+                    next_ids[finished] = eos_id
+                    finished |= next_ids == eos_id
+                tokens[:, pos] = next_ids
+                if finished.all():
+                    tokens = tokens[:, :pos + 1]
+                    break
+                if pos + 1 < total:
+                    logits = self.step(tokens[:, pos:pos + 1], caches)
+        
+        return tokens[0] if unbatched else tokens
+
+    def named_parameters(self, prefix=""):
+        params = self.embedding.named_parameters(prefix + "embedding.")
+        for i, block in enumerate(self.blocks):
+            params += block.named_parameters(f"{prefix}blocks.{i}.")
+        return params + self.head.named_parameters(prefix + "head.")
+
+    def config(self):
+        """Constructor arguments, stored in checkpoints"""
+        vocab_size, embed_size = self.embedding.weights.shape
+        return {"vocab_size": vocab_size, "embed_size": embed_size, "num_layers": len(self.blocks),
+                "context_length": self.context_length, "num_heads": self.num_heads}
+
+def sample_logits(logits, temperature=1.0, top_k=None, top_p=None, rng=None):
+    """Pick one token id per row of logits (B, vocab)
+
+    temperature=0 is greedy. top_k keeps the k most likely tokens, top_p
+    the smallest set whose probability adds up to p (nucleus sampling).
+    """
+    logits = np.atleast_2d(logits)
+    if not temperature:
+        return np.argmax(logits, axis=-1)
+    rng = rng if rng is not None else np.random.default_rng()
+    
+    scaled = logits / temperature
+    if top_k is not None and top_k < scaled.shape[-1]:
+        kth = np.partition(scaled, -top_k, axis=-1)[:, -top_k, None]
+        scaled = np.where(scaled < kth, -np.inf, scaled)
+    probs = softmax(scaled, axis=-1, out=scaled).data
+    if top_p is not None and top_p < 1.0:
+        order = np.argsort(-probs, axis=-1)
+        sorted_probs = np.take_along_axis(probs, order, axis=-1)
+        # Keep a token if the tokens before it don't already reach top_p
+        drop = np.cumsum(sorted_probs, axis=-1) - sorted_probs >= top_p
+        np.put_along_axis(probs, order, np.where(drop, 0.0, sorted_probs), axis=-1)
+        probs /= probs.sum(axis=-1, keepdims=True)
+    
+    # Inverse CDF sampling, one uniform draw per row
+    cdf = np.cumsum(probs, axis=-1)
+    draws = rng.random((probs.shape[0], 1)) * cdf[:, -1:]
+    return np.minimum((cdf < draws).sum(axis=-1), probs.shape[-1] - 1)
+
+class SimpleChatBot(Module):
+    def __init__(self, vocab_size=10, tokenizer=None):
         self.vocab_size = vocab_size
+        self.tokenizer = tokenizer
         # 1. The Brain: A Linear layer
         # In a real LLM, this would be a massive stack of Transformer layers
         self.layer = Linear(in_features=vocab_size, out_features=vocab_size)
@@ -99,18 +388,20 @@ class SimpleChatBot:
         self.memory = {} 
 
     def think(self, input_text):
-        # Simulate turning text into numbers (Tokenization)
-        # In a real app, you would use a proper tokenizer here
-        input_id = hash(input_text) % self.vocab_size
-        
-        # Create a one-hot vector (the input tensor)
+        # Turn text into numbers (Tokenization): a bag of token ids with a
+        # tokenizer, otherwise a checksum that is stable across processes
         input_vector = np.zeros(self.vocab_size)
-        input_vector[input_id] = 1.0
+        if self.tokenizer is not None:
+            ids = np.asarray(self.tokenizer.encode(input_text), dtype=np.int64)
+            np.add.at(input_vector, ids % self.vocab_size, 1.0)
+        else:
+            input_vector[zlib.crc32(input_text.encode("utf-8")) % self.vocab_size] = 1.0
         x = Tensor(input_vector)
 
         # 2. Forward Pass: The "Thought Process"
-        logits = self.layer(x)       # Raw calculations
-        probabilities = self.softmax(logits) # Convert to chances
+        with no_grad():
+            logits = self.layer(x)       # Raw calculations
+            probabilities = self.softmax(logits) # Convert to chances
         
         # 3. Decoding: Pick the next word based on probability
         predicted_id = np.argmax(probabilities.data)
@@ -123,4 +414,7 @@ class SimpleChatBot:
             "Data is power.", "Computing...", "Error."
         ]
         
-        return responses[predicted_id]
\ No newline at end of file
+        return responses[predicted_id]
+
+    def named_parameters(self, prefix=""):
+        return self.layer.named_parameters(prefix + "layer.")
\ No newline at end of file
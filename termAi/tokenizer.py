@@ -0,0 +1,196 @@
+"""Byte-level BPE tokenizer for TermAI
+
+Text is NFC-normalised (so "ą" typed as "a" + combining ogonek is the same
+token as the precomposed letter), split into words and punctuation, and
+each piece is encoded as UTF-8 bytes that are merged by learned rank.
+Any text round-trips, including Lithuanian diacritics, because every byte
+has its own token.
+"""
+import json
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+from .data_collector import ChatLogger
+
+# Words keep their leading space so decode() can simply join the pieces
+PRETOKENIZE = re.compile(r" ?\w+| ?[^\w\s]+|\s+")
+
+SPECIAL_TOKENS = ["<pad>", "<eos>"]
+PAD_ID = 0
+EOS_ID = 1
+BYTE_OFFSET = len(SPECIAL_TOKENS)
+
+
+def normalize(text):
+    return unicodedata.normalize("NFC", text)
+
+
+def pretokenize(text):
+    return PRETOKENIZE.findall(normalize(text))
+
+
+class BPETokenizer:
+    def __init__(self, merges=None, cache_size=10000):
+        self.merges = []
+        self.ranks = {}  # (left_id, right_id) -> merge rank
+        self.token_bytes = [b""] * BYTE_OFFSET + [bytes([b]) for b in range(256)]
+        for left, right in merges or []:
+            self._add_merge(left, right)
+        # Encoded pieces are cached; chat text repeats the same words a lot
+        self._encode_piece = lru_cache(maxsize=cache_size)(self._bpe)
+
+    @property
+    def vocab_size(self):
+        return len(self.token_bytes)
+
+    def _add_merge(self, left, right):
+        self.ranks[(left, right)] = len(self.merges)
+        self.merges.append((left, right))
+        self.token_bytes.append(self.token_bytes[left] + self.token_bytes[right])
+        return len(self.token_bytes) - 1
+
+    def _bpe(self, piece):
+        ids = [b + BYTE_OFFSET for b in piece.encode("utf-8")]
+        ranks = self.ranks
+        while len(ids) > 1:
+            # Apply the earliest learned merge present in the piece
+            best = min(zip(ids, ids[1:]), key=lambda pair: ranks.get(pair, float("inf")))
+            if best not in ranks:
+                break
+            merged = BYTE_OFFSET + 256 + ranks[best]
+            out, i = [], 0
+            while i < len(ids):
+                if i < len(ids) - 1 and ids[i] == best[0] and ids[i + 1] == best[1]:
+                    out.append(merged)
+                    i += 2
+                else:
+                    out.append(ids[i])
+                    i += 1
+            ids = out
+        return tuple(ids)
+
+    # --- Training ---
+
+    @classmethod
+    def train(cls, texts, vocab_size=1000, min_frequency=2, cache_size=10000):
+        """Learn merges from an iterable of strings until vocab_size tokens"""
+        tokenizer = cls(cache_size=cache_size)
+        word_counts = Counter()
+        for text in texts:
+            word_counts.update(pretokenize(text))
+
+        words = [[b + BYTE_OFFSET for b in word.encode("utf-8")] for word in word_counts]
+        freqs = list(word_counts.values())
+
+        # Pair counts are updated incrementally: only the words containing
+        # the merged pair are re-scanned each round
+        pair_counts = Counter()
+        pair_words = defaultdict(set)
+        for index, word in enumerate(words):
+            for pair in zip(word, word[1:]):
+                pair_counts[pair] += freqs[index]
+                pair_words[pair].add(index)
+
+        while tokenizer.vocab_size < vocab_size and pair_counts:
+            best = max(pair_counts, key=pair_counts.get)
+            if pair_counts[best] < min_frequency:
+                break
+            new_id = tokenizer._add_merge(*best)
+
+            for index in pair_words.pop(best):
+                word, freq = words[index], freqs[index]
+                for pair in zip(word, word[1:]):
+                    pair_counts[pair] -= freq
+                    if pair_counts[pair] <= 0:
+                        del pair_counts[pair]
+                merged, i = [], 0
+                while i < len(word):
+                    if i < len(word) - 1 and (word[i], word[i + 1]) == best:
+                        merged.append(new_id)
+                        i += 2
+                    else:
+                        merged.append(word[i])
+                        i += 1
+                words[index] = merged
+                for pair in zip(merged, merged[1:]):
+                    pair_counts[pair] += freq
+                    pair_words[pair].add(index)
+        return tokenizer
+
+    @classmethod
+    def train_from_logs(cls, filename="termchat_logs.jsonl", vocab_size=1000, **kwargs):
+        """Train on the input and output text of ChatLogger records"""
+        def texts():
+            for entry in ChatLogger(filename).iter_records():
+                for field in ("input", "output"):
+                    if isinstance(entry.get(field), str):
+                        yield entry[field]
+        return cls.train(texts(), vocab_size=vocab_size, **kwargs)
+
+    # --- Encoding ---
+
+    def encode(self, text, add_eos=False):
+        """Token ids for a string"""
+        ids = []
+        for piece in pretokenize(text):
+            ids.extend(self._encode_piece(piece))
+        if add_eos:
+            ids.append(EOS_ID)
+        return ids
+
+    def decode(self, ids):
+        """String for token ids; padding and special tokens are skipped"""
+        data = b"".join(self.token_bytes[int(i)] for i in ids)
+        return data.decode("utf-8", errors="replace")
+
+    def tokens(self, text):
+        """Token strings for a text, without surrounding whitespace"""
+        pieces = (self.decode([i]).strip() for i in self.encode(text))
+        return [piece for piece in pieces if piece]
+
+    def encode_batch(self, texts, max_length=None, add_eos=False):
+        """Encode several strings into a padded (N, L) int array
+
+        Returns (ids, lengths); rows are right-padded with PAD_ID and cut
+        to max_length when given.
+        """
+        encoded = [self.encode(text, add_eos=add_eos) for text in texts]
+        lengths = np.array([len(ids) for ids in encoded], dtype=np.int64)
+        width = int(lengths.max()) if len(encoded) else 0
+        if max_length is not None:
+            width = min(width, max_length)
+            np.minimum(lengths, width, out=lengths)
+        batch = np.full((len(encoded), width), PAD_ID, dtype=np.int64)
+        for row, ids in enumerate(encoded):
+            batch[row, :lengths[row]] = ids[:width]
+        return batch, lengths
+
+    def decode_batch(self, batch, lengths=None):
+        """Decode a padded (N, L) int array back into strings"""
+        batch = np.asarray(batch)
+        if lengths is None:
+            return [self.decode(row) for row in batch]
+        return [self.decode(row[:length]) for row, length in zip(batch, lengths)]
+
+    # --- Persistence ---
+
+    def save(self, filename):
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump({
+                "type": "byte_bpe",
+                "version": 1,
+                "special_tokens": SPECIAL_TOKENS,
+                "merges": self.merges,
+            }, f)
+
+    @classmethod
+    def load(cls, filename, cache_size=10000):
+        with open(filename, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("type") != "byte_bpe" or data.get("special_tokens") != SPECIAL_TOKENS:
+            raise ValueError(f"{filename} is not a compatible BPE tokenizer file")
+        return cls([tuple(pair) for pair in data["merges"]], cache_size=cache_size)
@@ -0,0 +1,238 @@
+"""Training loop for TermAI models on collected chat logs
+
+Runs on CPU with NumPy only:
+
+    python -m termAi.train --logs termchat_logs.jsonl --steps 2000
+
+The logs written by ChatLogger are tokenized into one stream (each turn
+"input\\noutput" followed by <eos>) and the model learns to predict the
+next token of random windows of it.
+"""
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+from .checkpoint import load_checkpoint, save_checkpoint
+from .core import cross_entropy
+from .data_collector import ChatLogger
+from .models import MiniGPT
+from .tokenizer import BPETokenizer
+
+
+# --- Optimizers ---
+# Both update parameter arrays in place and keep their state in buffers
+# allocated once, so a step allocates nothing per parameter.
+
+class SGD:
+    def __init__(self, params, lr=0.01, momentum=0.0, weight_decay=0.0):
+        self.params = list(params)
+        self.lr = lr
+        self.momentum = momentum
+        self.weight_decay = weight_decay
+        self.velocity = [np.zeros_like(p.data) for p in self.params] if momentum else None
+
+    def zero_grad(self):
+        for p in self.params:
+            p.zero_grad()
+
+    def step(self):
+        for i, p in enumerate(self.params):
+            if p.grad is None:
+                continue
+            grad = p.grad
+            if self.weight_decay:
+                grad = grad + self.weight_decay * p.data
+            if self.velocity is not None:
+                v = self.velocity[i]
+                v *= self.momentum
+                v += grad
+                grad = v
+            p.data -= self.lr * grad
+
+
+class Adam:
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-8, weight_decay=0.0):
+        self.params = list(params)
+        self.lr = lr
+        self.beta1, self.beta2 = betas
+        self.eps = eps
+        self.weight_decay = weight_decay
+        self.m = [np.zeros_like(p.data) for p in self.params]
+        self.v = [np.zeros_like(p.data) for p in self.params]
+        self._scratch = [np.empty_like(p.data) for p in self.params]
+        self.t = 0
+
+    def zero_grad(self):
+        for p in self.params:
+            p.zero_grad()
+
+    def step(self):
+        self.t += 1
+        # Bias corrections folded into the step size
+        step_size = self.lr * math.sqrt(1 - self.beta2 ** self.t) / (1 - self.beta1 ** self.t)
+        for p, m, v, tmp in zip(self.params, self.m, self.v, self._scratch):
+            if p.grad is None:
+                continue
+            grad = p.grad
+            if self.weight_decay:
+                # Decoupled weight decay (AdamW)
+                p.data -= self.lr * self.weight_decay * p.data
+            m *= self.beta1
+            m += (1 - self.beta1) * grad
+            v *= self.beta2
+            np.multiply(grad, grad, out=tmp)
+            tmp *= 1 - self.beta2
+            v += tmp
+            np.sqrt(v, out=tmp)
+            tmp += self.eps
+            np.divide(m, tmp, out=tmp)
+            tmp *= step_size
+            p.data -= tmp
+
+
+def clip_grad_norm(params, max_norm):
+    """Scale gradients in place so their global L2 norm is at most max_norm
+
+    Returns the norm before clipping.
+    """
+    grads = [p.grad for p in params if p.grad is not None]
+    total = math.sqrt(sum(float(np.vdot(g, g)) for g in grads))
+    if total > max_norm:
+        scale = max_norm / (total + 1e-6)
+        for g in grads:
+            g *= scale
+    return total
+
+
+def lr_schedule(step, base_lr, warmup_steps=100, total_steps=1000, min_lr=0.0):
+    """Linear warmup followed by cosine decay to min_lr"""
+    if step < warmup_steps:
+        return base_lr * (step + 1) / warmup_steps
+    progress = min(1.0, (step - warmup_steps) / max(1, total_steps - warmup_steps))
+    return min_lr + 0.5 * (base_lr - min_lr) * (1 + math.cos(math.pi * progress))
+
+
+# --- Data ---
+
+def iter_log_texts(filename="termchat_logs.jsonl"):
+    """Yield one "input\\noutput" string per logged turn, across rotated shards"""
+    for entry in ChatLogger(filename).iter_records():
+        user_input, output = entry.get("input"), entry.get("output")
+        if isinstance(user_input, str) and isinstance(output, str):
+            yield f"{user_input}\n{output}"
+
+
+def build_token_stream(tokenizer, texts):
+    """Concatenate encoded texts, each ended by <eos>, into one int32 array"""
+    chunks = [np.asarray(tokenizer.encode(text, add_eos=True), dtype=np.int32) for text in texts]
+    return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+
+
+def iter_batches(tokens, batch_size, context_length, rng):
+    """Endless random (inputs, targets) windows of shape (batch_size, context_length)
+
+    Targets are the inputs shifted by one token.
+    """
+    if len(tokens) <= context_length:
+        raise ValueError(f"Need more than {context_length} tokens to train, got {len(tokens)}")
+    offsets = np.arange(context_length + 1)
+    while True:
+        starts = rng.integers(0, len(tokens) - context_length, size=batch_size)
+        window = tokens[starts[:, None] + offsets]
+        yield window[:, :-1], window[:, 1:]
+
+
+# --- Loop ---
+
+def train(model, tokens, steps=1000, batch_size=16, context_length=64, lr=3e-3,
+          warmup_steps=100, min_lr=None, max_grad_norm=1.0, weight_decay=0.0,
+          optimizer="adam", log_every=50, checkpoint_path=None, checkpoint_every=500, seed=0):
+    """Train model on a token stream; returns the list of per-step losses"""
+    params = model.parameters()
+    if optimizer == "adam":
+        opt = Adam(params, lr=lr, weight_decay=weight_decay)
+    elif optimizer == "sgd":
+        opt = SGD(params, lr=lr, momentum=0.9, weight_decay=weight_decay)
+    else:
+        raise ValueError(f"Unknown optimizer: {optimizer}")
+    min_lr = lr * 0.1 if min_lr is None else min_lr
+
+    rng = np.random.default_rng(seed)
+    batches = iter_batches(tokens, batch_size, context_length, rng)
+    losses = []
+    window_tokens, window_start = 0, time.perf_counter()
+
+    for step in range(steps):
+        inputs, targets = next(batches)
+        opt.lr = lr_schedule(step, lr, warmup_steps, steps, min_lr)
+
+        opt.zero_grad()
+        loss = cross_entropy(model(inputs), targets)
+        loss.backward()
+        grad_norm = clip_grad_norm(params, max_grad_norm)
+        opt.step()
+
+        losses.append(float(loss.data))
+        window_tokens += inputs.size
+
+        if log_every and (step + 1) % log_every == 0:
+            elapsed = time.perf_counter() - window_start
+            recent = losses[-log_every:]
+            print(f"[Train] step {step + 1}/{steps} loss {sum(recent) / len(recent):.4f} "
+                  f"lr {opt.lr:.2e} grad_norm {grad_norm:.2f} "
+                  f"{window_tokens / elapsed:.0f} tokens/sec")
+            window_tokens, window_start = 0, time.perf_counter()
+
+        if checkpoint_path and checkpoint_every and (step + 1) % checkpoint_every == 0:
+            save_checkpoint(model, checkpoint_path, metadata={"step": step + 1})
+            print(f"[Train] Saved checkpoint to {checkpoint_path}")
+
+    if checkpoint_path and not (checkpoint_every and steps % checkpoint_every == 0):
+        save_checkpoint(model, checkpoint_path, metadata={"step": steps})
+        print(f"[Train] Saved checkpoint to {checkpoint_path}")
+    return losses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a MiniGPT on TermChat logs")
+    parser.add_argument("--logs", default="termchat_logs.jsonl")
+    parser.add_argument("--tokenizer", default="termai_tokenizer.json",
+                        help="Tokenizer file; trained from the logs if it doesn't exist")
+    parser.add_argument("--vocab-size", type=int, default=1000)
+    parser.add_argument("--embed-size", type=int, default=64)
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--heads", type=int, default=4)
+    parser.add_argument("--context", type=int, default=64)
+    parser.add_argument("--steps", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--lr", type=float, default=3e-3)
+    parser.add_argument("--optimizer", choices=["adam", "sgd"], default="adam")
+    parser.add_argument("--checkpoint", default="termai_model.ckpt")
+    parser.add_argument("--checkpoint-every", type=int, default=500)
+    parser.add_argument("--resume", action="store_true", help="Start from the existing checkpoint")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.exists(args.tokenizer):
+        tokenizer = BPETokenizer.load(args.tokenizer)
+    else:
+        print(f"[Train] Training tokenizer on {args.logs}...")
+        tokenizer = BPETokenizer.train_from_logs(args.logs, vocab_size=args.vocab_size)
+        tokenizer.save(args.tokenizer)
+    tokens = build_token_stream(tokenizer, iter_log_texts(args.logs))
+    print(f"[Train] {len(tokens)} tokens, vocabulary of {tokenizer.vocab_size}")
+
+    np.random.seed(args.seed)
+    model = MiniGPT(tokenizer.vocab_size, args.embed_size, args.layers,
+                    context_length=args.context, num_heads=args.heads)
+    if args.resume and os.path.exists(args.checkpoint):
+        state, header = load_checkpoint(args.checkpoint)
+        model.load_state_dict(state, copy=True)
+        print(f"[Train] Resumed from {args.checkpoint} (step {header['metadata'].get('step', 0)})")
+    train(model, tokens, steps=args.steps, batch_size=args.batch_size,
+          context_length=args.context, lr=args.lr, optimizer=args.optimizer,
+          checkpoint_path=args.checkpoint, checkpoint_every=args.checkpoint_every,
+          seed=args.seed)
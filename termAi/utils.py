@@ -1,8 +1,17 @@
 """Utility functions for TermAI"""
 import re
 
+_tokenizer = None
+
+def set_tokenizer(tokenizer):
+    """Route tokenize() through a trained tokenizer (None restores the regex)"""
+    global _tokenizer
+    _tokenizer = tokenizer
+
 def tokenize(text):
-    """Simple tokenization"""
+    """Simple tokenization, or the tokenizer given to set_tokenizer()"""
+    if _tokenizer is not None:
+        return _tokenizer.tokens(text.lower())
     return re.findall(r'\w+', text.lower())
 
 def preprocess_message(message):
@@ -6,12 +6,13 @@ Tests the AI functionality by sending messages and checking responses
 
 import paho.mqtt.client as mqtt
 import json
+import os
 import time
 import threading
 
-# Test configuration
-BROKER = "broker.emqx.io"
-PORT = 1883
+# Test configuration (MQTT_HOST=127.0.0.1 for a local or embedded broker)
+BROKER = os.getenv("MQTT_HOST", "broker.emqx.io")
+PORT = int(os.getenv("MQTT_PORT", 1883))
 INPUT_TOPIC = "termchat/input"
 OUTPUT_TOPIC = "termchat/output"
 
@@ -29,7 +30,9 @@ TEST_MESSAGES = [
 ]
 
 class AITester:
-    def __init__(self):
+    def __init__(self, host=BROKER, port=PORT):
+        self.host = host
+        self.port = port
         self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         self.responses = []
         self.test_complete = False
@@ -61,7 +64,11 @@ class AITester:
         print(f"📤 Sending: {text}")
         self.client.publish(INPUT_TOPIC, json.dumps(message))
         
-    def run_tests(self):
+    def run_tests(self, messages=TEST_MESSAGES, delay=3, settle=5):
+        """Send each message, wait for replies; returns the AI responses
+
+        delay should stay above the service's 1 s per-user cooldown.
+        """
         print("🚀 Starting AI Intelligence Test...")
         print("=" * 50)
         
@@ -70,31 +77,31 @@ class AITester:
         self.client.on_message = self.on_message
         
         try:
-            self.client.connect(BROKER, PORT, 60)
+            self.client.connect(self.host, self.port, 60)
             self.client.loop_start()
             
             # Wait for connection
             time.sleep(2)
             
             # Send test messages
-            for i, test_msg in enumerate(TEST_MESSAGES):
-                print(f"\n🧪 Test {i+1}/{len(TEST_MESSAGES)}")
+            for i, test_msg in enumerate(messages):
+                print(f"\n🧪 Test {i+1}/{len(messages)}")
                 self.send_test_message(test_msg)
-                time.sleep(3)  # Wait for response
+                time.sleep(delay)  # Wait for response
                 
             # Wait for final responses
-            time.sleep(5)
+            time.sleep(settle)
             
             # Results
             print("\n" + "=" * 50)
             print("📊 TEST RESULTS")
             print("=" * 50)
-            print(f"Messages sent: {len(TEST_MESSAGES)}")
+            print(f"Messages sent: {len(messages)}")
             print(f"AI responses: {len(self.responses)}")
             
             if len(self.responses) > 0:
                 print("✅ AI is responding!")
-                print(f"Response rate: {len(self.responses)/len(TEST_MESSAGES)*100:.1f}%")
+                print(f"Response rate: {len(self.responses)/len(messages)*100:.1f}%")
                 
                 # Check intelligence
                 smart_indicators = ['python', 'function', 'lietuvą', 'quantum', 'dirbtinis']
@@ -116,6 +123,13 @@ class AITester:
         finally:
             self.client.loop_stop()
             self.client.disconnect()
+        return self.responses
+
+def test_ai_responds(termchat_service):
+    """Runs against the embedded broker from conftest.py"""
+    tester = AITester(*termchat_service)
+    responses = tester.run_tests(TEST_MESSAGES[:3], delay=1.2, settle=1)
+    assert len(responses) == 3
 
 if __name__ == "__main__":
     tester = AITester()
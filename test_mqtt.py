@@ -5,9 +5,15 @@ Simple MQTT test for public deployment
 
 import paho.mqtt.client as mqtt
 import json
+import os
 import time
 
-def test_mqtt_chat():
+# MQTT_HOST=127.0.0.1 for a local or embedded broker
+BROKER = os.getenv("MQTT_HOST", "broker.emqx.io")
+PORT = int(os.getenv("MQTT_PORT", 1883))
+
+def run_mqtt_chat(host=BROKER, port=PORT, timeout=10):
+    """(connected, messages received) after one 'ai' message to the service"""
     print("🔗 Testing MQTT Chat Connection")
     print("=" * 40)
     
@@ -50,12 +56,12 @@ def test_mqtt_chat():
     client.on_message = on_message
     
     try:
-        client.connect("broker.emqx.io", 1883, 60)
+        client.connect(host, port, 60)
         client.loop_start()
         
         # Wait for connection and messages
-        for i in range(10):
-            time.sleep(1)
+        for i in range(timeout * 10):
+            time.sleep(0.1)
             if connected and messages_received > 0:
                 break
         
@@ -69,6 +75,13 @@ def test_mqtt_chat():
             
     except Exception as e:
         print(f"❌ MQTT error: {e}")
+    return connected, messages_received
+
+def test_mqtt_chat(termchat_service):
+    """Runs against the embedded broker from conftest.py"""
+    connected, messages_received = run_mqtt_chat(*termchat_service)
+    assert connected
+    assert messages_received > 0
 
 if __name__ == "__main__":
-    test_mqtt_chat()
\ No newline at end of file
+    run_mqtt_chat()
\ No newline at end of file
@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+import backend
+from termAi.checkpoint import LocalModel
+from termAi.models import MiniGPT
+from termAi.tokenizer import BPETokenizer
+
+
+@pytest.fixture
+def local_model(monkeypatch):
+    tokenizer = BPETokenizer.train(["labas, kaip sekasi?", "hello there", "ai hello"] * 5, vocab_size=300)
+    model = MiniGPT(tokenizer.vocab_size, 16, 1, context_length=32)
+    monkeypatch.setattr(backend, "local_model", LocalModel(model, tokenizer))
+    return model
+
+
+def test_concurrent_replies_do_not_overlap(local_model, monkeypatch):
+    generate = local_model.generate
+    active, overlaps = [0], []
+
+    def tracked_generate(*args, **kwargs):
+        active[0] += 1
+        overlaps.append(active[0] > 1)
+        time.sleep(0.05)  # Widen the window for a second caller
+        try:
+            return generate(*args, **kwargs)
+        finally:
+            active[0] -= 1
+
+    monkeypatch.setattr(local_model, "generate", tracked_generate)
+    replies = [None, None]
+
+    def reply(i):
+        replies[i] = backend.local_reply("labas ai")
+
+    threads = [threading.Thread(target=reply, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert overlaps == [False, False]
+    assert all(isinstance(r, str) and r for r in replies)
+
+
+def test_generate_failure_falls_back_to_simple_bot(local_model, monkeypatch):
+    def broken_generate(*args, **kwargs):
+        raise ValueError("arena size mismatch")
+
+    monkeypatch.setattr(local_model, "generate", broken_generate)
+    assert backend.local_reply("labas ai") == backend.local_bot.think("labas ai")
+
+
+def test_get_ai_response_survives_local_model_failure(local_model, monkeypatch):
+    monkeypatch.setattr(local_model, "generate", lambda *a, **k: 1 / 0)
+    logged = []
+    monkeypatch.setattr(backend.logger, "log_interaction", lambda q, a: logged.append((q, a)))
+    reply = backend.get_ai_response("labas ai")
+    assert reply == backend.local_bot.think("labas ai")
+    assert logged == [("labas ai", reply)]
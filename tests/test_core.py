@@ -0,0 +1,84 @@
+"""termAi.core autograd against finite differences"""
+import numpy as np
+import pytest
+
+from termAi.core import Tensor, cross_entropy, no_grad
+
+
+def numeric_grad(f, x, eps=1e-6):
+    """Central-difference gradient of the scalar f() with respect to array x (perturbed in place)"""
+    grad = np.zeros_like(x)
+    for i in np.ndindex(x.shape):
+        original = x[i]
+        x[i] = original + eps
+        plus = f()
+        x[i] = original - eps
+        minus = f()
+        x[i] = original
+        grad[i] = (plus - minus) / (2 * eps)
+    return grad
+
+
+def check_grads(loss_fn, *shapes, seed=0):
+    """Compare backward() with finite differences for loss_fn(*tensors) -> scalar Tensor"""
+    rng = np.random.default_rng(seed)
+    tensors = [Tensor(rng.standard_normal(shape), requires_grad=True) for shape in shapes]
+    loss_fn(*tensors).backward()
+    for t in tensors:
+        expected = numeric_grad(lambda: float(loss_fn(*tensors).data), t.data)
+        np.testing.assert_allclose(t.grad, expected, rtol=1e-5, atol=1e-7)
+
+
+def weighted_sum(out, seed=1):
+    """Scalar with a distinct weight per element, so every output gradient differs"""
+    weights = np.random.default_rng(seed).standard_normal(out.shape)
+    return (out * weights).sum()
+
+
+def layer_norm(x, gain, bias, eps=1e-5):
+    """Layer norm over the last axis built from Tensor ops (the models use none yet)"""
+    centred = x - x.mean(axis=-1, keepdims=True)
+    variance = (centred ** 2).mean(axis=-1, keepdims=True)
+    return centred / (variance + eps) ** 0.5 * gain + bias
+
+
+def test_matmul_grad():
+    check_grads(lambda a, b: weighted_sum(a @ b), (3, 4), (4, 5))
+    # Batched with a broadcast right operand, as in Linear
+    check_grads(lambda a, b: weighted_sum(a @ b), (2, 3, 4), (4, 5))
+
+
+def test_softmax_grad():
+    check_grads(lambda x: weighted_sum(x.softmax(axis=-1)), (3, 5))
+    check_grads(lambda x: weighted_sum(x.softmax(axis=0)), (3, 5))
+
+
+def test_layer_norm_grad():
+    check_grads(lambda x, gain, bias: weighted_sum(layer_norm(x, gain, bias)), (2, 3, 6), (6,), (6,))
+
+
+def test_cross_entropy_grad():
+    targets = np.array([[1, 4, 0], [2, 2, 3]])
+    check_grads(lambda logits: cross_entropy(logits, targets), (2, 3, 5))
+    check_grads(lambda logits: cross_entropy(logits, targets, ignore_index=2), (2, 3, 5))
+
+
+def test_no_grad_builds_no_graph():
+    x = Tensor(np.ones((2, 3)), requires_grad=True)
+    w = Tensor(np.ones((3, 4)), requires_grad=True)
+    with no_grad():
+        loss = cross_entropy((x @ w).softmax(), np.zeros(2, dtype=int))
+    assert not loss.requires_grad
+    assert loss._parents == ()
+    with pytest.raises(RuntimeError, match="does not require grad"):
+        loss.backward()
+    assert x.grad is None and w.grad is None
+
+    # Grad mode comes back afterwards
+    loss = cross_entropy(x @ w, np.zeros(2, dtype=int))
+    assert loss.requires_grad and loss._parents
+
+
+def test_backward_without_requires_grad_raises():
+    with pytest.raises(RuntimeError, match="does not require grad"):
+        (Tensor(np.ones(3)) * 2).sum().backward()
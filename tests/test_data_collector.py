@@ -0,0 +1,166 @@
+import atexit
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from termAi.data_collector import ChatLogger
+
+
+def write_records(filename, writer, count, **options):
+    logger = ChatLogger(filename, **options)
+    for i in range(count):
+        logger.log_interaction(f"{writer}-{i}", "ok")
+    logger.close()
+
+
+def test_concurrent_writers_with_rotation(tmp_path):
+    filename = str(tmp_path / "log.jsonl")
+    logger = ChatLogger(filename, max_bytes=2000, compress="gzip", block_records=8,
+                        flush_interval=0.01, buffer_records=5)
+
+    def write(w):
+        for i in range(200):
+            logger.log_interaction(f"{w}-{i}", "ok")
+            time.sleep(0.0005)  # Spread over many flushes and rotations
+
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logger.close()
+
+    reader = ChatLogger(filename)
+    assert len(reader.shards()) > 2
+    inputs = [record["input"] for record in reader.iter_records()]
+    assert sorted(inputs) == sorted(f"{w}-{i}" for w in range(4) for i in range(200))
+    for w in range(4):
+        # Each writer's records stay in the order it logged them
+        mine = [int(x.split("-")[1]) for x in inputs if x.startswith(f"{w}-")]
+        assert mine == sorted(mine)
+    assert [reader.get_record(n)["input"] for n in range(len(inputs))] == inputs
+
+
+def test_log_interaction_does_not_wait_for_rotation(tmp_path, monkeypatch):
+    filename = str(tmp_path / "log.jsonl")
+    logger = ChatLogger(filename, max_bytes=1, compress="gzip", flush_interval=0.01)
+    compress = logger._write_compressed
+    rotating = threading.Event()
+
+    def slow_compress(*args):
+        rotating.set()
+        time.sleep(0.5)
+        compress(*args)
+
+    monkeypatch.setattr(logger, "_write_compressed", slow_compress)
+    logger.log_interaction("first", "ok")
+    logger.flush()
+    logger.log_interaction("second", "ok")  # The flusher now rotates the first file
+    assert rotating.wait(2)
+    started = time.monotonic()
+    logger.log_interaction("third", "ok")
+    assert time.monotonic() - started < 0.1
+    logger.close()
+    assert [r["input"] for r in ChatLogger(filename).iter_records()] == ["first", "second", "third"]
+
+
+def test_processes_do_not_rotate_the_same_file(tmp_path):
+    filename = str(tmp_path / "log.jsonl")
+    ctx = multiprocessing.get_context("fork")
+    processes = [ctx.Process(target=write_records, args=(filename, w, 300),
+                             kwargs=dict(max_bytes=300, flush_interval=0.001, buffer_records=1))
+                 for w in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    reader = ChatLogger(filename)
+    inputs = [record["input"] for record in reader.iter_records()]
+    assert sorted(inputs) == sorted(f"{w}-{i}" for w in range(4) for i in range(300))
+    assert len(reader) == len(inputs)
+
+
+def test_only_writing_loggers_register_at_exit(tmp_path, monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    monkeypatch.setattr(atexit, "unregister", registered.remove)
+    reader = ChatLogger(str(tmp_path / "log.jsonl"))
+    list(reader.iter_records())
+    assert registered == []
+
+    writer = ChatLogger(str(tmp_path / "log.jsonl"))
+    writer.log_interaction("hi", "ok")
+    assert registered == [writer.close]
+    writer.close()
+    assert registered == []
+
+
+def test_reopened_index_seeks_to_records(tmp_path):
+    filename = str(tmp_path / "log.jsonl")
+    write_records(filename, "a", 20)
+
+    reader = ChatLogger(filename)
+    offsets = reader._index(filename)
+    assert len(offsets) == 20
+    with open(filename, "rb") as f:
+        for i, offset in enumerate(offsets):
+            f.seek(offset)
+            assert json.loads(f.readline())["input"] == f"a-{i}"
+    assert reader.get_record(13)["input"] == "a-13"
+
+    # A second session appends to the same index
+    write_records(filename, "b", 5)
+    reader = ChatLogger(filename)
+    assert os.path.getsize(filename + ".idx") == 25 * 8
+    assert [reader.get_record(n)["input"] for n in (0, 19, 20, 24)] == ["a-0", "a-19", "b-0", "b-4"]
+
+
+@pytest.mark.parametrize("compress", [None, "gzip"])
+def test_size_rollover_keeps_records_readable(tmp_path, compress):
+    filename = str(tmp_path / "log.jsonl")
+    logger = ChatLogger(filename, max_bytes=500, compress=compress, block_records=4)
+    for i in range(60):
+        logger.log_interaction(f"a-{i}", "ok")
+        if i % 7 == 6:
+            logger.flush()  # Rotation is checked once per batch
+    logger.close()
+
+    reader = ChatLogger(filename)
+    shards = reader.shards()
+    assert len(shards) > 2
+    assert all(os.path.exists(shard + ".idx") for shard in shards)
+    expected = [f"a-{i}" for i in range(60)]
+    assert [record["input"] for record in reader.iter_records()] == expected
+    assert len(reader) == 60
+    # Random access across segment boundaries, backwards to defeat the block cache
+    assert [reader.get_record(n)["input"] for n in reversed(range(60))] == expected[::-1]
+
+
+def test_truncated_last_record_is_recovered(tmp_path):
+    filename = str(tmp_path / "log.jsonl")
+    write_records(filename, "a", 5)
+    # A writer died mid-append: half a record and half an index entry
+    with open(filename, "ab") as f:
+        f.write(b'{"input": "a-5", "outp')
+    with open(filename + ".idx", "ab") as f:
+        f.write(b"\x01\x02\x03")
+
+    reader = ChatLogger(filename)
+    assert len(reader) == 5
+    assert [record["input"] for record in reader.iter_records()] == [f"a-{i}" for i in range(5)]
+    assert reader.get_record(-1)["input"] == "a-4"
+
+    # The next write cuts the partial record off instead of appending to it
+    write_records(filename, "b", 2)
+    reader = ChatLogger(filename)
+    assert [record["input"] for record in reader.iter_records()] == [f"a-{i}" for i in range(5)] + ["b-0", "b-1"]
+    assert os.path.getsize(filename + ".idx") == 7 * 8
+    assert reader.get_record(5)["input"] == "b-0"
+    with open(filename, "rb") as f:
+        assert all(json.loads(line) for line in f)
@@ -0,0 +1,71 @@
+"""AsyncioMQTT: paho on the event loop, connecting off it"""
+import asyncio
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+from mqtt_asyncio import AsyncioMQTT
+
+
+class Backoff:
+    def next_delay(self):
+        return 0.05
+
+
+def test_slow_connect_does_not_stall_the_loop(mqtt_broker):
+    async def run():
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        connect = client.connect
+        connected = asyncio.Event()
+        received = []
+        loop = asyncio.get_running_loop()
+
+        def slow_connect(*args, **kwargs):
+            time.sleep(0.5)  # Like DNS or a SYN to a blackholed broker
+            return connect(*args, **kwargs)
+
+        client.connect = slow_connect
+        client.on_connect = lambda c, u, flags, rc, p=None: (c.subscribe("test/asyncio"), connected.set())
+        client.on_message = lambda c, u, message: received.append((threading.get_ident(), message.payload))
+        network = AsyncioMQTT(client, Backoff())
+        network.connect(mqtt_broker.host, mqtt_broker.port)
+
+        # The loop keeps ticking while the connect is in progress
+        started, ticks = loop.time(), 0
+        while not connected.is_set():
+            await asyncio.sleep(0.01)
+            ticks += 1
+            assert loop.time() - started < 5
+        assert ticks > 20
+
+        await asyncio.sleep(0.1)  # SUBACK
+        client.publish("test/asyncio", b"hi")
+        while not received and loop.time() - started < 5:
+            await asyncio.sleep(0.01)
+        await network.disconnect()
+        return received
+
+    assert asyncio.run(run()) == [(threading.get_ident(), b"hi")]
+
+
+def test_reconnect_retries_off_the_loop():
+    async def run():
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        attempts = []
+
+        def refused(*args, **kwargs):
+            attempts.append(threading.get_ident())
+            raise ConnectionRefusedError("refused")
+
+        client.connect = refused
+        client.reconnect = refused
+        network = AsyncioMQTT(client, Backoff())
+        network.connect("127.0.0.1", 1)
+        await asyncio.sleep(0.3)
+        await network.disconnect()
+        return attempts
+
+    attempts = asyncio.run(run())
+    assert len(attempts) > 2
+    assert threading.get_ident() not in attempts
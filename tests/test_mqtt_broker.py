@@ -0,0 +1,96 @@
+"""EmbeddedBroker routing: retained messages, wildcards, $share groups"""
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+import pytest
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while not predicate() and time.time() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+@pytest.fixture
+def connect(mqtt_broker):
+    """connect(client_id, subscriptions=(), protocol=...) -> (client, received)"""
+    clients = []
+
+    def connect(client_id, subscriptions=(), protocol=mqtt.MQTTv311):
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id, protocol=protocol)
+        received = []
+        subscribed = threading.Event()
+        client.on_message = lambda c, u, message: received.append((message.topic, message.payload, message.retain))
+        client.on_subscribe = lambda c, u, mid, reason_codes, p=None: subscribed.set()
+        if protocol == mqtt.MQTTv5:
+            client.connect(mqtt_broker.host, mqtt_broker.port, 60, properties=Properties(PacketTypes.CONNECT))
+        else:
+            client.connect(mqtt_broker.host, mqtt_broker.port, 60)
+        client.loop_start()
+        clients.append(client)
+        if subscriptions:
+            client.subscribe([(topic, 1) for topic in subscriptions])
+            assert subscribed.wait(5)
+        return client, received
+
+    yield connect
+    for client in clients:
+        client.disconnect()
+        client.loop_stop()
+
+
+def test_retained_message_reaches_later_subscribers(connect):
+    publisher, _ = connect("retain-pub")
+    publisher.publish("test/retain/state", b"first", qos=1, retain=True).wait_for_publish(5)
+    publisher.publish("test/retain/state", b"latest", qos=1, retain=True).wait_for_publish(5)
+
+    _, received = connect("retain-sub", ["test/retain/+"])
+    assert wait_for(lambda: received)
+    time.sleep(0.1)
+    assert received == [("test/retain/state", b"latest", True)]
+
+    # Live messages are not flagged retained; an empty retained payload clears it
+    publisher.publish("test/retain/state", b"live", qos=1).wait_for_publish(5)
+    assert wait_for(lambda: len(received) == 2)
+    assert received[1] == ("test/retain/state", b"live", False)
+    publisher.publish("test/retain/state", b"", qos=1, retain=True).wait_for_publish(5)
+    _, late = connect("retain-late", ["test/retain/#"])
+    time.sleep(0.2)
+    assert late == []
+
+
+def test_wildcards(connect):
+    _, single = connect("wild-plus", ["test/wild/room/+/state"])
+    _, multi = connect("wild-hash", ["test/wild/#"])
+    publisher, _ = connect("wild-pub")
+    topics = ["test/wild/room/lab/state", "test/wild/room/lab/state/extra", "test/wild/room/state",
+              "test/wild", "test/other/room/lab/state"]
+    for topic in topics:
+        publisher.publish(topic, topic, qos=1).wait_for_publish(5)
+
+    assert wait_for(lambda: len(multi) == 4)
+    time.sleep(0.1)
+    assert [topic for topic, _, _ in single] == ["test/wild/room/lab/state"]
+    # '#' also matches its parent level
+    assert [topic for topic, _, _ in multi] == topics[:4]
+
+
+def test_shared_subscription_round_robin(connect, mqtt_broker):
+    _, first = connect("share-1", ["$share/workers/test/jobs/#"], mqtt.MQTTv5)
+    _, second = connect("share-2", ["$share/workers/test/jobs/#"], mqtt.MQTTv5)
+    _, observer = connect("share-observer", ["test/jobs/#"])
+    publisher, _ = connect("share-pub")
+    for i in range(10):
+        publisher.publish(f"test/jobs/{i}", str(i), qos=1).wait_for_publish(5)
+
+    assert wait_for(lambda: len(first) + len(second) == 10 and len(observer) == 10)
+    time.sleep(0.1)
+    # Each message goes to one member of the group, alternating between them;
+    # ordinary subscribers still see everything
+    assert len(first) == len(second) == 5
+    payloads = sorted(int(payload) for _, payload, _ in first + second)
+    assert payloads == list(range(10))
@@ -0,0 +1,139 @@
+"""mqtt_service admin commands"""
+import asyncio
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import diagnostics
+import mqtt_service
+import state_snapshot
+
+
+@pytest.fixture
+def admin(monkeypatch, tmp_path):
+    """admin(command) -> (reply, whether it was answered synchronously)"""
+    monkeypatch.chdir(tmp_path)  # Diagnostics reports go to ./diagnostics
+
+    def admin(command):
+        async def run():
+            answered = asyncio.get_running_loop().create_future()
+            mqtt_service.run_admin(f"{mqtt_service.admin_token} {command}", answered.set_result)
+            immediate = answered.done()
+            return await asyncio.wait_for(answered, 10), immediate
+        return asyncio.run(run())
+    return admin
+
+
+def test_blocking_commands_run_off_the_event_loop(admin, monkeypatch):
+    threads = []
+    structure_sizes = diagnostics.structure_sizes
+
+    def record_thread(structures):
+        threads.append(threading.current_thread())
+        return structure_sizes(structures)
+
+    monkeypatch.setattr(diagnostics, "structure_sizes", record_thread)
+    reply, immediate = admin("memory")
+    assert reply.startswith("RSS ") and not immediate
+    assert threads and threads[0] is not threading.main_thread()
+
+    reply, immediate = admin("heap snapshot")
+    assert reply.startswith("tracemalloc started") and not immediate
+    reply, _ = admin("heap stop")
+    assert reply == "tracemalloc stopped"
+
+
+def test_quick_commands_answer_immediately(admin):
+    assert admin("outbound") == ("Outbound publisher not running", True)
+    assert admin("profile stop") == ("Profiler is not running", False)
+
+
+def test_blocking_command_errors_are_reported(admin, monkeypatch):
+    def broken(structures):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(diagnostics, "structure_sizes", broken)
+    assert admin("memory") == ("Admin error: disk full", False)
+
+
+def test_snapshot_command_writes_off_the_event_loop(admin, monkeypatch, tmp_path):
+    threads = []
+    save = state_snapshot.save
+
+    def record_thread(filename, state, meta=None):
+        threads.append(threading.current_thread())
+        return save(filename, state, meta)
+
+    monkeypatch.setattr(state_snapshot, "STATE_SNAPSHOT_FILE", str(tmp_path / "state.snap"))
+    monkeypatch.setattr(state_snapshot, "save", record_thread)
+    monkeypatch.setattr(mqtt_service, "_last_snapshot", None)
+    reply, immediate = admin("snapshot")
+    assert reply.startswith("Saved ") and not immediate
+    assert threads and threads[0] is not threading.main_thread()
+    state, _, _ = state_snapshot.load(str(tmp_path / "state.snap"))
+    assert state["current_room"] == mqtt_service.current_room
+    assert admin("snapshot") == ("State unchanged since the last snapshot", False)
+
+
+@pytest.fixture
+def snapshot_file(monkeypatch, tmp_path):
+    path = str(tmp_path / "state.snap")
+    monkeypatch.setattr(state_snapshot, "STATE_SNAPSHOT_FILE", path)
+    for name, value in [("active_users", mqtt_service.presence.PresenceStore()), ("room_histories", {}),
+                        ("user_histories", {}), ("conv_history", []), ("_last_snapshot", None)]:
+        monkeypatch.setattr(mqtt_service, name, value)
+    return path
+
+
+def test_restore_accepts_numeric_user_ids(snapshot_file):
+    state_snapshot.save(snapshot_file, {"active_users": [[5, 100.0, 2, "library"], ["ann", 90.0, 1, None]],
+                                        "conv_history": [{"role": "user", "content": "5: hi"}]},
+                        {"workers": mqtt_service.SERVICE_WORKERS})
+    mqtt_service.restore_state()
+    assert mqtt_service.active_users.get(5).room == "library"
+    assert "ann" in mqtt_service.active_users
+    assert len(mqtt_service.conv_history) == 1
+
+
+def test_restore_skips_a_snapshot_it_cannot_apply(snapshot_file):
+    state_snapshot.save(snapshot_file, {"conv_history": [{"role": "user", "content": "hi"}],
+                                        "active_users": [["ann"]]},
+                        {"workers": mqtt_service.SERVICE_WORKERS})
+    mqtt_service.restore_state()  # Logged, not raised
+    assert mqtt_service.conv_history == [] and len(mqtt_service.active_users) == 0
+    assert mqtt_service._last_snapshot is None
+
+
+def test_replies_fan_out_only_where_configured(monkeypatch):
+    topics = []
+    monkeypatch.setattr(mqtt_service, "publish_event", lambda client, topic, data, wire=None: topics.append(topic))
+    # Default: one copy on the global topic, which every shipped client reads
+    mqtt_service.publish_reply(None, "library", {"msg": "hi"})
+    assert topics == ["termchat/output"]
+
+    topics.clear()
+    monkeypatch.setattr(mqtt_service, "MQTT_ROOM_OUTPUT", True)
+    monkeypatch.setattr(mqtt_service, "MQTT_GLOBAL_OUTPUT", False)
+    mqtt_service.publish_reply(None, "library", {"msg": "hi"})
+    assert topics == ["termchat/room/library/output"]
+
+
+def test_late_worker_answers_are_not_taken_for_the_next_request(monkeypatch):
+    supervisor_end, worker_end = multiprocessing.Pipe()
+    monkeypatch.setattr(mqtt_service, "workers", {0: (None, supervisor_end)})
+
+    def worker():
+        request_id, payload = worker_end.recv()
+        time.sleep(0.3)  # Busy past the supervisor's timeout
+        worker_end.send((request_id, f"done {payload}", {}))
+        request_id, payload = worker_end.recv()
+        worker_end.send((request_id, f"done {payload}", {}))
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert mqtt_service.query_workers("slow reset", timeout=0.1) == []
+    time.sleep(0.3)
+    assert mqtt_service.query_workers("users", timeout=2) == [(0, "done users", {})]
+    thread.join()
@@ -0,0 +1,86 @@
+"""Replicas sharing the inbound topics through an MQTT v5 $share group"""
+import json
+import re
+import threading
+import time
+import zlib
+
+import paho.mqtt.client as mqtt
+
+
+def users_by_replica(count=2):
+    """Two user ids for each replica, by the service's crc32 partitioning"""
+    users = {index: [] for index in range(count)}
+    n = 0
+    while any(len(ids) < 2 for ids in users.values()):
+        user = f"user{n}"
+        users[zlib.crc32(user.encode()) % count].append(user)
+        n += 1
+    return users
+
+
+def test_partitioned_users_keep_their_own_room_and_history(start_service, private_broker):
+    tokens = [start_service(MQTT_SHARE_GROUP="chat", REPLICA_COUNT="2", REPLICA_INDEX=str(index),
+                            MQTT_ROOM_OUTPUT="1")
+              for index in range(2)]
+    users = users_by_replica()
+    mover, neighbour = users[0]  # On the same replica
+    other = users[1][0]
+
+    replies = []
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.on_message = lambda c, u, message: replies.append((message.topic, json.loads(message.payload)))
+    client.connect(private_broker.host, private_broker.port)
+    client.subscribe([("termchat/room/+/output", 0), ("termchat/output", 0)])
+    client.loop_start()
+    time.sleep(0.3)
+
+    def send(user, text, ref):
+        client.publish("termchat/input", json.dumps({"id": user, "msg": text, "ref": ref}))
+
+    def reply_topics(ref):
+        return [topic for topic, data in replies if data.get("ref") == ref]
+
+    def wait_for(predicate, timeout=5):
+        deadline = time.time() + timeout
+        while not predicate() and time.time() < deadline:
+            time.sleep(0.05)
+        return predicate()
+
+    send(mover, "ai labas", "m1")
+    send(neighbour, "ai labas", "n1")
+    send(other, "ai labas", "o1")
+    assert wait_for(lambda: all(reply_topics(ref) for ref in ("m1", "n1", "o1")))
+    time.sleep(1.1)  # Per-user cooldown
+    send(mover, "einu į biblioteka", "m2")
+    assert wait_for(lambda: reply_topics("m2"))
+    time.sleep(1.1)
+    send(mover, "ai kas čia?", "m3")
+    send(neighbour, "ai kas čia?", "n3")
+    send(other, "ai kas čia?", "o3")
+    assert wait_for(lambda: all(len(reply_topics(ref)) == 2 for ref in ("m3", "n3", "o3")))
+
+    # Only the user who navigated moved, whichever replica holds the others
+    assert "termchat/room/library/output" in reply_topics("m3")
+    assert "termchat/room/living_room/output" in reply_topics("n3")
+    assert "termchat/room/living_room/output" in reply_topics("o3")
+    # Every request was answered once, by its owner replica
+    for ref in ("m1", "n1", "o1", "m2", "m3", "n3", "o3"):
+        assert sorted(reply_topics(ref))[0] == "termchat/output"
+        assert len(reply_topics(ref)) == 2
+
+    # History: neighbour 2 turns (4 entries) and mover 1 turn since moving
+    # on replica 0; other 2 turns on replica 1
+    for index, token in enumerate(tokens):
+        client.publish("termchat/admin", json.dumps({"id": "admin", "msg": f"{token} status", "ref": f"s{index}"}))
+    # Each replica answers every admin message; only the one whose token it carries accepts it
+    def accepted():
+        return {data["ref"]: data["msg"] for _, data in replies
+                if data.get("ref") in ("s0", "s1") and "INVALID" not in data["msg"]}
+
+    assert wait_for(lambda: len(accepted()) == 2)
+    status = accepted()
+    client.loop_stop()
+    client.disconnect()
+    assert re.search(r"History: 6\b", status["s0"])
+    assert re.search(r"History: 4\b", status["s1"])
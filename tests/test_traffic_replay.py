@@ -0,0 +1,48 @@
+"""traffic_replay: replaying faster than recorded without tripping the rate limit"""
+import argparse
+import json
+import time
+
+import traffic_replay
+
+
+def frame(offset, user, text, topic="termchat/input"):
+    return offset, topic, json.dumps({"id": user, "msg": text}).encode()
+
+
+def write_recording(path, frames):
+    with open(path, "wb") as f:
+        f.write(traffic_replay.MAGIC)
+        for offset, topic, payload in frames:
+            traffic_replay.write_frame(f, offset, topic, payload)
+
+
+def test_alias_users_keeps_each_sender_under_the_cooldown():
+    frames = [frame(0, "ann", "ai one"), frame(1.5, "ann", "ai two"), frame(1.6, "bob", "ai hi"),
+              frame(3.0, "ann", "ai three"), frame(3.1, "ann", "admin", topic="termchat/admin")]
+    assert traffic_replay.alias_users(frames, 1) == {}
+    # 2x: ann's messages are now 0.75s apart
+    assert traffic_replay.alias_users(frames, 2) == {1: "ann~1"}
+    assert traffic_replay.alias_users(frames, 0) == {1: "ann~1", 3: "ann~2"}
+
+
+def test_fast_replay_diffs_clean_against_recorded_pace(termchat_service, tmp_path):
+    host, port = termchat_service
+    recording = str(tmp_path / "traffic.tcr")
+    write_recording(recording, [frame(0, "replayer", "ai one"), frame(1.2, "replayer", "ai two"),
+                                frame(2.4, "replayer", "ai three")])
+
+    def replay(speed):
+        out = str(tmp_path / f"speed{speed}.json")
+        traffic_replay.replay(argparse.Namespace(recording=recording, host=host, port=port,
+                                                 speed=speed, timeout=5, out=out))
+        time.sleep(1.2)  # Let the service's cooldown for "replayer" lapse before the next run
+        return out
+
+    before, after = replay(1), replay(0)
+    with open(after, encoding="utf-8") as f:
+        report = json.load(f)
+    assert report["replies"] == 3 and report["dropped"] == 0
+    assert [m.get("sender") for m in report["messages"]] == [None, "replayer~1", "replayer~2"]
+    args = argparse.Namespace(before=before, after=after, threshold=0.5, min_ms=5, show=10)
+    assert traffic_replay.diff(args) == 0
@@ -0,0 +1,254 @@
+"""Lightweight request tracing for the TermChat service
+
+Each inbound message gets a trace; the stages of handling it are timed as
+spans with the monotonic clock:
+
+    trace = tracing.start_trace("on_message", {"topic": topic})
+    with trace.activate():
+        with tracing.span("parse"):
+            ...
+    trace.finish()
+
+A sampled share of traces (TRACE_SAMPLE_RATE) and every trace slower than
+TRACE_SLOW_MS are exported as OpenTelemetry-style JSON lines to
+TRACE_FILE, and/or POSTed to an OTLP/HTTP collector at TRACE_ENDPOINT,
+from a background thread. Slow traces are also printed with their stage
+breakdown. Tracing is off unless TRACE_FILE or TRACE_ENDPOINT is set (and
+one of the two thresholds is above 0); then span() costs a context-variable
+lookup.
+"""
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", 2000))
+TRACE_FILE = os.getenv("TRACE_FILE", "")  # e.g. traces.jsonl
+TRACE_ENDPOINT = os.getenv("TRACE_ENDPOINT", "")  # e.g. http://localhost:4318/v1/traces
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "termchat")
+
+ENABLED = bool(TRACE_FILE or TRACE_ENDPOINT) and (TRACE_SAMPLE_RATE > 0 or TRACE_SLOW_MS > 0)
+
+_current = contextvars.ContextVar("termchat_trace", default=None)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start", "end")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+        self.start = self.end = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.end = time.perf_counter_ns()
+        self.trace.spans.append(self)
+        self.trace = None  # No trace <-> span cycle for the GC to find
+        return False
+
+
+class Trace:
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.sampled = random.random() < TRACE_SAMPLE_RATE
+        self.spans = []
+        # Wall clock once for export; everything else is monotonic
+        self.wall_start_ns = time.time_ns()
+        self.start = time.perf_counter_ns()
+        self.end = None
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def activate(self):
+        """Make this the trace that tracing.span() records into"""
+        return _Activation(self)
+
+    @property
+    def duration_ms(self):
+        return ((self.end or time.perf_counter_ns()) - self.start) / 1e6
+
+    def finish(self):
+        self.end = time.perf_counter_ns()
+        slow = TRACE_SLOW_MS > 0 and self.duration_ms >= TRACE_SLOW_MS
+        if slow:
+            self.attributes["slow"] = True
+            print(f"[SLOW] {self.name} {self.duration_ms:.1f}ms {self._describe()}")
+        if self.sampled or slow:
+            _exporter.submit(self)
+
+    def stage_breakdown(self):
+        """[(stage name, milliseconds)] in the order the stages ended"""
+        return [(span.name, (span.end - span.start) / 1e6) for span in self.spans]
+
+    def _describe(self):
+        attrs = " ".join(f"{k}={v}" for k, v in self.attributes.items() if k != "slow")
+        stages = " | ".join(f"{name} {ms:.1f}ms" for name, ms in self.stage_breakdown())
+        return f"{attrs} stages: {stages}"
+
+    def to_otlp(self):
+        """The trace as an OTLP/JSON ExportTraceServiceRequest"""
+        trace_id = f"{random.getrandbits(128):032x}"
+        root_id = f"{random.getrandbits(64):016x}"
+
+        def wall(ns):
+            return str(self.wall_start_ns + (ns - self.start))
+
+        spans = [{
+            "traceId": trace_id,
+            "spanId": root_id,
+            "name": self.name,
+            "kind": 2,  # SERVER
+            "startTimeUnixNano": wall(self.start),
+            "endTimeUnixNano": wall(self.end),
+            "attributes": _attributes(self.attributes),
+        }]
+        for span in self.spans:
+            spans.append({
+                "traceId": trace_id,
+                "spanId": f"{random.getrandbits(64):016x}",
+                "parentSpanId": root_id,
+                "name": span.name,
+                "kind": 1,  # INTERNAL
+                "startTimeUnixNano": wall(span.start),
+                "endTimeUnixNano": wall(span.end),
+            })
+        return {"resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": "termchat.tracing"}, "spans": spans}],
+        }]}
+
+
+class _NoTrace:
+    """Stand-in when tracing is disabled; every method is a no-op"""
+    sampled = False
+    duration_ms = 0.0
+
+    def span(self, name):
+        return NO_SPAN
+
+    def set(self, key, value):
+        pass
+
+    def activate(self):
+        return NO_SPAN
+
+    def finish(self):
+        pass
+
+
+NO_TRACE = _NoTrace()
+
+
+class _Activation:
+    __slots__ = ("trace", "token")
+
+    def __init__(self, trace):
+        self.trace = trace
+
+    def __enter__(self):
+        self.token = _current.set(self.trace)
+        return self.trace
+
+    def __exit__(self, *exc):
+        _current.reset(self.token)
+        return False
+
+
+def _attributes(values):
+    out = []
+    for key, value in values.items():
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        out.append({"key": key, "value": typed})
+    return out
+
+
+def start_trace(name, attributes=None):
+    return Trace(name, attributes) if ENABLED else NO_TRACE
+
+
+def current():
+    return _current.get() or NO_TRACE
+
+
+def span(name):
+    """Time a stage of the active trace (no-op without one)"""
+    trace = _current.get()
+    return trace.span(name) if trace is not None else NO_SPAN
+
+
+class _Exporter:
+    """Writes finished traces from a background thread; drops when backed up"""
+    def __init__(self, maxsize=1000):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, trace):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._export([trace.to_otlp() for trace in batch])
+            except Exception as e:
+                print(f"[TRACE] Export failed: {e}")
+
+    def _export(self, payloads):
+        if TRACE_FILE:
+            with open(TRACE_FILE, "a") as f:
+                for payload in payloads:
+                    f.write(json.dumps(payload) + "\n")
+        if TRACE_ENDPOINT:
+            merged = {"resourceSpans": [rs for payload in payloads for rs in payload["resourceSpans"]]}
+            request = urllib.request.Request(TRACE_ENDPOINT, data=json.dumps(merged).encode(),
+                                             headers={"Content-Type": "application/json"})
+            urllib.request.urlopen(request, timeout=5).close()
+
+
+_exporter = _Exporter()
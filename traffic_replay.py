@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Traffic Record & Replay for TermChat LT
+
+Record the inbound traffic of a broker, replay it into a local broker
+running the service, and compare two replays:
+
+    python traffic_replay.py record --host broker.emqx.io --out traffic.tcr --duration 600
+    python traffic_replay.py replay traffic.tcr --host localhost --speed 1 --out run_a.json
+    python traffic_replay.py replay traffic.tcr --host localhost --speed 0 --out run_b.json
+    python traffic_replay.py diff run_a.json run_b.json
+
+Recordings are a small header followed by one binary frame per message
+(time offset, topic, payload). --speed 1 keeps the recorded pacing, N
+plays it N times faster and 0 sends as fast as possible. Replayed
+messages get a "ref" so each reply can be matched to its request.
+
+Faster replays squeeze a user's messages closer together than the
+service's per-user cooldown, which would silently drop them. So at any
+speed other than 1, a message that would arrive too soon is sent as
+"<id>~<k>" instead. diff doesn't count those replies as changed.
+"""
+
+import argparse
+import json
+import os
+import struct
+import sys
+import threading
+import time
+
+import paho.mqtt.client as mqtt
+
+import wire_format
+from load_test import USER_COOLDOWN, LoadTester
+
+MAGIC = b"TCREC1\n"
+FRAME = struct.Struct("<dHI")  # seconds since start, topic length, payload length
+
+BROKER = os.getenv("MQTT_HOST", "localhost")
+PORT = int(os.getenv("MQTT_PORT", 1883))
+
+# What the service consumes; its own output topics are left out so a
+# replay doesn't feed replies back in
+INBOUND_TOPICS = ["termchat/input", "termchat/input/mp", "termchat/admin", "termchat/admin/mp",
+                  "termchat/room/+/input", "termchat/room/+/input/mp"]
+OUTPUT_TOPICS = ["termchat/output", "termchat/output/mp", "termchat/room/+/output", "termchat/room/+/output/mp"]
+
+
+def write_frame(f, offset, topic, payload):
+    topic = topic.encode("utf-8")
+    f.write(FRAME.pack(offset, len(topic), len(payload)))
+    f.write(topic)
+    f.write(payload)
+
+
+def read_frames(filename):
+    """Yield (offset seconds, topic, payload) from a recording"""
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a TermChat recording")
+        while True:
+            header = f.read(FRAME.size)
+            if len(header) < FRAME.size:
+                return
+            offset, topic_len, payload_len = FRAME.unpack(header)
+            topic = f.read(topic_len).decode("utf-8")
+            yield offset, topic, f.read(payload_len)
+
+
+def connect(host, port, client_id, on_message=None, topics=()):
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+    connected = threading.Event()
+
+    def on_connect(client, userdata, flags, rc, properties=None):
+        for topic in topics:
+            client.subscribe(topic)
+        connected.set()
+
+    client.on_connect = on_connect
+    if on_message:
+        client.on_message = on_message
+    client.connect(host, port, 60)
+    client.loop_start()
+    if not connected.wait(10):
+        raise RuntimeError(f"Could not connect to {host}:{port}")
+    return client
+
+
+# --- Record ---
+
+def record(args):
+    lock = threading.Lock()
+    count = 0
+    start = time.monotonic()
+    out = open(args.out, "wb")
+    out.write(MAGIC)
+
+    def on_message(client, userdata, message, properties=None):
+        nonlocal count
+        with lock:
+            write_frame(out, time.monotonic() - start, message.topic, message.payload)
+            count += 1
+
+    client = connect(args.host, args.port, f"termchat-recorder-{os.getpid()}", on_message,
+                     args.topics or INBOUND_TOPICS)
+    print(f"🎙️  Recording {args.host}:{args.port} to {args.out} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+            if args.duration and time.monotonic() - start >= args.duration:
+                break
+            if args.max_messages and count >= args.max_messages:
+                break
+    except KeyboardInterrupt:
+        pass
+    client.loop_stop()
+    client.disconnect()
+    with lock:
+        out.close()
+    print(f"✅ Recorded {count} messages in {time.monotonic() - start:.1f}s")
+
+
+# --- Replay ---
+
+def decode_frame(topic, payload):
+    """A recorded payload's fields, or None if it isn't a JSON/MessagePack object"""
+    _, wire = wire_format.split_topic(topic)
+    try:
+        data = wire_format.decode(payload, wire)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def tag_payload(topic, payload, ref, user=None):
+    """Add a correlation ref (and a replacement sender id) to a recorded payload; None if it has no fields"""
+    data = decode_frame(topic, payload)
+    if data is None:
+        return None
+    data["ref"] = ref
+    if user is not None:
+        data["id"] = user
+    return wire_format.encode(data, wire_format.split_topic(topic)[1])
+
+
+def alias_users(frames, speed, cooldown=USER_COOLDOWN + 0.1):
+    """{frame index: sender id} for messages that would break the per-user cooldown at this speed
+
+    Each gets the first "<id>~<k>" whose previous message is at least the
+    cooldown (plus a margin for send jitter) earlier in replay time.
+    """
+    aliases = {}
+    last_sent = {}  # sender id as replayed -> seconds into the replay
+    for i, (offset, topic, payload) in enumerate(frames):
+        base, _ = wire_format.split_topic(topic)
+        data = decode_frame(topic, payload)
+        if data is None or base == "termchat/admin":
+            continue  # Plain-text and admin messages aren't rate limited per user
+        user = str(data.get("id", "unknown"))
+        at = offset / speed if speed else 0.0
+        sender, k = user, 0
+        while sender in last_sent and at - last_sent[sender] < cooldown:
+            k += 1
+            sender = f"{user}~{k}"
+        last_sent[sender] = at
+        if sender != user:
+            aliases[i] = sender
+    return aliases
+
+
+def replay(args):
+    frames = list(read_frames(args.recording))
+    run_id = f"replay{os.getpid()}"
+    lock = threading.Lock()
+    pending = {}   # ref -> index
+    results = [{"index": i, "topic": topic, "offset": round(offset, 3), "latency_ms": None, "reply": None}
+               for i, (offset, topic, _) in enumerate(frames)]
+    aliases = alias_users(frames, args.speed) if args.speed != 1 else {}
+    for i, sender in aliases.items():
+        results[i]["sender"] = sender
+
+    def on_message(client, userdata, message, properties=None):
+        received = time.monotonic()
+        _, wire = wire_format.split_topic(message.topic)
+        try:
+            data = wire_format.decode(message.payload, wire)
+        except (ValueError, UnicodeDecodeError):
+            return
+        ref = data.get("ref") if isinstance(data, dict) else None
+        with lock:
+            index = pending.pop(ref, None)
+            if index is None:
+                return
+            entry = results[index]
+            entry["latency_ms"] = round((received - entry.pop("_sent")) * 1000, 2)
+            entry["reply"] = {"type": data.get("type"), "msg": data.get("msg")}
+
+    observer = connect(args.host, args.port, f"{run_id}-observer", on_message, OUTPUT_TOPICS)
+    sender = connect(args.host, args.port, f"{run_id}-sender")
+    speed = "max" if args.speed == 0 else f"{args.speed}x"
+    print(f"▶️  Replaying {len(frames)} messages into {args.host}:{args.port} at {speed}")
+    if aliases:
+        print(f"⚠️  {len(aliases)} messages would hit the {USER_COOLDOWN:.0f}s per-user rate limit at this speed; "
+              f"sending them under aliased ids")
+
+    start = time.monotonic()
+    for i, (offset, topic, payload) in enumerate(frames):
+        if args.speed:
+            delay = start + offset / args.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        ref = f"{run_id}-{i}"
+        tagged = tag_payload(topic, payload, ref, aliases.get(i))
+        with lock:
+            results[i]["_sent"] = time.monotonic()
+            if tagged is not None:
+                pending[ref] = i
+        sender.publish(topic, tagged if tagged is not None else payload)
+    elapsed = time.monotonic() - start
+
+    deadline = time.monotonic() + args.timeout
+    while pending and time.monotonic() < deadline:
+        time.sleep(0.1)
+    for client in (sender, observer):
+        client.loop_stop()
+        client.disconnect()
+
+    with lock:
+        for entry in results:
+            entry.pop("_sent", None)
+        latencies = sorted(e["latency_ms"] for e in results if e["latency_ms"] is not None)
+        expected = len(results) - sum(1 for offset, topic, payload in frames
+                                      if tag_payload(topic, payload, "") is None)
+        report = {
+            "recording": args.recording,
+            "speed": args.speed,
+            "sent": len(results),
+            "replies": len(latencies),
+            "dropped": len(pending),
+            "drop_rate": round(len(pending) / expected, 4) if expected else 0.0,
+            "duration_s": round(elapsed, 2),
+            "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            "latency_ms": LoadTester.summarize(latencies),
+            "messages": results,
+        }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+    print_summary(report)
+    print(f"💾 Results written to {args.out}")
+
+
+def print_summary(report):
+    lat = report["latency_ms"]
+    print(f"Sent {report['sent']}, replies {report['replies']}, dropped {report['dropped']} "
+          f"({report['drop_rate'] * 100:.2f}%), {report['throughput']} replies/s")
+    print(f"Latency ms: p50 {lat['p50']}  p95 {lat['p95']}  p99 {lat['p99']}  max {lat['max']}")
+
+
+# --- Diff ---
+
+def diff(args):
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)
+    if before["sent"] != after["sent"]:
+        print(f"⚠️  Runs replayed different recordings ({before['sent']} vs {after['sent']} messages)")
+
+    print(f"{'metric':<12} {'before':>10} {'after':>10} {'change':>10}")
+    rows = [("replies", before["replies"], after["replies"]),
+            ("drop_rate", before["drop_rate"], after["drop_rate"]),
+            ("throughput", before["throughput"], after["throughput"])]
+    rows += [(f"{pct} ms", before["latency_ms"][pct], after["latency_ms"][pct])
+             for pct in ("p50", "p95", "p99", "max")]
+    for name, old, new in rows:
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"{name:<12} {old:>10} {new:>10} {change:>10}")
+
+    lost, gained, changed, slower = [], [], [], []
+    renamed = 0
+    for old, new in zip(before["messages"], after["messages"]):
+        if old["reply"] and not new["reply"]:
+            lost.append(old)
+        elif new["reply"] and not old["reply"]:
+            gained.append(new)
+        elif old["reply"] and new["reply"]:
+            if old.get("sender") != new.get("sender"):
+                renamed += 1  # Another sender id (see alias_users), so another reply is expected
+            elif old["reply"] != new["reply"]:
+                changed.append((old, new))
+            if new["latency_ms"] > old["latency_ms"] * (1 + args.threshold) and \
+                    new["latency_ms"] - old["latency_ms"] > args.min_ms:
+                slower.append((old, new))
+
+    print(f"\nReplies lost: {len(lost)}, gained: {len(gained)}, changed: {len(changed)}, "
+          f"slower by >{args.threshold * 100:.0f}%: {len(slower)}")
+    if renamed:
+        print(f"  ({renamed} replies to messages sent under an aliased id not compared)")
+    for old, new in changed[:args.show]:
+        print(f"  #{old['index']} {old['topic']}: {old['reply']['msg']!r} -> {new['reply']['msg']!r}")
+    for old, new in sorted(slower, key=lambda p: p[0]["latency_ms"] - p[1]["latency_ms"])[:args.show]:
+        print(f"  #{old['index']} {old['topic']}: {old['latency_ms']}ms -> {new['latency_ms']}ms")
+    for entry in lost[:args.show]:
+        print(f"  #{entry['index']} {entry['topic']}: reply lost")
+    return 1 if lost else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Record and replay TermChat MQTT traffic")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    rec = commands.add_parser("record", help="Capture inbound termchat traffic")
+    rec.add_argument("--host", default=BROKER)
+    rec.add_argument("--port", type=int, default=PORT)
+    rec.add_argument("--out", default="traffic.tcr")
+    rec.add_argument("--duration", type=float, default=0, help="Seconds to record (0 = until Ctrl+C)")
+    rec.add_argument("--max-messages", type=int, default=0)
+    rec.add_argument("--topics", nargs="*", help="Topic filters (default: the service's inbound topics)")
+
+    rep = commands.add_parser("replay", help="Publish a recording and capture the replies")
+    rep.add_argument("recording")
+    rep.add_argument("--host", default=BROKER)
+    rep.add_argument("--port", type=int, default=PORT)
+    rep.add_argument("--speed", type=float, default=1.0, help="1 = recorded pace, N = N times faster, 0 = max")
+    rep.add_argument("--timeout", type=float, default=10, help="Seconds to wait for the last replies")
+    rep.add_argument("--out", default="replay_results.json")
+
+    dif = commands.add_parser("diff", help="Compare two replay results")
+    dif.add_argument("before")
+    dif.add_argument("after")
+    dif.add_argument("--threshold", type=float, default=0.5, help="Relative latency increase to report")
+    dif.add_argument("--min-ms", type=float, default=5, help="Ignore latency increases smaller than this")
+    dif.add_argument("--show", type=int, default=10, help="Examples to print per category")
+
+    args = parser.parse_args()
+    if args.command == "record":
+        record(args)
+    elif args.command == "replay":
+        replay(args)
+    else:
+        sys.exit(diff(args))
@@ -0,0 +1,85 @@
+"""Wire formats for TermChat MQTT payloads
+
+JSON stays the default. Clients opt in to the compact MessagePack encoding
+either by publishing to the topic with the "/mp" suffix (termchat/input/mp)
+or, on MQTT v5, by setting the content-type property. Replies are sent back
+in the same format on the matching suffixed topic.
+"""
+import json
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+TOPIC_SUFFIXES = {
+    MSGPACK: "/mp",
+}
+
+CONTENT_TYPES = {
+    JSON: "application/json",
+    MSGPACK: "application/msgpack",
+}
+
+_FORMAT_BY_CONTENT_TYPE = {
+    "application/json": JSON,
+    "application/msgpack": MSGPACK,
+    "application/x-msgpack": MSGPACK,
+    "application/vnd.msgpack": MSGPACK,
+}
+
+
+def split_topic(topic):
+    """Split a topic into (base_topic, wire_format) using its suffix"""
+    for fmt, suffix in TOPIC_SUFFIXES.items():
+        if topic.endswith(suffix):
+            return topic[:-len(suffix)], fmt
+    return topic, JSON
+
+
+def topic_for(base_topic, fmt=JSON):
+    """Topic a payload in the given format should be published to"""
+    return base_topic + TOPIC_SUFFIXES.get(fmt, "")
+
+
+def detect_format(message):
+    """Return (base_topic, wire_format) for an incoming paho message
+
+    An MQTT v5 content-type property wins over the topic suffix.
+    """
+    base_topic, fmt = split_topic(message.topic)
+    properties = getattr(message, "properties", None)
+    content_type = getattr(properties, "ContentType", None) if properties else None
+    if content_type:
+        fmt = _FORMAT_BY_CONTENT_TYPE.get(content_type.split(";")[0].strip().lower(), fmt)
+    return base_topic, fmt
+
+
+def encode(data, fmt=JSON):
+    """Serialise a message for the wire"""
+    if fmt == MSGPACK:
+        if not MSGPACK_AVAILABLE:
+            raise ValueError("msgpack not installed")
+        return msgpack.packb(data, use_bin_type=True)
+    return json.dumps(data)
+
+
+def decode(payload, fmt=JSON):
+    """Parse a wire payload (bytes) into a Python object
+
+    Raises ValueError if the payload is not valid in the given format.
+    """
+    if fmt == MSGPACK:
+        if not MSGPACK_AVAILABLE:
+            raise ValueError("msgpack not installed")
+        try:
+            return msgpack.unpackb(payload, raw=False)
+        except Exception as e:
+            raise ValueError(f"Invalid msgpack payload: {e}")
+    if isinstance(payload, bytes):
+        payload = payload.decode()
+    return json.loads(payload)